@@ -0,0 +1,259 @@
+"""
+Running statistics per location x month x hour-of-day (UTC), kept up to date by
+the loader, and an anomaly score for every row it loads.
+
+"<schema>".weather_stats holds, for each metric in STATS_METRICS, the count,
+mean, sum of squared deviations (m2, Welford), min and max of every reading
+loaded so far. A load folds its batch in with the parallel form of Welford's
+update (Chan et al.), which Postgres applies in the upsert, so the cost is
+O(rows loaded) however long the history is and concurrent loads cannot lose
+each other's updates.
+
+The statistics describe the rows stored in formatted_weather_data: the loader
+folds in only the rows it inserts, and where a newer run or a spool revision
+replaces rows (db.py), the slots they fall in are recomputed from the table
+(rebuild_slots), since a Welford state cannot take a reading back out exactly
+(min and max least of all).
+
+A row's anomaly_score is the largest |z| over those metrics, against the
+statistics from before its own file was loaded; NaN until a slot has
+ANOMALY_MIN_SAMPLES readings. Rows above ANOMALY_THRESHOLD are counted and logged.
+
+Rows loaded before the table existed (or by synthetic.py) are not in it;
+`python anomaly.py rebuild` recomputes it from formatted_weather_data once.
+"""
+import argparse
+import os
+import numpy as np
+import psycopg2
+import pandas as pd
+from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+from metrics import incr, span
+
+load_dotenv()
+
+ANOMALY_MIN_SAMPLES = int(os.getenv("ANOMALY_MIN_SAMPLES", "10"))
+ANOMALY_THRESHOLD = float(os.getenv("ANOMALY_THRESHOLD", "4"))
+ANOMALY_COLUMN = "anomaly_score"
+
+# Metric (weather_stats.metric) -> CSV column. Wind direction is circular and left out.
+STATS_METRICS = {
+    "temp_f": "temperature (°F)",
+    "cloud_cover_perc": "cloud cover (%)",
+    "surface_pressure": "surface pressure (hPa)",
+    "wind_speed_80m_mph": "wind speed (80m elevation) (mph)",
+}
+SLOT = ["location_id", "month", "hour"]
+
+
+def stats_table(schema):
+    return f'"{schema}".weather_stats'
+
+
+def ensure_table(cursor, schema="WeatherData"):
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {stats_table(schema)} (
+            location_id text             not null,
+            month       smallint         not null,
+            hour        smallint         not null,
+            metric      text             not null,
+            n           bigint           not null,
+            mean        double precision not null,
+            m2          double precision not null,
+            min         double precision not null,
+            max         double precision not null,
+            primary key (location_id, month, hour, metric)
+        );
+    """)
+
+
+def slots(df):
+    """(location_id, month, hour) of every row, as a DataFrame aligned with `df`."""
+    times = pd.to_datetime(df["time"], utc=True)
+    return pd.DataFrame({
+        "location_id": df["location_id"].to_numpy(),
+        "month": times.dt.month.to_numpy(dtype=np.int16),
+        "hour": times.dt.hour.to_numpy(dtype=np.int16),
+    })
+
+
+def batch_stats(df):
+    """
+    Count, mean, m2, min and max of each metric per slot of `df`, one row per
+    (location_id, month, hour, metric). NaN readings are left out.
+    """
+    keyed = slots(df)
+    for metric, column in STATS_METRICS.items():
+        keyed[metric] = pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=np.float64)
+    grouped = keyed.groupby(SLOT, sort=False)
+    count, mean, var = grouped.count(), grouped.mean(), grouped.var(ddof=0)
+    low, high = grouped.min(), grouped.max()
+
+    frames = []
+    for metric in STATS_METRICS:
+        frames.append(pd.DataFrame({
+            "metric": metric,
+            "n": count[metric],
+            "mean": mean[metric],
+            "m2": var[metric] * count[metric],  # n * population variance
+            "min": low[metric],
+            "max": high[metric],
+        }))
+    long = pd.concat(frames).reset_index()
+    return long[long["n"] > 0].reset_index(drop=True)
+
+
+def load_stats(cursor, df, schema="WeatherData"):
+    """
+    Current statistics of the slots `df` touches, locked until the transaction
+    ends: {metric: DataFrame indexed by slot with n, mean, std}.
+    """
+    cursor.execute(
+        f"SELECT location_id, month, hour, metric, n, mean, m2 FROM {stats_table(schema)} "
+        f"WHERE location_id = ANY(%s) AND month = ANY(%s) FOR UPDATE;",
+        (list(df["location_id"].unique()), [int(m) for m in slots(df)["month"].unique()]),
+    )
+    rows = pd.DataFrame(cursor.fetchall(), columns=SLOT + ["metric", "n", "mean", "m2"])
+    rows["std"] = np.sqrt(rows["m2"].astype(float) / rows["n"].where(rows["n"] > 0))
+    rows["month"] = rows["month"].astype(np.int16)
+    rows["hour"] = rows["hour"].astype(np.int16)
+    return {metric: group.set_index(SLOT)[["n", "mean", "std"]] for metric, group in rows.groupby("metric")}
+
+
+def anomaly_scores(df, stats, min_samples=ANOMALY_MIN_SAMPLES):
+    """Largest |z| over STATS_METRICS per row of `df`, from `stats` as returned by load_stats."""
+    keys = pd.MultiIndex.from_frame(slots(df))
+    scores = np.full(len(df), np.nan)
+    for metric, column in STATS_METRICS.items():
+        if metric not in stats:
+            continue
+        slot = stats[metric].reindex(keys)
+        usable = (slot["n"].to_numpy() >= min_samples) & (slot["std"].to_numpy() > 0)
+        values = pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            z = np.abs(values - slot["mean"].to_numpy()) / slot["std"].to_numpy()
+        scores = np.fmax(scores, np.where(usable, z, np.nan))
+    return scores
+
+
+def update_stats(cursor, df, schema="WeatherData"):
+    """Folds `df`'s readings into weather_stats. Does not commit."""
+    batch = batch_stats(df)
+    if batch.empty:
+        return
+    rows = [
+        (r.location_id, int(r.month), int(r.hour), r.metric, int(r.n), float(r.mean), float(r.m2),
+         float(r.min), float(r.max))
+        for r in batch.itertuples(index=False)
+    ]
+    # Chan et al.: combine (n_a, mean_a, m2_a) with (n_b, mean_b, m2_b); SET sees the old row as s
+    execute_values(cursor, f"""
+        INSERT INTO {stats_table(schema)} AS s (location_id, month, hour, metric, n, mean, m2, min, max)
+        VALUES %s
+        ON CONFLICT (location_id, month, hour, metric) DO UPDATE SET
+            n    = s.n + EXCLUDED.n,
+            mean = s.mean + (EXCLUDED.mean - s.mean) * EXCLUDED.n::float8 / (s.n + EXCLUDED.n),
+            m2   = s.m2 + EXCLUDED.m2
+                   + (EXCLUDED.mean - s.mean) ^ 2 * s.n::float8 * EXCLUDED.n / (s.n + EXCLUDED.n),
+            min  = LEAST(s.min, EXCLUDED.min),
+            max  = GREATEST(s.max, EXCLUDED.max);
+    """, rows, page_size=1000)
+
+
+def score_rows(cursor, df, filename, schema="WeatherData"):
+    """
+    Returns `df` with an anomaly_score column, scored against the current
+    statistics (locked until the caller's transaction ends).
+    """
+    with span("anomaly", file=filename, rows=len(df)):
+        ensure_table(cursor, schema)
+        out = df.copy()
+        out[ANOMALY_COLUMN] = anomaly_scores(df, load_stats(cursor, df, schema)) if len(df) else []
+
+    anomalous = int((out[ANOMALY_COLUMN] > ANOMALY_THRESHOLD).sum())
+    if anomalous:
+        incr("rows_anomalous", anomalous)
+        print(f"{anomalous} rows of {filename} are more than {ANOMALY_THRESHOLD} standard deviations "
+              f"from their location/month/hour mean.")
+    return out
+
+
+def score_and_update(cursor, df, filename, schema="WeatherData"):
+    """
+    Returns `df` with an anomaly_score column and folds its readings into the
+    running statistics, in the caller's transaction (does not commit).
+    """
+    out = score_rows(cursor, df, filename, schema)
+    update_stats(cursor, df, schema)
+    return out
+
+
+def _aggregate_sql(schema, where="TRUE"):
+    """INSERT of the statistics of every slot of formatted_weather_data matching `where`."""
+    values = ", ".join(f"('{metric}', {metric})" for metric in STATS_METRICS)
+    return f"""
+        INSERT INTO {stats_table(schema)} (location_id, month, hour, metric, n, mean, m2, min, max)
+        SELECT location_id,
+               EXTRACT(MONTH FROM time AT TIME ZONE 'UTC'),
+               EXTRACT(HOUR FROM time AT TIME ZONE 'UTC'),
+               m.metric, COUNT(*), AVG(m.value), VAR_POP(m.value) * COUNT(*), MIN(m.value), MAX(m.value)
+        FROM "{schema}".formatted_weather_data
+        CROSS JOIN LATERAL (VALUES {values}) AS m (metric, value)
+        WHERE m.value IS NOT NULL AND m.value <> 'NaN' AND ({where})
+        GROUP BY 1, 2, 3, 4;
+    """
+
+
+def rebuild_slots(cursor, df, schema="WeatherData"):
+    """
+    Recomputes the statistics of the slots `df`'s rows fall in from
+    formatted_weather_data, e.g. after rows there were replaced. Does not commit.
+    """
+    if df.empty:
+        return
+    keys = slots(df).drop_duplicates()
+    params = (keys["location_id"].tolist(), [int(m) for m in keys["month"]], [int(h) for h in keys["hour"]])
+    slot_filter = "(location_id, month, hour) IN (SELECT * FROM unnest(%s::text[], %s::int[], %s::int[]))"
+    ensure_table(cursor, schema)
+    cursor.execute(f"DELETE FROM {stats_table(schema)} WHERE {slot_filter};", params)
+    where = "location_id = ANY(%s) AND " + slot_filter.replace(
+        "(location_id, month, hour)",
+        "(location_id, EXTRACT(MONTH FROM time AT TIME ZONE 'UTC')::int, EXTRACT(HOUR FROM time AT TIME ZONE 'UTC')::int)",
+    )
+    cursor.execute(_aggregate_sql(schema, where), (sorted(set(params[0])), *params))
+
+
+def rebuild_stats(conn, schema="WeatherData"):
+    """Recomputes weather_stats from every row in formatted_weather_data (one full scan) and commits."""
+    cursor = conn.cursor()
+    try:
+        ensure_table(cursor, schema)
+        cursor.execute(f"TRUNCATE {stats_table(schema)};")
+        cursor.execute(_aggregate_sql(schema))
+        rows = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    print(f"Rebuilt {rows} statistics rows in {stats_table(schema)}.")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Running statistics behind the anomaly scores.")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--schema", default="WeatherData")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.getenv("DB_URL"))
+    try:
+        rebuild_stats(conn, args.schema)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
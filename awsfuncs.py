@@ -1,31 +1,169 @@
 import os
+import threading
+import time
 import boto3
 from dotenv import load_dotenv
 from botocore.exceptions import BotoCoreError, ClientError
+from metrics import incr, span
 
 load_dotenv()
 
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class S3CallStats:
+    """
+    Per-operation S3 request accounting fed by botocore event hooks: call count,
+    errors, retries, bytes sent/received and a latency histogram.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.ops = {}
+
+    def _op(self, name):
+        op = self.ops.get(name)
+        if op is None:
+            op = self.ops[name] = {
+                "calls": 0,
+                "errors": 0,
+                "retries": 0,
+                "bytes_sent": 0,
+                "bytes_received": 0,
+                "total_ms": 0.0,
+                "histogram": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+            }
+        return op
+
+    def _before_call(self, model, context, **kwargs):
+        context["meteo_start"] = time.perf_counter()
+        context["meteo_op"] = model.name
+
+    def _before_send(self, request, event_name, **kwargs):
+        # Fires once per attempt, so retried uploads count every byte actually sent.
+        # Chunked uploads with trailing checksums carry the payload size in a separate header.
+        headers = request.headers
+        sent = int(headers.get("x-amz-decoded-content-length") or headers.get("Content-Length") or 0)
+        if sent:
+            with self._lock:
+                self._op(event_name.rsplit(".", 1)[-1])["bytes_sent"] += sent
+
+    def _after_call(self, http_response, parsed, model, context, **kwargs):
+        self._record(model.name, context, parsed, http_response)
+
+    def _after_call_error(self, context=None, exception=None, event_name="", **kwargs):
+        # Fired when no response came back (connection, endpoint or timeout errors), with
+        # only the exception and the request context
+        context = context if context is not None else {}
+        self._record(context.get("meteo_op") or event_name.rsplit(".", 1)[-1], context, None, None)
+
+    def _record(self, name, context, parsed, http_response):
+        elapsed_ms = (time.perf_counter() - context.get("meteo_start", time.perf_counter())) * 1000
+        meta = (parsed or {}).get("ResponseMetadata", {})
+        received = 0
+        if http_response is not None and name != "HeadObject":
+            received = int(http_response.headers.get("Content-Length") or 0)
+        # 304 Not Modified answers a conditional GET (lakecache.py) and is not a failure
+        not_modified = http_response is not None and http_response.status_code == 304
+        error = not not_modified and (parsed is None or "Error" in parsed or http_response.status_code >= 400)
+
+        bucket = next((i for i, ub in enumerate(LATENCY_BUCKETS_MS) if elapsed_ms <= ub), len(LATENCY_BUCKETS_MS))
+        with self._lock:
+            op = self._op(name)
+            op["calls"] += 1
+            op["errors"] += int(error)
+            op["retries"] += meta.get("RetryAttempts", 0)
+            op["bytes_received"] += received
+            op["total_ms"] += elapsed_ms
+            op["histogram"][bucket] += 1
+        incr("s3_requests", op=name)
+
+    def report(self) -> dict:
+        """{operation: {calls, errors, retries, bytes_sent, bytes_received, avg_ms, histogram}}."""
+        labels = [f"<={ub}ms" for ub in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        with self._lock:
+            return {
+                name: {
+                    "calls": op["calls"],
+                    "errors": op["errors"],
+                    "retries": op["retries"],
+                    "bytes_sent": op["bytes_sent"],
+                    "bytes_received": op["bytes_received"],
+                    "avg_ms": round(op["total_ms"] / op["calls"], 2) if op["calls"] else 0.0,
+                    "histogram": {l: n for l, n in zip(labels, op["histogram"]) if n},
+                }
+                for name, op in sorted(self.ops.items())
+            }
+
+    def calls(self) -> dict:
+        """{operation: call count}, handy for asserting a request budget."""
+        with self._lock:
+            return {name: op["calls"] for name, op in self.ops.items()}
+
+    def print_report(self):
+        rows = self.report()
+        if not rows:
+            print("No S3 calls recorded.")
+            return
+        print(f"{'operation':<24}{'calls':>7}{'errors':>8}{'retries':>9}{'sent B':>10}{'recv B':>10}{'avg ms':>9}")
+        for name, r in rows.items():
+            print(
+                f"{name:<24}{r['calls']:>7}{r['errors']:>8}{r['retries']:>9}"
+                f"{r['bytes_sent']:>10}{r['bytes_received']:>10}{r['avg_ms']:>9.2f}"
+            )
+
+
+# Shared by every client made through get_s3_client(); reset between runs
+S3_CALLS = S3CallStats()
+
+
+def instrument_client(client, stats=None):
+    """Registers the accounting hooks on an existing S3 client and returns it."""
+    stats = stats or S3_CALLS
+    events = client.meta.events
+    tag = f"meteo-{id(stats)}"
+    events.register("before-call.s3", stats._before_call, unique_id=f"{tag}-before-call")
+    events.register("before-send.s3", stats._before_send, unique_id=f"{tag}-before-send")
+    events.register("after-call.s3", stats._after_call, unique_id=f"{tag}-after-call")
+    events.register("after-call-error.s3", stats._after_call_error, unique_id=f"{tag}-after-call-error")
+    return client
+
+
 def get_s3_client():
-    """Returns an S3 client using credentials from environment variables."""
-    return boto3.client(
+    """Returns an S3 client using credentials from environment variables, with call accounting hooks."""
+    client = boto3.client(
         "s3",
         region_name=os.getenv("AWS_REGION"),
         aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
         aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
     )
+    return instrument_client(client)
+
+def list_files(bucket, s3=None, include_compacted=False):
+    """
+    Lists all file names in the given S3 bucket and returns them.
 
-def list_files(bucket, s3=None):
-    """Lists all file names in the given S3 bucket and returns them."""
+    With `include_compacted`, days that lake.py has merged into monthly objects
+    are listed under their original weather_<date>.csv names as well.
+    """
     if s3 is None:
         s3 = get_s3_client()
 
-    response = s3.list_objects_v2(Bucket=bucket)
-    if "Contents" in response:
-        keys = [obj["Key"] for obj in response["Contents"]]
-        return keys
-    else:
+    keys = []
+    with span("s3_list", bucket=bucket):
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
+    if include_compacted:
+        from lake import compacted_files, read_manifest
+        keys.extend(compacted_files(read_manifest(bucket, s3)))
+    if not keys:
         print("Bucket is empty or doesn't exist.")
-        return []
+    return keys
 
 def file_exists_in_s3(bucket_name, key, s3_client=None):
     """Checks if a file exists in S3 using provided client."""
@@ -36,7 +174,8 @@ def file_exists_in_s3(bucket_name, key, s3_client=None):
             return False
         if bucket_name is None:
             bucket_name = os.getenv("BUCKET_NAME")
-        s3_client.head_object(Bucket=bucket_name, Key=key)
+        with span("s3_head"):
+            s3_client.head_object(Bucket=bucket_name, Key=key)
         return True
     except ClientError as e:
         if e.response['Error']['Code'] == '404':
@@ -61,7 +200,10 @@ def upload_file(bucket, filepath, key, s3_client=None):
             return
 
         print(f"Uploading {filepath} to s3://{key}")
-        s3_client.upload_file(filepath, bucket, key)
+        size = os.path.getsize(filepath)
+        with span("s3_put", key=key):
+            s3_client.upload_file(filepath, bucket, key)
+        incr("bytes_uploaded", size)
         print(f"upload successful: {filepath} -> s3://{key}")
         os.remove(filepath)
         print(f"Deleted local file: {filepath}")
@@ -0,0 +1,31 @@
+import pytest
+from db import LOAD_STRATEGIES, insert_weather_rows
+from benchmarks.sample_data import BENCH_SCHEMA, SIZES, make_weather_df, size_id
+
+
+@pytest.mark.parametrize("strategy", LOAD_STRATEGIES)
+@pytest.mark.parametrize("size", SIZES, ids=size_id)
+def test_db_load(benchmark, bench_conn, size, strategy):
+    if strategy == "row" and size[0] * size[1] > 5000:
+        pytest.skip("per-row inserts are too slow at this size")
+    df = make_weather_df(*size)
+
+    def truncate():
+        cur = bench_conn.cursor()
+        cur.execute(f'TRUNCATE "{BENCH_SCHEMA}".formatted_weather_data;')
+        bench_conn.commit()
+        cur.close()
+
+    def load():
+        cur = bench_conn.cursor()
+        insert_weather_rows(cur, df, "weather_bench.csv", BENCH_SCHEMA, strategy)
+        bench_conn.commit()
+        cur.close()
+
+    benchmark.pedantic(load, setup=truncate, rounds=5, iterations=1)
+
+    cur = bench_conn.cursor()
+    cur.execute(f'SELECT COUNT(*) FROM "{BENCH_SCHEMA}".formatted_weather_data;')
+    assert cur.fetchone()[0] == len(df)
+    cur.close()
+    benchmark.extra_info["rows"] = len(df)
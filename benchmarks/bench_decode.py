@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from weathercalls import responses_to_dataframe
+from benchmarks.sample_data import SIZES, size_id
+
+
+class FakeVariable:
+    def __init__(self, values):
+        self.values = values
+
+    def ValuesAsNumpy(self):
+        return self.values
+
+
+class FakeHourly:
+    """Same accessors as openmeteo_sdk's VariablesWithTime for hourly data."""
+
+    def __init__(self, hours, variables=5, start=1735689600):
+        rng = np.random.default_rng(hours)
+        self.start = start
+        self.hours = hours
+        self.variables = [FakeVariable(rng.normal(size=hours).astype("float32")) for _ in range(variables)]
+
+    def Time(self):
+        return self.start
+
+    def TimeEnd(self):
+        return self.start + self.hours * 3600
+
+    def Interval(self):
+        return 3600
+
+    def Variables(self, i):
+        return self.variables[i]
+
+
+class FakeResponse:
+    def __init__(self, hours):
+        self.hourly = FakeHourly(hours)
+
+    def Hourly(self):
+        return self.hourly
+
+
+@pytest.mark.parametrize("size", SIZES, ids=size_id)
+def test_decode_responses(benchmark, size):
+    hours, n_locations = size
+    locations = [{"location_id": f"LOC{i:03d}"} for i in range(n_locations)]
+    responses = [FakeResponse(hours) for _ in range(n_locations)]
+
+    df = benchmark(responses_to_dataframe, responses, locations)
+
+    assert len(df) == hours * n_locations
@@ -0,0 +1,42 @@
+from io import BytesIO
+import pandas as pd
+import pytest
+from benchmarks.sample_data import SIZES, make_weather_df, size_id
+
+pytest.importorskip("pyarrow")
+
+
+def encode(df, fmt):
+    buf = BytesIO()
+    if fmt == "csv":
+        df.to_csv(buf, index=False)
+    else:
+        df.to_parquet(buf, index=False)
+    return buf.getvalue()
+
+
+def decode(data, fmt):
+    if fmt == "csv":
+        return pd.read_csv(BytesIO(data))
+    return pd.read_parquet(BytesIO(data))
+
+
+@pytest.mark.parametrize("fmt", ["csv", "parquet"])
+@pytest.mark.parametrize("size", SIZES, ids=size_id)
+def test_encode(benchmark, size, fmt):
+    df = make_weather_df(*size)
+
+    data = benchmark(encode, df, fmt)
+
+    benchmark.extra_info["bytes"] = len(data)
+
+
+@pytest.mark.parametrize("fmt", ["csv", "parquet"])
+@pytest.mark.parametrize("size", SIZES, ids=size_id)
+def test_decode(benchmark, size, fmt):
+    df = make_weather_df(*size)
+    data = encode(df, fmt)
+
+    out = benchmark(decode, data, fmt)
+
+    assert len(out) == len(df)
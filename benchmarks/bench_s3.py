@@ -0,0 +1,31 @@
+import pytest
+from benchmarks.sample_data import SIZES, make_weather_df, size_id
+
+
+@pytest.mark.parametrize("size", SIZES, ids=size_id)
+def test_s3_put(benchmark, moto_s3, size):
+    client, bucket = moto_s3
+    body = make_weather_df(*size).to_csv(index=False).encode()
+
+    benchmark(client.put_object, Bucket=bucket, Key="weather_bench.csv", Body=body)
+
+    benchmark.extra_info["bytes"] = len(body)
+
+
+@pytest.mark.parametrize("size", SIZES, ids=size_id)
+def test_s3_get(benchmark, moto_s3, size):
+    client, bucket = moto_s3
+    body = make_weather_df(*size).to_csv(index=False).encode()
+    client.put_object(Bucket=bucket, Key="weather_bench.csv", Body=body)
+
+    def get():
+        return client.get_object(Bucket=bucket, Key="weather_bench.csv")["Body"].read()
+
+    assert len(benchmark(get)) == len(body)
+
+
+def test_s3_head(benchmark, moto_s3):
+    client, bucket = moto_s3
+    client.put_object(Bucket=bucket, Key="weather_bench.csv", Body=b"x")
+
+    benchmark(client.head_object, Bucket=bucket, Key="weather_bench.csv")
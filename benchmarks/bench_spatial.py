@@ -0,0 +1,18 @@
+import numpy as np
+from spatial import SpatialIndex
+from weathercalls import grid_points
+
+
+def test_nearest_grid_cell(benchmark):
+    cells = grid_points()  # ~10k cells over North Carolina
+    index = SpatialIndex(cells["latitude"], cells["longitude"])
+    queries = iter(np.random.default_rng(0).uniform((33.8, -84.35), (36.6, -75.45), (1_000_000, 2)))
+
+    def lookup():
+        lat, lon = next(queries)
+        return index.nearest(lat, lon)
+
+    position, km = benchmark(lookup)
+
+    assert km < 5
+    benchmark.extra_info["points"] = len(index)
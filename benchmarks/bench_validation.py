@@ -0,0 +1,14 @@
+import pytest
+from lake import decode_weather_csv
+from validation import validate
+from benchmarks.sample_data import SIZES, make_weather_df, size_id
+
+
+@pytest.mark.parametrize("size", SIZES, ids=size_id)
+def test_validate(benchmark, size):
+    df = decode_weather_csv(make_weather_df(*size).to_csv(index=False).encode())
+
+    valid, rejected, _ = benchmark(validate, df)
+
+    assert rejected.empty
+    benchmark.extra_info["rows"] = len(df)
@@ -0,0 +1,31 @@
+import psycopg2
+import pytest
+from benchmarks.sample_data import BENCH_SCHEMA, connect, create_weather_table
+
+
+@pytest.fixture(scope="session")
+def bench_conn():
+    try:
+        conn = connect()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"Postgres not available: {e}")
+    create_weather_table(conn, BENCH_SCHEMA)
+
+    yield conn
+
+    cur = conn.cursor()
+    cur.execute(f'DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE;')
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+@pytest.fixture
+def moto_s3():
+    """An in-process S3 stand-in with one bucket: (client, bucket)."""
+    moto = pytest.importorskip("moto")
+    import boto3
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="bench-bucket")
+        yield client, "bench-bucket"
@@ -0,0 +1,189 @@
+"""
+Headless load test for the dashboard: N concurrent sessions, each rerunning
+streamlit_app.py like autorefresh ticks, in one process (so st.cache_* and the
+TimeSeriesStore are shared the way they are in one container).
+
+    python -m benchmarks.load_test --sessions 20 --ticks 10
+    python -m benchmarks.load_test --sessions 50 --tick-interval 5 --fake-redis --output load.json
+
+The app reads DB_URL (default: built from the POSTGRES_* variables) and the
+REDIS_* variables. --fake-redis swaps Redis for an in-process fakeredis server.
+--db-url overrides DB_URL for the app. --seed DAYS drops and recreates
+"WeatherData".formatted_weather_data at --db-url and fills it with synthetic data
+for the three dashboard cities, so only use it on a scratch DB; it needs an
+explicit --db-url and never falls back to DB_URL.
+
+Reports p50/p95/p99 latency of first runs and of reruns, DB connections opened,
+and resident memory added per session.
+"""
+import argparse
+import json
+import os
+import resource
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import psycopg2
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit_app.py")
+CITIES = ["Charlotte", "Raleigh", "Greensboro"]
+
+
+class ConnectionCounter:
+    """Wraps psycopg2.connect to count connections opened by the app."""
+
+    def __init__(self):
+        self.opened = 0
+        self._lock = threading.Lock()
+        self._connect = psycopg2.connect
+
+    def install(self):
+        def connect(*args, **kwargs):
+            with self._lock:
+                self.opened += 1
+            return self._connect(*args, **kwargs)
+        psycopg2.connect = connect
+
+    def uninstall(self):
+        psycopg2.connect = self._connect
+
+
+def rss_bytes():
+    """Current resident set size (Linux), else peak RSS."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"count": len(samples), "p50_ms": round(p50, 1), "p95_ms": round(p95, 1),
+            "p99_ms": round(p99, 1), "max_ms": round(max(samples), 1)}
+
+
+def seed_database(db_url, days):
+    from benchmarks.sample_data import create_weather_table
+    from synthetic import copy_frames, generate
+
+    def frames():
+        for city, df in zip(CITIES, generate(len(CITIES), days / 365)):
+            df["location_id"] = city
+            yield df
+
+    conn = psycopg2.connect(db_url)
+    try:
+        create_weather_table(conn, "WeatherData")
+        rows = copy_frames(conn, frames(), "WeatherData")
+    finally:
+        conn.close()
+    print(f"Seeded {rows} rows for {', '.join(CITIES)}")
+
+
+def use_fake_redis():
+    import fakeredis
+    import redis
+    import ratelimit
+    ratelimit._pool = redis.ConnectionPool(connection_class=fakeredis.FakeConnection, server=fakeredis.FakeServer())
+
+
+def run_session(ticks, tick_interval, timeout, click_refresh):
+    """One simulated viewer: a first run, then `ticks` reruns. Returns (session, [ms, ...])."""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    latencies = []
+    for tick in range(ticks + 1):
+        if tick and tick_interval:
+            time.sleep(tick_interval)
+        start = time.perf_counter()
+        if tick == 1 and click_refresh and at.button:
+            at.button[0].click().run()
+        else:
+            at.run()
+        latencies.append((time.perf_counter() - start) * 1000)
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+    return at, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for the dashboard.")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--ticks", type=int, default=5, help="reruns per session after the first run")
+    parser.add_argument("--tick-interval", type=float, default=0.0,
+                        help="seconds between reruns (the app's autorefresh is 5)")
+    parser.add_argument("--click-refresh", action="store_true", help="press Refresh on each session's first rerun")
+    parser.add_argument("--fake-redis", action="store_true")
+    parser.add_argument("--db-url", help="database the app reads (default: DB_URL)")
+    parser.add_argument("--seed", type=int, metavar="DAYS",
+                        help="reset WeatherData at --db-url and load DAYS of synthetic data")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-run timeout in seconds")
+    parser.add_argument("--output", help="write results as JSON here")
+    args = parser.parse_args()
+    if args.seed and not args.db_url:
+        parser.error("--seed drops tables, so it needs an explicit --db-url (DB_URL is not used for it)")
+
+    if args.db_url:
+        os.environ["DB_URL"] = args.db_url
+    elif not os.getenv("DB_URL"):
+        os.environ["DB_URL"] = (
+            f"postgresql://{os.getenv('POSTGRES_USER', 'postgres')}:{os.getenv('POSTGRES_PASSWORD', 'postgres')}"
+            f"@{os.getenv('POSTGRES_HOST', 'localhost')}:{os.getenv('POSTGRES_PORT', '5432')}"
+            f"/{os.getenv('POSTGRES_DB', 'postgres')}"
+        )
+    if args.seed:
+        seed_database(args.db_url, args.seed)
+    if args.fake_redis:
+        use_fake_redis()
+
+    counter = ConnectionCounter()
+    counter.install()
+    try:
+        # One warm-up session so imports and process-wide caches are not billed to the sessions
+        _, warmup = run_session(0, 0, args.timeout, False)
+        connections_warm = counter.opened
+        rss_before = rss_bytes()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+            futures = [
+                pool.submit(run_session, args.ticks, args.tick_interval, args.timeout, args.click_refresh)
+                for _ in range(args.sessions)
+            ]
+            results = [f.result() for f in futures]
+        wall = time.perf_counter() - start
+        rss_after = rss_bytes()
+    finally:
+        counter.uninstall()
+
+    first = [lat[0] for _, lat in results]
+    reruns = [ms for _, lat in results for ms in lat[1:]]
+    report = {
+        "sessions": args.sessions,
+        "ticks": args.ticks,
+        "tick_interval_s": args.tick_interval,
+        "wall_s": round(wall, 2),
+        "warmup_ms": round(warmup[0], 1),
+        "first_run": percentiles(first),
+        "rerun": percentiles(reruns),
+        "db_connections": {
+            "warmup": connections_warm,
+            "sessions": counter.opened - connections_warm,
+            "per_run": round((counter.opened - connections_warm) / (len(first) + len(reruns)), 3),
+        },
+        "memory_per_session_kib": round((rss_after - rss_before) / args.sessions / 1024, 1),
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
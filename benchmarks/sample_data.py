@@ -0,0 +1,67 @@
+import os
+import numpy as np
+import pandas as pd
+import psycopg2
+from dotenv import load_dotenv
+load_dotenv()
+
+BENCH_SCHEMA = "aq_bench"
+
+# (hours per location, locations): a day for the 3 cities up to a month for 30 locations
+SIZES = [(24, 3), (720, 3), (720, 30)]
+
+
+def size_id(size):
+    hours, locations = size
+    return f"{hours}h-x{locations}loc"
+
+
+def make_weather_df(hours, locations, seed=0):
+    """A CSV-shaped frame like weathercalls writes: `hours` hourly rows per location."""
+    rng = np.random.default_rng(seed)
+    n = hours * locations
+    times = pd.date_range("2025-01-01", periods=hours, freq="h", tz="UTC")
+    return pd.DataFrame({
+        "location_id": np.repeat([f"LOC{i:03d}" for i in range(locations)], hours),
+        "time": np.tile(times, locations),
+        "temperature (°F)": rng.normal(60, 15, n).astype("float32"),
+        "cloud cover (%)": rng.uniform(0, 100, n).astype("float32"),
+        "surface pressure (hPa)": rng.normal(1013, 8, n).astype("float32"),
+        "wind speed (80m elevation) (mph)": rng.gamma(2, 4, n).astype("float32"),
+        "wind direction (80m elevation) (°)": rng.uniform(0, 360, n).astype("float32"),
+    })
+
+
+def connect():
+    """Connects to the same Postgres as the tests (POSTGRES_* variables)."""
+    return psycopg2.connect(
+        host=os.getenv("POSTGRES_HOST", "localhost"),
+        port=os.getenv("POSTGRES_PORT", "5432"),
+        user=os.getenv("POSTGRES_USER", "postgres"),
+        password=os.getenv("POSTGRES_PASSWORD", "postgres"),
+        dbname=os.getenv("POSTGRES_DB", "postgres"),
+        connect_timeout=3,
+    )
+
+
+def create_weather_table(conn, schema):
+    """(Re)creates an empty formatted_weather_data in `schema`, same DDL as the test schema."""
+    cur = conn.cursor()
+    cur.execute(f'CREATE SCHEMA IF NOT EXISTS "{schema}";')
+    cur.execute(f'DROP TABLE IF EXISTS "{schema}".formatted_weather_data;')
+    cur.execute(f"""
+        CREATE TABLE "{schema}".formatted_weather_data (
+            id                     integer generated always as identity primary key,
+            file_name              text                     not null,
+            location_id            text                     not null,
+            temp_f                 real                     not null,
+            cloud_cover_perc       real                     not null,
+            surface_pressure       real                     not null,
+            wind_speed_80m_mph     real                     not null,
+            wind_direction_80m_deg real                     not null,
+            time                   timestamp with time zone not null,
+            constraint row_loc unique (file_name, location_id, time)
+        );
+    """)
+    conn.commit()
+    cur.close()
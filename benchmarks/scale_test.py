@@ -0,0 +1,129 @@
+"""
+Grows a scratch copy of formatted_weather_data with synthetic data and times the
+dashboard's and loader's queries at each size.
+
+    python -m benchmarks.scale_test                       # 10k .. 100M rows
+    python -m benchmarks.scale_test --sizes 10000,1000000 --output scale.json
+
+Each step adds rows (new synthetic locations with `--years` of hourly history)
+up to the next size, runs ANALYZE, then reports the median of `--repeat` runs of:
+  store_initial       TimeSeriesStore's first refresh (the today view's load)
+  store_incremental   a forced refresh with nothing new (id > watermark)
+  history_week_raw    fetch_history, one location, last 7 days, raw
+  history_year_auto   fetch_history, one location, last year, auto resolution
+  already_uploaded    db.file_already_uploaded for a file that is loaded
+  not_uploaded        db.file_already_uploaded for a file that is not
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import date, timedelta
+from benchmarks.sample_data import connect, create_weather_table
+from db import file_already_uploaded
+from history import fetch_history
+from synthetic import copy_frames, generate
+from tsstore import TimeSeriesStore
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 10_000_000, 100_000_000]
+
+
+def timed(func, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(runs), 2)
+
+
+def grow(conn, schema, rows_needed, years, next_location):
+    """Adds exactly `rows_needed` rows; the last location is cut to its most recent hours."""
+    hours = int(round(years * 365 * 24))
+    locations = -(-rows_needed // hours)
+
+    def frames():
+        remaining = rows_needed
+        for df in generate(locations, years, first_location=next_location):
+            yield df.tail(remaining) if len(df) > remaining else df
+            remaining -= len(df)
+
+    return copy_frames(conn, frames(), schema), next_location + locations
+
+
+def run_queries(conn, schema, repeat):
+    today = date.today()
+    location = "SYN00000"
+    cursor = conn.cursor()
+    loaded_file = f"weather_{today - timedelta(days=1):%Y-%m-%d}.csv"
+
+    def store_initial():
+        TimeSeriesStore(connect, schema=schema).refresh()
+
+    store = TimeSeriesStore(connect, schema=schema)
+    store.refresh()
+
+    results = {
+        "store_initial": timed(store_initial, repeat),
+        "store_incremental": timed(lambda: store.refresh(force=True), repeat),
+        "history_week_raw": timed(
+            lambda: fetch_history(conn, location, today - timedelta(days=6), today, "raw", schema), repeat
+        ),
+        "history_year_auto": timed(
+            lambda: fetch_history(conn, location, today - timedelta(days=365), today, None, schema), repeat
+        ),
+        "already_uploaded": timed(lambda: file_already_uploaded(cursor, loaded_file, schema), repeat),
+        "not_uploaded": timed(lambda: file_already_uploaded(cursor, "weather_1900-01-01.csv", schema), repeat),
+    }
+    cursor.close()
+    return results
+
+
+def print_table(rows):
+    names = [k for k in rows[0] if k not in ("rows", "load_s")]
+    print(f"{'rows':>12}{'load s':>9}" + "".join(f"{n:>20}" for n in names))
+    for r in rows:
+        print(f"{r['rows']:>12,}{r['load_s']:>9.1f}" + "".join(f"{r[n]:>20.2f}" for n in names))
+    print("(query times are median ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time dashboard and loader queries as the table grows.")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="comma-separated row counts, ascending")
+    parser.add_argument("--years", type=float, default=2.0, help="history per synthetic location")
+    parser.add_argument("--schema", default="aq_scale", help="scratch schema; its table is dropped first")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write results as JSON here")
+    args = parser.parse_args()
+
+    sizes = sorted(int(s) for s in args.sizes.split(","))
+    conn = connect()
+    create_weather_table(conn, args.schema)
+
+    rows, loaded, next_location = [], 0, 0
+    try:
+        for size in sizes:
+            start = time.perf_counter()
+            added, next_location = grow(conn, args.schema, size - loaded, args.years, next_location)
+            loaded += added
+            cursor = conn.cursor()
+            cursor.execute(f'ANALYZE "{args.schema}".formatted_weather_data;')
+            conn.commit()
+            cursor.close()
+            load_s = time.perf_counter() - start
+
+            result = {"rows": loaded, "load_s": round(load_s, 1), **run_queries(conn, args.schema, args.repeat)}
+            rows.append(result)
+            print(json.dumps(result))
+    finally:
+        conn.close()
+
+    print_table(rows)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"years_per_location": args.years, "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
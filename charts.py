@@ -0,0 +1,373 @@
+import functools
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import altair as alt
+import pandas as pd
+
+# Metric definitions: key -> (display name, unit)
+METRICS = {
+    "temp_f": ("Temperature", "°F"),
+    "cloud_cover_perc": ("Cloud Cover", "%"),
+    "surface_pressure": ("Surface Pressure", "hPa"),
+    "wind_speed_80m_mph": ("Wind Speed @80m", "mph"),
+    "wind_direction_80m_deg": ("Wind Direction @80m", "°")
+}
+
+SPEC_CACHE_SIZE = 64
+
+# "client" (default): Vega-Lite spec, transforms evaluated in the browser.
+# "server": transforms pre-evaluated in Python by VegaFusion; the browser gets a
+#           Vega spec carrying only the data each mark needs.
+CHART_TRANSFORMS = os.getenv("CHART_TRANSFORMS", "client")
+
+try:
+    import vegafusion  # noqa: F401
+    import vl_convert  # noqa: F401
+    HAS_VEGAFUSION = True
+except ImportError:
+    HAS_VEGAFUSION = False
+
+if CHART_TRANSFORMS == "server" and not HAS_VEGAFUSION:
+    print("CHART_TRANSFORMS=server needs vegafusion and vl-convert-python; using client-side transforms.")
+
+VEGA_EMBED_HTML = """
+<div id="vis" style="width: 100%;"></div>
+<script>{bundle}</script>
+<script>vegaEmbed("#vis", {spec}, {{"actions": false}});</script>
+"""
+
+_spec_cache = OrderedDict()
+_spec_cache_lock = threading.Lock()
+spec_cache_stats = {"hits": 0, "misses": 0}
+
+
+def transform_mode() -> str:
+    """Effective transform mode, falling back to "client" when VegaFusion is not installed."""
+    if CHART_TRANSFORMS == "server" and HAS_VEGAFUSION:
+        return "server"
+    return "client"
+
+
+def is_vega_spec(spec: dict) -> bool:
+    return spec.get("$schema", "").startswith("https://vega.github.io/schema/vega/")
+
+
+@functools.lru_cache(maxsize=1)
+def vega_bundle() -> str:
+    """Vega, Vega-Lite and vega-embed as one script, bundled by vl-convert (no CDN needed)."""
+    import vl_convert
+    return vl_convert.javascript_bundle().replace("</script", "<\\/script")
+
+
+def script_json(value) -> str:
+    """JSON safe to place inside a <script> tag: "</" cannot close it early."""
+    return json.dumps(value).replace("</", "<\\/")
+
+
+def vega_embed_html(spec: dict) -> str:
+    """Self-contained HTML snippet rendering a pre-transformed Vega spec with vega-embed."""
+    return VEGA_EMBED_HTML.format(bundle=vega_bundle(), spec=script_json(spec))
+
+
+def metric_label(metric: str) -> str:
+    display_name, unit = METRICS[metric]
+    return f"{display_name} ({unit})"
+
+
+def data_version(df: pd.DataFrame) -> str:
+    """Content hash of a frame, used to tell whether a cached spec is still current."""
+    if df.empty:
+        return "empty"
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return hashlib.sha1(row_hashes.tobytes()).hexdigest()[:16]
+
+
+def cached_chart_spec(key: tuple, build):
+    """
+    Returns the compiled spec for `key`, calling `build()` only on a miss.
+
+    The returned dict is a shallow copy because Streamlit pops `datasets` off
+    the spec it is given.
+    """
+    with _spec_cache_lock:
+        spec = _spec_cache.get(key)
+        if spec is not None:
+            _spec_cache.move_to_end(key)
+            spec_cache_stats["hits"] += 1
+    if spec is None:
+        spec = build()
+        with _spec_cache_lock:
+            spec_cache_stats["misses"] += 1
+            _spec_cache[key] = spec
+            while len(_spec_cache) > SPEC_CACHE_SIZE:
+                _spec_cache.popitem(last=False)
+    if "datasets" not in spec:
+        return dict(spec)
+    return {**spec, "datasets": dict(spec["datasets"])}
+
+
+def clear_spec_cache():
+    with _spec_cache_lock:
+        _spec_cache.clear()
+        spec_cache_stats.update(hits=0, misses=0)
+
+
+def summarize(long_df: pd.DataFrame, keys: list[str]) -> pd.DataFrame:
+    """One row per x value with every metric's value joined into a tooltip string."""
+    return (
+        long_df
+        .groupby(keys, sort=False)
+        .apply(
+            lambda g: ", ".join(f"{m}: {v:.1f}" for m, v in zip(g["metric"], g["value"])),
+            include_groups=False
+        )
+        .reset_index(name="summary")
+    )
+
+
+def hourly_long_df(loc_df: pd.DataFrame, metrics: list[str]) -> pd.DataFrame:
+    """Build long-form data: one row per hour per metric."""
+    records = []
+    for metric in metrics:
+        agg = (
+            loc_df.groupby(["hour", "hour_label"])[metric]
+            .mean()  # collapse duplicates per hour
+            .reset_index()
+            .sort_values("hour")
+        )
+        if agg.empty:
+            continue
+        agg = agg.rename(columns={metric: "value"})
+        agg["metric"] = metric_label(metric)
+        records.append(agg[["hour", "hour_label", "metric", "value"]])
+    if not records:
+        return pd.DataFrame(columns=["hour", "hour_label", "metric", "value"])
+    return pd.concat(records, ignore_index=True)
+
+
+def history_long_df(week_df: pd.DataFrame, metrics: list[str]) -> pd.DataFrame:
+    """Build long-form raw time-series (no collapsing) for the selected metrics."""
+    records = []
+    for metric in metrics:
+        tmp = week_df[["time", metric]].rename(columns={metric: "value"})
+        tmp["metric"] = metric_label(metric)
+        records.append(tmp[["time", "metric", "value"]])
+    return pd.concat(records, ignore_index=True)
+
+
+def _source(name: str, df: pd.DataFrame, mode: str):
+    # VegaFusion needs the frames themselves; the client path references them by name
+    return df if mode == "server" else alt.NamedData(name=name)
+
+
+def _compile(chart, datasets: dict, mode: str) -> dict:
+    if mode == "server":
+        with alt.data_transformers.enable("vegafusion"):
+            return chart.to_dict(format="vega")
+    spec = chart.to_dict()
+    spec["datasets"] = datasets
+    return spec
+
+
+def build_hourly_chart(long_df: pd.DataFrame, summary: pd.DataFrame, version: str, mode: str = "client") -> dict:
+    """Per-city hour-of-day chart, with data referenced by name (client mode) or pre-transformed (server mode)."""
+    values_name = f"hourly-{version}"
+    summary_name = f"hourly-summary-{version}"
+
+    # Named selection keeps the spec identical across reruns
+    hover = alt.selection_point(
+        name="hover",
+        fields=["hour"],
+        nearest=True,
+        on="mouseover",
+        empty="none",
+        clear="mouseout"
+    )
+
+    # Base lines: one line per metric
+    lines = (
+        alt.Chart(_source(values_name, long_df, mode))
+        .mark_line()
+        .encode(
+            x=alt.X(
+                "hour:O",
+                title="Hour of Day",
+                axis=alt.Axis(
+                    labelExpr="""
+                        datum.value == 0 ? '12AM' :
+                        datum.value < 12 ? datum.value + 'AM' :
+                        datum.value == 12 ? '12PM' :
+                        (datum.value - 12) + 'PM'
+                    """,
+                    labelAngle=0
+                ),
+            ),
+            y=alt.Y("value:Q", title=None),
+            color=alt.Color(
+                "metric:N",
+                title="Metric",
+                scale=alt.Scale(scheme="category10"),
+                legend=alt.Legend(orient="top", titleFontSize=12, labelFontSize=11),
+            ),
+        )
+    )
+
+    points = (
+        alt.Chart(_source(values_name, long_df, mode))
+        .transform_filter(hover)
+        .mark_circle(size=80)
+        .encode(
+            x=alt.X("hour:O"),
+            y=alt.Y("value:Q"),
+            color=alt.Color("metric:N", title="Metric"),
+            tooltip=[
+                alt.Tooltip("hour_label:N", title="Hour"),
+                alt.Tooltip("metric:N", title="Metric"),
+                alt.Tooltip("value:Q", title="Value", format=".2f"),
+            ],
+        )
+    )
+
+    rule = (
+        alt.Chart(_source(summary_name, summary, mode))
+        .mark_rule(color="gray")
+        .encode(
+            x=alt.X("hour:O"),
+            opacity=alt.condition(hover, alt.value(1), alt.value(0)),
+            tooltip=[
+                alt.Tooltip("hour_label:N", title="Hour"),
+                alt.Tooltip("summary:N", title="Values")
+            ]
+        )
+        .add_params(hover)
+    )
+
+    final_chart = (
+        alt.layer(lines, points, rule)
+        .resolve_scale(y="shared")
+        .properties(width=350, height=350)
+        .interactive(name="zoom")
+    )
+    return _compile(final_chart, {values_name: long_df, summary_name: summary}, mode)
+
+
+def build_history_chart(long_week: pd.DataFrame, summary_week: pd.DataFrame, version: str,
+                        mode: str = "client") -> dict:
+    """Date-range history chart, with data referenced by name (client mode) or pre-transformed (server mode)."""
+    values_name = f"history-{version}"
+    summary_name = f"history-summary-{version}"
+
+    # Hover selection on time (nearest timestamp)
+    hover_time = alt.selection_point(
+        name="hover_time",
+        fields=["time"],
+        nearest=True,
+        on="mouseover",
+        empty="none",
+        clear="mouseout"
+    )
+
+    # Line layer
+    lines_week = (
+        alt.Chart(_source(values_name, long_week, mode))
+        .mark_line()
+        .encode(
+            x=alt.X("time:T", title="Time", axis=alt.Axis(format="%b %d %I %p")),
+            y=alt.Y("value:Q", title=None),
+            color=alt.Color(
+                "metric:N",
+                title="Metric",
+                scale=alt.Scale(scheme="category10"),
+                legend=alt.Legend(orient="top", titleFontSize=12, labelFontSize=11)),
+            tooltip=[
+                alt.Tooltip("time:T", title="Time", format="%Y-%m-%d %I:%M %p"),
+                alt.Tooltip("metric:N", title="Metric"),
+                alt.Tooltip("value:Q", title="Value", format=".2f"),
+            ],
+        )
+    )
+
+    # Points at hovered time
+    points_week = (
+        alt.Chart(_source(values_name, long_week, mode))
+        .transform_filter(hover_time)
+        .mark_circle(size=80)
+        .encode(
+            x="time:T",
+            y="value:Q",
+            color=alt.Color("metric:N", scale=alt.Scale(scheme="category10"), legend=None),
+            tooltip=[
+                alt.Tooltip("time:T", title="Time", format="%Y-%m-%d %I:%M %p"),
+                alt.Tooltip("metric:N", title="Metric"),
+                alt.Tooltip("value:Q", title="Value", format=".2f"),
+            ],
+        )
+    )
+
+    # Rule with combined tooltip from summary_week
+    rule_week = (
+        alt.Chart(_source(summary_name, summary_week, mode))
+        .mark_rule(color="gray")
+        .encode(
+            x=alt.X("time:T"),
+            opacity=alt.condition(hover_time, alt.value(1), alt.value(0)),
+            tooltip=[
+                alt.Tooltip("time:T", title="Time", format="%Y-%m-%d %I:%M %p"),
+                alt.Tooltip("summary:N", title="All metrics"),
+            ],
+        )
+        .add_params(hover_time)
+    )
+
+    big_chart = (
+        alt.layer(lines_week, points_week, rule_week)
+        .resolve_scale(y="shared")
+        .properties(height=500)
+        .interactive(name="zoom")
+    )
+    return _compile(big_chart, {values_name: long_week, summary_name: summary_week}, mode)
+
+
+def hourly_chart_spec(loc_df: pd.DataFrame, metrics: list[str], location_id: str, day) -> dict | None:
+    """
+    Cached spec for one city's hour-of-day chart, keyed on
+    (location, metric set, data version, day). Returns None when there is nothing to plot.
+    """
+    metric_set = tuple(metrics)
+    mode = transform_mode()
+    version = data_version(loc_df[["hour"] + list(metric_set)])
+    key = ("hourly", location_id, metric_set, version, day, mode)
+
+    def build():
+        long_df = hourly_long_df(loc_df, metrics)
+        if long_df.empty:
+            return {}
+        return build_hourly_chart(long_df, summarize(long_df, ["hour", "hour_label"]), version, mode)
+
+    spec = cached_chart_spec(key, build)
+    return spec or None
+
+
+def history_chart_spec(week_df: pd.DataFrame, metrics: list[str], location_id: str, date_range,
+                       prepare=None) -> dict:
+    """
+    Cached spec for the history chart, keyed on (location, metric set, data version, range).
+
+    :param prepare: optional callable applied to the long-form frame before plotting
+                    (e.g. downsampling)
+    """
+    metric_set = tuple(metrics)
+    mode = transform_mode()
+    version = data_version(week_df[["time"] + list(metric_set)])
+    key = ("history", location_id, metric_set, version, tuple(date_range), mode)
+
+    def build():
+        long_week = history_long_df(week_df, metrics)
+        if prepare is not None:
+            long_week = prepare(long_week)
+        return build_history_chart(long_week, summarize(long_week, ["time"]), version, mode)
+
+    return cached_chart_spec(key, build)
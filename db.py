@@ -1,12 +1,22 @@
 import os
 import boto3
+import numpy as np
 import psycopg2
 import pandas as pd
 from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 from datetime import datetime
 from awsfuncs import file_exists_in_s3, get_s3_client
+from metrics import incr, span
+from profiling import profiled
 from io import StringIO
+from psycopg2.extras import execute_values
+from validation import QUARANTINE_PREFIX, fully_quarantined, mark_fully_quarantined, quarantine_invalid
+from derived import METRICS as DERIVED_METRICS
+from anomaly import ANOMALY_COLUMN, rebuild_slots, score_rows, update_stats
+from forecasts import record_run, recorded_files
+from lake import (COMPACTED_PREFIX, compacted_files, read_compacted_file,
+                  read_compacted_month, read_manifest, read_table)
 load_dotenv()
 
 def file_already_uploaded(cursor, filename, schema: str | None = None) -> bool:
@@ -26,9 +36,183 @@ def file_already_uploaded(cursor, filename, schema: str | None = None) -> bool:
     """
 
     cursor.execute(query, (filename,))
-    return cursor.fetchone()[0]
+    if cursor.fetchone()[0]:
+        return True
+    # A file with no valid rows is done too; it only left a quarantine object behind.
+    # So is a run whose hours were all already covered by other files (forecasts.py)
+    return (filename in fully_quarantined(cursor, [filename], schema)
+            or filename in recorded_files(cursor, [filename], schema))
 
-def upload_weather_data_to_db(bucket_name=None, conn=None, filename=None, schema="WeatherData", s3_client=None):
+# CSV column -> table column, in insert order (file_name comes first)
+CSV_TO_DB_COLUMNS = {
+    "location_id": "location_id",
+    "temperature (°F)": "temp_f",
+    "cloud cover (%)": "cloud_cover_perc",
+    "surface pressure (hPa)": "surface_pressure",
+    "wind speed (80m elevation) (mph)": "wind_speed_80m_mph",
+    "wind direction (80m elevation) (°)": "wind_direction_80m_deg",
+    "time": "time",
+}
+
+LOAD_STRATEGIES = ("row", "executemany", "execute_values", "copy")
+
+# Columns a file may carry beyond the raw ones (CSV column -> table column, nullable real)
+OPTIONAL_COLUMNS = {csv: name for name, csv in DERIVED_METRICS.items()}
+OPTIONAL_COLUMNS[ANOMALY_COLUMN] = ANOMALY_COLUMN
+
+
+def weather_columns(cursor, df, schema="WeatherData"):
+    """
+    CSV column -> table column for the columns of `df` to insert: the raw ones plus
+    any OPTIONAL_COLUMNS it has (derived metrics, anomaly score). Missing optional
+    columns are added to the table, so older files and tables keep working.
+    """
+    optional = {csv: name for csv, name in OPTIONAL_COLUMNS.items() if csv in df.columns}
+    if optional:
+        cursor.execute(
+            "SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s",
+            (schema, "formatted_weather_data"),
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+        for name in optional.values():
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE "{schema}".formatted_weather_data ADD COLUMN IF NOT EXISTS {name} real')
+    columns = dict(CSV_TO_DB_COLUMNS)
+    columns.update(optional)
+    return columns
+
+
+def _row_values(df, mapping, missing=None):
+    """
+    The `mapping` columns of `df`, with `missing` in place of NaN in the optional
+    ones. Those are NaN where there is nothing to say (no history yet); they are
+    stored as NULL, since Postgres sorts NaN above every number and AVG/SUM over
+    it give NaN.
+    """
+    data = df[list(mapping)].copy()
+    for column in (c for c in mapping if c in OPTIONAL_COLUMNS):
+        values = data[column]
+        data[column] = np.where(values.notna(), values.astype(object), missing)
+    return data
+
+
+def covered_hours(cursor, df, schema="WeatherData"):
+    """Boolean mask of the rows of `df` whose (location_id, time) is already in formatted_weather_data."""
+    if df.empty:
+        return np.zeros(0, dtype=bool)
+    times = pd.to_datetime(df["time"], utc=True)
+    cursor.execute(
+        f'SELECT DISTINCT location_id, time FROM "{schema}".formatted_weather_data '
+        f"WHERE location_id = ANY(%s) AND time BETWEEN %s AND %s;",
+        (sorted(df["location_id"].unique().tolist()), times.min().to_pydatetime(), times.max().to_pydatetime()),
+    )
+    existing = pd.DataFrame(cursor.fetchall(), columns=["location_id", "time"])
+    existing = pd.MultiIndex.from_arrays([existing["location_id"], pd.to_datetime(existing["time"], utc=True)])
+    return pd.MultiIndex.from_arrays([df["location_id"], times]).isin(existing)
+
+
+def delete_weather_rows(cursor, df, schema="WeatherData", filename=None):
+    """
+    Delete the rows of formatted_weather_data at the (location_id, time) of `df`'s
+    rows, only those tagged with `filename` if given. Does not commit. Returns the
+    location_id and time of the deleted rows.
+    """
+    if df.empty:
+        return pd.DataFrame(columns=["location_id", "time"])
+    rows = list(zip(df["location_id"], pd.to_datetime(df["time"], utc=True).dt.to_pydatetime()))
+    same_file = ""
+    if filename is not None:
+        rows = [(filename, *row) for row in rows]
+        same_file = " AND t.file_name = v.file_name"
+    columns = "location_id, time" if filename is None else "file_name, location_id, time"
+    deleted = execute_values(
+        cursor,
+        f'DELETE FROM "{schema}".formatted_weather_data AS t USING (VALUES %s) AS v ({columns}) '
+        f"WHERE t.location_id = v.location_id AND t.time = v.time{same_file} RETURNING t.location_id, t.time",
+        rows, template="(" + "%s, " * (len(rows[0]) - 1) + "%s::timestamptz)", page_size=1000, fetch=True,
+    )
+    return pd.DataFrame(deleted, columns=["location_id", "time"])
+
+
+def insert_weather_rows(cursor, df, filename, schema="WeatherData", strategy="execute_values"):
+    """
+    Insert a weather CSV's rows tagged with `filename`. Does not commit.
+
+    Strategies, slowest to fastest: "row" (one execute per row), "executemany",
+    "execute_values" (multi-row INSERTs in pages) and "copy" (COPY FROM STDIN).
+    """
+    if strategy not in LOAD_STRATEGIES:
+        raise ValueError(f"Unknown load strategy '{strategy}'. Use one of {LOAD_STRATEGIES}.")
+
+    mapping = weather_columns(cursor, df, schema)
+    columns = "file_name, " + ", ".join(mapping.values())
+    table = f'"{schema}".formatted_weather_data'
+    # An empty unquoted COPY field is NULL
+    data = _row_values(df, mapping, missing="" if strategy == "copy" else None)
+
+    if strategy == "copy":
+        buf = StringIO()
+        data.insert(0, "file_name", filename)
+        data.to_csv(buf, index=False, header=False, na_rep="NaN")
+        buf.seek(0)
+        cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", buf)
+        return
+
+    rows = [(filename, *values) for values in data.itertuples(index=False, name=None)]
+    if strategy == "execute_values":
+        execute_values(cursor, f"INSERT INTO {table} ({columns}) VALUES %s", rows, page_size=1000)
+        return
+
+    insert_query = f"INSERT INTO {table} ({columns}) VALUES ({', '.join(['%s'] * (len(mapping) + 1))})"
+    if strategy == "executemany":
+        cursor.executemany(insert_query, rows)
+    else:
+        for row in rows:
+            cursor.execute(insert_query, row)
+
+
+def load_weather_frame(cursor, df, filename, schema="WeatherData", strategy="execute_values",
+                       s3_client=None, bucket_name=None, prefix=""):
+    """
+    Validate, score and load a decoded weather file and record it as a forecast
+    run, in the caller's transaction (does not commit). Returns the rows stored.
+
+    formatted_weather_data keeps one row per location and hour: hours no earlier
+    file covered are inserted, and covered ones are replaced where this is the
+    newest run for the hour. Replaced rows get new ids, so readers that follow the id (the
+    TimeSeriesStore watermark) see the revision; the values they held stay in
+    forecast_values (forecasts.py). weather_stats follows the stored rows: new
+    hours are folded in and the slots of replaced ones recomputed (anomaly.py).
+    """
+    # Bad rows go to quarantine instead of failing the whole file
+    rows = len(df)
+    df = quarantine_invalid(df, filename, s3_client, bucket_name, prefix)
+    if rows and df.empty:
+        mark_fully_quarantined(cursor, filename, rows, schema)
+        print(f"Every row of {filename} was quarantined; marked it as processed.")
+        return df
+    df = score_rows(cursor, df, filename, schema)
+    with span("db_insert", file=filename, rows=len(df), strategy=strategy):
+        # Record first: it takes the runs lock and says which hours this run is the newest for
+        applied = record_run(cursor, df.rename(columns=CSV_TO_DB_COLUMNS), filename, schema)
+        covered = covered_hours(cursor, df, schema)
+        replaced = delete_weather_rows(cursor, df[covered & applied], schema)
+        stored = df[applied | ~covered]
+        insert_weather_rows(cursor, stored, filename, schema, strategy)
+        update_stats(cursor, df[~covered], schema)
+        rebuild_slots(cursor, replaced, schema)
+    return stored
+
+
+@profiled("db_load")
+def upload_weather_data_to_db(bucket_name=None, conn=None, filename=None, schema="WeatherData", s3_client=None,
+                              prefix="", strategy="execute_values", lease=None):
+    """
+    Load a weather CSV from S3 into formatted_weather_data, skipping files already loaded.
+
+    Pass the stage's `lease` (leases.Lease) to fence the insert: it only commits
+    while that lease is still held.
+    """
     if bucket_name is None:
         bucket_name = os.getenv("BUCKET_NAME")
     
@@ -49,13 +233,21 @@ def upload_weather_data_to_db(bucket_name=None, conn=None, filename=None, schema
         if not filename.startswith("weather_") or not filename.endswith(".csv"):
             raise ValueError("Filename must start with 'weather_' and end with '.csv'")
 
-    # Check if file exists in S3
-    if not file_exists_in_s3(bucket_name, filename):
-        print(f"File {filename} does not exist in bucket {bucket_name}. Aborting.....")
-        cursor.close()
-        if close_conn:
-            conn.close()
-        return
+    if s3_client is None:
+        s3_client = get_s3_client()
+
+    # Check if file exists in S3 (rows are still tagged with the bare filename)
+    s3_key = f"{prefix}{filename}"
+    compacted_key = None
+    if not file_exists_in_s3(bucket_name, s3_key, s3_client):
+        # Days of finished months may have been compacted into a monthly object (lake.py)
+        compacted_key = compacted_files(read_manifest(bucket_name, s3_client, prefix)).get(filename)
+        if compacted_key is None:
+            print(f"File {filename} does not exist in bucket {bucket_name}. Aborting.....")
+            cursor.close()
+            if close_conn:
+                conn.close()
+            return
 
     if file_already_uploaded(cursor, filename, schema):
         print(f"Data from file '{filename}' already exists in the database. Skipping insert.....")
@@ -64,36 +256,18 @@ def upload_weather_data_to_db(bucket_name=None, conn=None, filename=None, schema
             conn.close()
         return
 
-    # Download file from S3
-    if s3_client is None:
-        s3_client = get_s3_client()
-    obj = s3_client.get_object(Bucket=bucket_name, Key=filename)
-    body = obj['Body'].read().decode("utf-8")
-    df = pd.read_csv(StringIO(body))
-
-    insert_query = f"""
-        INSERT INTO "{schema}".formatted_weather_data (
-            file_name, location_id, temp_f, cloud_cover_perc, surface_pressure, 
-            wind_speed_80m_mph, wind_direction_80m_deg, time
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-    """
+    if compacted_key is not None:
+        df = read_compacted_file(bucket_name, compacted_key, filename, s3_client)
+    else:
+        # Download file from S3 (or revalidate the cached copy)
+        df = read_table(bucket_name, s3_key, s3_client).to_pandas()
 
     try:
-        for _, row in df.iterrows():
-            cursor.execute(
-                insert_query,
-                (
-                    filename,
-                    row["location_id"],
-                    row["temperature (°F)"],
-                    row["cloud cover (%)"],
-                    row["surface pressure (hPa)"],
-                    row["wind speed (80m elevation) (mph)"],
-                    row["wind direction (80m elevation) (°)"],
-                    row["time"]
-                )
-            )
+        df = load_weather_frame(cursor, df, filename, schema, strategy, s3_client, bucket_name, prefix)
+        if lease is not None:
+            lease.check(cursor)
         conn.commit()
+        incr("rows_loaded", len(df))
         print(f"Inserted {len(df)} rows from {filename} into the database.....")
     except Exception as e:
         conn.rollback()
@@ -103,10 +277,17 @@ def upload_weather_data_to_db(bucket_name=None, conn=None, filename=None, schema
         if close_conn:
             conn.close()
 
+@profiled("drain")
 def upload_weather_data_to_s3_drain_bucket(bucket_name=os.getenv("BUCKET_NAME"), db_url=os.getenv("DB_URL")):
     conn = psycopg2.connect(db_url)
     cursor = conn.cursor()
 
+    def load(filename, df):
+        df = load_weather_frame(cursor, df, filename, s3_client=s3, bucket_name=bucket_name)
+        conn.commit()
+        incr("rows_loaded", len(df))
+        print(f"Inserted {len(df)} rows from {filename} into the database.")
+
     try:
         s3 = get_s3_client()
         response = s3.list_objects_v2(Bucket=bucket_name)
@@ -116,7 +297,7 @@ def upload_weather_data_to_s3_drain_bucket(bucket_name=os.getenv("BUCKET_NAME"),
 
         for obj in response['Contents']:
             key = obj['Key']
-            if not key.endswith(".csv"):
+            if not key.endswith(".csv") or key.startswith((QUARANTINE_PREFIX, COMPACTED_PREFIX)):
                 continue
 
             filename = os.path.basename(key)
@@ -127,32 +308,17 @@ def upload_weather_data_to_s3_drain_bucket(bucket_name=os.getenv("BUCKET_NAME"),
 
             print(f"Processing {filename}...")
 
-            s3_obj = s3.get_object(Bucket=bucket_name, Key=key)
-            body = s3_obj['Body'].read().decode('utf-8')
-            df = pd.read_csv(StringIO(body))
-
-            insert_query = """
-                INSERT INTO "WeatherData".formatted_weather_data (
-                    file_name, "location_id", "temp_F", "cloud_cover_perc", "surface_pressure", 
-                    "wind_speed_80m_mph", "wind_direction_80m_deg", "time"
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """
-
-            for _, row in df.iterrows():
-                data_tuple = (
-                    filename,
-                    row['location_id'],
-                    row['temperature (°F)'],
-                    row['cloud cover (%)'],
-                    row['surface pressure (hPa)'],
-                    row['wind speed (80m elevation) (mph)'],
-                    row['wind direction (80m elevation) (°)'],
-                    row['time']
-                )
-                cursor.execute(insert_query, data_tuple)
-
-            conn.commit()
-            print(f"Inserted {len(df)} rows from {filename} into the database.")
+            load(filename, read_table(bucket_name, key, s3).to_pandas())
+
+        # Compacted months: one read per month, only if some of its days are missing
+        for month, entry in sorted(read_manifest(bucket_name, s3)["months"].items()):
+            pending = [f for f in entry["files"] if not file_already_uploaded(cursor, f)]
+            if not pending:
+                continue
+            print(f"Processing {len(pending)} files from {entry['key']}...")
+            month_df = read_compacted_month(bucket_name, entry["key"], s3)
+            for filename, df in month_df[month_df["file_name"].isin(pending)].groupby("file_name"):
+                load(filename, df.drop(columns="file_name"))
 
     except Exception as e:
         conn.rollback()
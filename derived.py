@@ -0,0 +1,172 @@
+"""
+Derived metrics computed once at fetch time and stored next to the raw columns,
+so the dashboard and queries read them instead of recomputing them.
+
+    wind_u_80m_mph / wind_v_80m_mph   wind components (meteorological convention: u > 0 blowing east)
+    temp_f_mean_24h                   mean temperature over the trailing 24 hours
+    temp_f_delta_24h                  temperature change from the same hour the day before
+    pressure_tendency_3h              surface pressure change over the last 3 hours
+
+Everything is vectorized NumPy over the whole frame, grouped by location. The
+rolling and lagged metrics need up to 24 hours before the first new row; that
+comes from the tail of the previous day's file, so a day costs O(its rows)
+however long the history is. Catch-up fetches of a given date ask the API for
+the day before as well (weathercalls.py) and use that instead, since the
+catch-up fetches days in parallel and the previous file may not exist yet.
+Values whose window is not fully available are NaN.
+
+DERIVED_METRICS (comma-separated names from METRICS, default all of them)
+chooses what is written; an empty value turns the stage off.
+"""
+import os
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+from lake import compacted_files, read_compacted_file, read_manifest, read_table
+from validation import UNIT_PER_SECOND
+
+load_dotenv()
+
+HOUR = 3600
+
+# Metric name (also its database column) -> CSV column
+METRICS = {
+    "wind_u_80m_mph": "wind u (80m elevation) (mph)",
+    "wind_v_80m_mph": "wind v (80m elevation) (mph)",
+    "temp_f_mean_24h": "temperature 24h mean (°F)",
+    "temp_f_delta_24h": "temperature 24h change (°F)",
+    "pressure_tendency_3h": "surface pressure 3h tendency (hPa)",
+}
+# Seconds of history each metric needs before a row
+LOOKBACK = {
+    "temp_f_mean_24h": 23 * HOUR,
+    "temp_f_delta_24h": 24 * HOUR,
+    "pressure_tendency_3h": 3 * HOUR,
+}
+
+
+def parse_metrics(value):
+    """'a,b' -> ["a", "b"], checked against METRICS."""
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in names if name not in METRICS]
+    if unknown:
+        raise ValueError(f"Unknown derived metrics {unknown}. Expected some of {list(METRICS)}")
+    return names
+
+
+DERIVED_METRICS = parse_metrics(os.getenv("DERIVED_METRICS", ",".join(METRICS)))
+
+
+def _seconds(column):
+    times = column.array
+    if not isinstance(times, pd.arrays.DatetimeArray):
+        times = pd.to_datetime(times, utc=True, format="ISO8601").array
+    return times.asi8 // UNIT_PER_SECOND[times.unit]
+
+
+def _lagged(keys, values, lag):
+    """Value of the same location exactly `lag` seconds earlier, NaN where there is none. `keys` sorted."""
+    target = keys - lag
+    idx = np.minimum(np.searchsorted(keys, target), len(keys) - 1)
+    found = keys[idx] == target
+    return np.where(found, values[idx], np.nan)
+
+
+def _rolling_mean(keys, values, window):
+    """Mean over (t - window, t] of the same location; NaN unless every hour in it has a value."""
+    start = np.searchsorted(keys, keys - window + 1)
+    valid = ~np.isnan(values)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(valid)))
+    end = np.arange(1, len(keys) + 1)
+    n = counts[end] - counts[start]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (sums[end] - sums[start]) / n
+    return np.where(n == window // HOUR, mean, np.nan)
+
+
+def compute(df, tail=None, metrics=None):
+    """
+    Returns `df` with a column per derived metric (METRICS names their CSV columns).
+
+    `tail` is earlier raw rows in the same layout (normally the previous day's
+    file); only the hours the rolling/lagged metrics need are used, and rows of
+    `df` win where both have the same location and hour.
+    """
+    metrics = DERIVED_METRICS if metrics is None else metrics
+    out = df.copy()
+    if not metrics or df.empty:
+        for name in metrics:
+            out[METRICS[name]] = np.nan
+        return out
+
+    speed = out["wind speed (80m elevation) (mph)"].to_numpy(dtype=np.float64)
+    direction = np.radians(out["wind direction (80m elevation) (°)"].to_numpy(dtype=np.float64))
+    if "wind_u_80m_mph" in metrics:
+        out[METRICS["wind_u_80m_mph"]] = -speed * np.sin(direction)
+    if "wind_v_80m_mph" in metrics:
+        out[METRICS["wind_v_80m_mph"]] = -speed * np.cos(direction)
+
+    windowed = [name for name in metrics if name in LOOKBACK]
+    if not windowed:
+        return out
+
+    frames = [df[["location_id", "time", "temperature (°F)", "surface pressure (hPa)"]]]
+    seconds = [_seconds(df["time"])]
+    if tail is not None and not tail.empty:
+        tail_seconds = _seconds(tail["time"])
+        keep = tail_seconds >= seconds[0].min() - max(LOOKBACK[name] for name in windowed)
+        frames.insert(0, tail.loc[keep, frames[0].columns])
+        seconds.insert(0, tail_seconds[keep])
+    rows = pd.concat(frames, ignore_index=True)
+    seconds = np.concatenate(seconds)
+    new = np.zeros(len(rows), dtype=bool)
+    new[len(rows) - len(df):] = True
+
+    # One sortable int64 per row: location code in the high bits, epoch seconds below
+    codes, _ = rows["location_id"].factorize()
+    keys = (codes.astype(np.int64) << 34) + seconds
+    # New rows sort after tail rows at the same key, and only the last of each key is kept
+    order = np.lexsort((new, keys))
+    last = np.append(keys[order][1:] != keys[order][:-1], True)
+    order = order[last]
+    keys = keys[order]
+
+    temp = rows["temperature (°F)"].to_numpy(dtype=np.float64)[order]
+    pressure = rows["surface pressure (hPa)"].to_numpy(dtype=np.float64)[order]
+    results = {
+        "temp_f_mean_24h": lambda: _rolling_mean(keys, temp, LOOKBACK["temp_f_mean_24h"] + HOUR),
+        "temp_f_delta_24h": lambda: temp - _lagged(keys, temp, LOOKBACK["temp_f_delta_24h"]),
+        "pressure_tendency_3h": lambda: pressure - _lagged(keys, pressure, LOOKBACK["pressure_tendency_3h"]),
+    }
+
+    # Sorted position -> row of df (duplicate rows within df all get their key's values)
+    positions = np.searchsorted(keys, ((codes.astype(np.int64) << 34) + seconds)[new])
+    for name in windowed:
+        out[METRICS[name]] = results[name]()[positions]
+    return out
+
+
+def previous_day_tail(day, bucket_name, s3_client, prefix="", output_dir="data"):
+    """
+    Raw rows of the file for the day before `day` (YYYY-MM-DD): the local copy if
+    it is still there, else the S3 object or its compacted month. None if there is none.
+    """
+    filename = f"weather_{(date.fromisoformat(day) - timedelta(days=1)).isoformat()}.csv"
+    local_path = os.path.join(output_dir, filename)
+    if os.path.exists(local_path):
+        return pd.read_csv(local_path, engine="pyarrow")
+    try:
+        try:
+            return read_table(bucket_name, f"{prefix}{filename}", s3_client).to_pandas()
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+        key = compacted_files(read_manifest(bucket_name, s3_client, prefix)).get(filename)
+        if key is not None:
+            return read_compacted_file(bucket_name, key, filename, s3_client)
+    except Exception as e:
+        print(f"Could not read {filename} for derived metrics, starting their windows fresh: {e}")
+    return None
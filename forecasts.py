@@ -0,0 +1,244 @@
+"""
+Every fetch kept as a forecast run, storing only what changed since the run before.
+
+With forecast_days > 1 consecutive fetches overlap: the same valid hour is
+forecast again by each later run, usually with most values unchanged. Instead
+of keeping every run in full (storage x horizon), formatted_weather_data keeps
+one row per location and hour, updated to the newest run's values (db.py), and
+each run is recorded in "<schema>".forecast_runs with only its changed values in
+"<schema>".forecast_values, one row per (location, valid hour, run) with NULL
+for the metrics that did not change. A value as of run R is the newest non-NULL
+one from a run <= R.
+
+    latest_values(...)       the current forecast per hour, as of the newest run
+                             (equal to formatted_weather_data for those hours)
+    forecast_evolution(...)  one row per run that covered a given hour, with its lead time
+
+Runs are applied per hour, in issue order: a run's rows are applied for the
+hours no run issued at or after it covers, and skipped for the rest, since the
+deltas of the later runs for those hours would no longer chain. Files often
+arrive out of order (the catch-up fetches and loads days in parallel), so a
+run issued before the newest one still applies to the hours only it covers.
+first_valid/last_valid of a run span the hours it was applied to. A run with
+no hour left to apply is recorded with applied = false and no values, so that
+loaders know it was processed (recorded_files).
+"""
+import re
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_values
+from history import METRIC_COLUMNS
+from metrics import incr, span
+
+# Written by the fetch: when the forecast was retrieved (UTC)
+ISSUED_AT_COLUMN = "issued_at"
+
+
+def runs_table(schema):
+    return f'"{schema}".forecast_runs'
+
+
+def values_table(schema):
+    return f'"{schema}".forecast_values'
+
+
+def ensure_tables(cursor, schema="WeatherData"):
+    metric_columns = ",\n".join(f"            {m} real" for m in METRIC_COLUMNS)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {runs_table(schema)} (
+            run_id        integer generated always as identity primary key,
+            issued_at     timestamptz not null,
+            file_name     text        not null unique,
+            first_valid   timestamptz not null,
+            last_valid    timestamptz not null,
+            row_count     integer     not null,
+            changed_count integer     not null,
+            applied       boolean     not null default true
+        );
+        ALTER TABLE {runs_table(schema)} ADD COLUMN IF NOT EXISTS applied boolean not null default true;
+        CREATE TABLE IF NOT EXISTS {values_table(schema)} (
+            location_id text        not null,
+            valid_time  timestamptz not null,
+            run_id      integer     not null,
+{metric_columns},
+            primary key (location_id, valid_time, run_id)
+        );
+    """)
+
+
+def issued_at(df, filename):
+    """The fetch time written in the file, or midnight UTC of the file's date for older files."""
+    if ISSUED_AT_COLUMN in df.columns and len(df) and pd.notna(df[ISSUED_AT_COLUMN].iloc[0]):
+        stamp = pd.Timestamp(df[ISSUED_AT_COLUMN].iloc[0])
+        stamp = stamp.tz_localize("UTC") if stamp.tzinfo is None else stamp.tz_convert("UTC")
+        return stamp.to_pydatetime()
+    day = re.search(r"\d{4}-\d{2}-\d{2}", filename)
+    return datetime.fromisoformat(day.group()).replace(tzinfo=timezone.utc)
+
+
+def _latest_sql(schema, where):
+    latest = ",\n".join(
+        f"(array_agg({m} ORDER BY run_id DESC) FILTER (WHERE {m} IS NOT NULL))[1] AS {m}"
+        for m in METRIC_COLUMNS
+    )
+    return f"""
+        SELECT location_id, valid_time AS time,
+               {latest}
+        FROM {values_table(schema)}
+        WHERE {where}
+        GROUP BY location_id, valid_time
+    """
+
+
+def changed_values(new, old):
+    """
+    Rows of `new` (location_id, time, METRIC_COLUMNS) that differ from `old` (the
+    current values, same columns) in any metric, with None for the unchanged
+    metrics. Compared as float32, the precision they are stored at.
+    """
+    merged = new.merge(old, on=["location_id", "time"], how="left", suffixes=("", "_old"), indicator=True)
+    is_new = (merged["_merge"] == "left_only").to_numpy()
+    keep = is_new.copy()
+    out = merged[["location_id", "time"]].copy()
+    for m in METRIC_COLUMNS:
+        values = merged[m].to_numpy(dtype=np.float64)
+        a, b = values.astype(np.float32), merged[f"{m}_old"].to_numpy(dtype=np.float32)
+        same = (a == b) | (np.isnan(a) & np.isnan(b))
+        changed = is_new | ~same
+        keep |= changed
+        out[m] = np.where(changed, values.astype(object), None)
+    return out[keep]
+
+
+def record_run(cursor, df, filename, schema="WeatherData"):
+    """
+    Records `df` (location_id, time, METRIC_COLUMNS, optionally issued_at) as the
+    forecast run of `filename`, storing only changed values. Does not commit.
+    Returns a boolean mask over `df`'s rows: True where the row was applied as
+    the newest forecast of its hour (all False when the file is already recorded).
+    """
+    applied = np.zeros(len(df), dtype=bool)
+    if df.empty:
+        return applied
+    issued = issued_at(df, filename)
+    with span("forecast_run", file=filename, rows=len(df)):
+        ensure_tables(cursor, schema)
+        # One recorder at a time, so runs get ids in issue order for every hour
+        cursor.execute(f"LOCK TABLE {runs_table(schema)} IN SHARE ROW EXCLUSIVE MODE;")
+        cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {runs_table(schema)} WHERE file_name = %s);", (filename,))
+        if cursor.fetchone()[0]:
+            print(f"Forecast run {filename} is already recorded.")
+            return applied
+
+        times = pd.to_datetime(df["time"], utc=True)
+        first, last = times.min().to_pydatetime(), times.max().to_pydatetime()
+        # Hours that runs issued at or after this one already cover
+        cursor.execute(
+            f"SELECT first_valid, last_valid FROM {runs_table(schema)} "
+            f"WHERE applied AND issued_at >= %s AND first_valid <= %s AND last_valid >= %s;",
+            (issued, last, first),
+        )
+        applied = np.ones(len(df), dtype=bool)
+        for start, end in cursor.fetchall():
+            applied &= ~((times >= pd.Timestamp(start)) & (times <= pd.Timestamp(end))).to_numpy()
+
+        new = df.loc[applied, ["location_id", "time", *METRIC_COLUMNS]].copy()
+        new["time"] = pd.to_datetime(new["time"], utc=True)
+        new = new.drop_duplicates(["location_id", "time"], keep="last")
+        if new.empty:
+            print(f"Every hour of forecast run {filename} ({issued:%Y-%m-%d %H:%M}) is covered by a later "
+                  f"run; recording it as superseded.")
+            cursor.execute(
+                f"INSERT INTO {runs_table(schema)} (issued_at, file_name, first_valid, last_valid, row_count, "
+                f"changed_count, applied) VALUES (%s, %s, %s, %s, %s, 0, false);",
+                (issued, filename, first, last, len(df)),
+            )
+            return applied
+        first, last = new["time"].min().to_pydatetime(), new["time"].max().to_pydatetime()
+
+        cursor.execute(
+            _latest_sql(schema, "location_id = ANY(%s) AND valid_time BETWEEN %s AND %s"),
+            (list(new["location_id"].unique()), first, last),
+        )
+        old = pd.DataFrame(cursor.fetchall(), columns=["location_id", "time", *METRIC_COLUMNS])
+        old["time"] = pd.to_datetime(old["time"], utc=True)
+        old[METRIC_COLUMNS] = old[METRIC_COLUMNS].astype(float)
+        delta = changed_values(new, old)
+
+        cursor.execute(
+            f"INSERT INTO {runs_table(schema)} (issued_at, file_name, first_valid, last_valid, row_count, changed_count) "
+            f"VALUES (%s, %s, %s, %s, %s, %s) RETURNING run_id;",
+            (issued, filename, first, last, len(new), len(delta)),
+        )
+        run_id = cursor.fetchone()[0]
+        rows = [(loc, t.to_pydatetime(), run_id, *values)
+                for loc, t, *values in delta.itertuples(index=False, name=None)]
+        execute_values(
+            cursor,
+            f"INSERT INTO {values_table(schema)} (location_id, valid_time, run_id, {', '.join(METRIC_COLUMNS)}) VALUES %s",
+            rows, page_size=1000,
+        )
+    if not applied.all():
+        print(f"Forecast run {filename}: {int((~applied).sum())} rows are covered by later runs and were skipped.")
+    incr("forecast_values_stored", len(delta))
+    incr("forecast_values_unchanged", len(new) - len(delta))
+    return applied
+
+
+def recorded_files(cursor, filenames, schema="WeatherData"):
+    """The names among `filenames` already recorded as runs (applied or not)."""
+    cursor.execute("SELECT to_regclass(%s);", (runs_table(schema),))
+    if cursor.fetchone()[0] is None:
+        return set()
+    cursor.execute(f"SELECT file_name FROM {runs_table(schema)} WHERE file_name = ANY(%s);", (list(filenames),))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def latest_values(conn, location_id, start, end, schema="WeatherData"):
+    """The newest forecast of every hour of `location_id` with start <= time < end."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            _latest_sql(schema, "location_id = %s AND valid_time >= %s AND valid_time < %s") + " ORDER BY time;",
+            (location_id, start, end),
+        )
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    df = pd.DataFrame(rows, columns=["location_id", "time", *METRIC_COLUMNS]).drop(columns="location_id")
+    df["time"] = pd.to_datetime(df["time"], utc=True)
+    df[METRIC_COLUMNS] = df[METRIC_COLUMNS].astype(float)
+    return df
+
+
+def forecast_evolution(conn, location_id, valid_time, schema="WeatherData"):
+    """
+    How the forecast for one hour changed: a row per run that covered it (issued_at,
+    lead_hours, METRIC_COLUMNS), unchanged values carried forward from earlier runs.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"SELECT run_id, issued_at FROM {runs_table(schema)} "
+            f"WHERE applied AND first_valid <= %s AND last_valid >= %s ORDER BY run_id;",
+            (valid_time, valid_time),
+        )
+        runs = pd.DataFrame(cursor.fetchall(), columns=["run_id", "issued_at"])
+        cursor.execute(
+            f"SELECT run_id, {', '.join(METRIC_COLUMNS)} FROM {values_table(schema)} "
+            f"WHERE location_id = %s AND valid_time = %s ORDER BY run_id;",
+            (location_id, valid_time),
+        )
+        deltas = pd.DataFrame(cursor.fetchall(), columns=["run_id", *METRIC_COLUMNS])
+    finally:
+        cursor.close()
+
+    deltas[METRIC_COLUMNS] = deltas[METRIC_COLUMNS].astype(float)
+    evolution = runs.merge(deltas, on="run_id", how="left")
+    evolution[METRIC_COLUMNS] = evolution[METRIC_COLUMNS].ffill()
+    # Runs before the first one that reached this location carry no values
+    evolution = evolution.dropna(how="all", subset=METRIC_COLUMNS)
+    evolution["issued_at"] = pd.to_datetime(evolution["issued_at"], utc=True)
+    evolution["lead_hours"] = (pd.Timestamp(valid_time) - evolution["issued_at"]) / pd.Timedelta(hours=1)
+    return evolution[["issued_at", "lead_hours", *METRIC_COLUMNS]].reset_index(drop=True)
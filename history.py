@@ -0,0 +1,160 @@
+from datetime import date, datetime, time, timedelta, timezone
+import numpy as np
+import pandas as pd
+
+# Hard cap on points sent to the browser for one metric series
+MAX_POINTS_PER_SERIES = 500
+
+# Resolution name -> Postgres interval used for server-side bucketing (None = raw rows)
+RESOLUTIONS = {
+    "raw": None,
+    "hourly": "1 hour",
+    "6-hourly": "6 hours",
+    "daily": "1 day",
+}
+RESOLUTION_HOURS = {"raw": 1, "hourly": 1, "6-hourly": 6, "daily": 24}
+
+METRIC_COLUMNS = [
+    "temp_f",
+    "cloud_cover_perc",
+    "surface_pressure",
+    "wind_speed_80m_mph",
+    "wind_direction_80m_deg",
+]
+
+
+def choose_resolution(start: date, end: date, max_points: int = MAX_POINTS_PER_SERIES) -> str:
+    """
+    Pick the finest resolution whose bucket count stays within a few multiples of
+    `max_points`, leaving LTTB to trim the remainder while keeping the series shape.
+    """
+    span_hours = ((end - start).days + 1) * 24
+    budget = max_points * 4
+    if span_hours <= 24 * 7:
+        return "raw"
+    for name in ("hourly", "6-hourly", "daily"):
+        if span_hours / RESOLUTION_HOURS[name] <= budget:
+            return name
+    return "daily"
+
+
+def build_history_query(resolution: str, schema: str = "WeatherData") -> str:
+    """Returns the SQL for a location/date-range history query at the given resolution."""
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution '{resolution}'. Expected one of {list(RESOLUTIONS)}")
+
+    where = """
+        WHERE location_id = %s
+          AND time >= %s
+          AND time <  %s
+    """
+    if RESOLUTIONS[resolution] is None:
+        return f"""
+            SELECT time, {", ".join(METRIC_COLUMNS)}
+            FROM "{schema}".formatted_weather_data
+            {where}
+            ORDER BY time ASC;
+        """
+
+    # Wind direction is circular, so average it through its unit vector
+    return f"""
+        SELECT
+            date_bin(INTERVAL '{RESOLUTIONS[resolution]}', time, TIMESTAMPTZ '2000-01-01') AS time,
+            AVG(temp_f)             AS temp_f,
+            AVG(cloud_cover_perc)   AS cloud_cover_perc,
+            AVG(surface_pressure)   AS surface_pressure,
+            AVG(wind_speed_80m_mph) AS wind_speed_80m_mph,
+            MOD(CAST(DEGREES(ATAN2(AVG(SIN(RADIANS(wind_direction_80m_deg))),
+                                   AVG(COS(RADIANS(wind_direction_80m_deg))))) AS numeric) + 360, 360)
+                                    AS wind_direction_80m_deg
+        FROM "{schema}".formatted_weather_data
+        {where}
+        GROUP BY 1
+        ORDER BY 1 ASC;
+    """
+
+
+def date_range_bounds(start: date, end: date) -> tuple[datetime, datetime]:
+    """Converts an inclusive date range into a UTC [start, end) timestamp window."""
+    lower = datetime.combine(start, time.min, tzinfo=timezone.utc)
+    upper = datetime.combine(end + timedelta(days=1), time.min, tzinfo=timezone.utc)
+    return lower, upper
+
+
+def fetch_history(conn, location_id: str, start: date, end: date, resolution: str | None = None,
+                  schema: str = "WeatherData") -> pd.DataFrame:
+    """
+    Fetch history for one location between two dates (inclusive), bucketed server-side.
+
+    :param conn: psycopg2 connection
+    :param resolution: one of RESOLUTIONS; chosen from the range length when None
+    """
+    if resolution is None:
+        resolution = choose_resolution(start, end)
+    lower, upper = date_range_bounds(start, end)
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(build_history_query(resolution, schema), (location_id, lower, upper))
+        columns = [desc[0] for desc in cursor.description]
+        df = pd.DataFrame(cursor.fetchall(), columns=columns)
+    finally:
+        cursor.close()
+
+    if not df.empty:
+        df["time"] = pd.to_datetime(df["time"], utc=True)
+        df[METRIC_COLUMNS] = df[METRIC_COLUMNS].astype(float)
+    return df
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Returns the indices of the `n_out` points that best preserve the visual shape
+    of the series. `x` must be sorted ascending; first and last points are kept.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Bucket edges for the n - 2 interior points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point for the final bucket)
+        nlo, nhi = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[nlo:nhi].mean()
+        avg_y = y[nlo:nhi].mean()
+
+        area = np.abs(
+            (x[a] - avg_x) * (y[lo:hi] - y[a])
+            - (x[a] - x[lo:hi]) * (avg_y - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return selected
+
+
+def downsample_long(long_df: pd.DataFrame, max_points: int = MAX_POINTS_PER_SERIES) -> pd.DataFrame:
+    """Apply LTTB per metric series of a long-form (time, metric, value) frame."""
+    parts = []
+    for _, series in long_df.groupby("metric", sort=False):
+        series = series.dropna(subset=["value"]).sort_values("time")
+        if len(series) > max_points:
+            x = series["time"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+            idx = lttb(x, series["value"].to_numpy(), max_points)
+            series = series.iloc[idx]
+        parts.append(series)
+    if not parts:
+        return long_df
+    return pd.concat(parts, ignore_index=True)
@@ -0,0 +1,313 @@
+"""
+The S3 bucket as a small data lake: daily weather_<date>.csv objects, compacted
+into one Parquet file per month once the month is over.
+
+    monthly/weather_2025-07.parquet   rows of every day in July, sorted by (time, location_id),
+                                      zstd-compressed, with row-group min/max statistics and a
+                                      file_name column so each day's rows stay identifiable
+    monthly/manifest.json             which daily files each monthly object holds, and their row counts
+    grid/weather_grid_<date>.parquet  a day of the statewide grid (weathercalls.fetch_grid_weather_data):
+                                      cell, time and float32 metrics, sorted by (cell, time), with
+                                      the grid spec it was fetched for in its Parquet metadata
+    grid/cells_<spec>.parquet         cell -> latitude, longitude, one object per grid spec
+                                      (a hash of GRID_BOUNDS and GRID_STEP), since cell ids
+                                      only mean something for the grid they were numbered on
+    grid/partial/weather_grid_<date>.parquet
+                                      the batches of a grid day fetched before a failure,
+                                      picked up by the next fetch
+
+Compaction deletes the daily objects only after the monthly object has been
+read back and its per-file row counts match. Readers use the manifest, so a
+compacted day is still "in S3" for the pipeline and the loaders. A year of
+history is then 12 objects instead of 365.
+
+    python lake.py compact                 # every finished month
+    python lake.py compact --month 2025-07 --keep-originals
+"""
+import argparse
+import hashlib
+import json
+import os
+from datetime import date
+from io import BytesIO
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+from awsfuncs import get_s3_client
+from lakecache import get_cache
+from metrics import incr, span
+
+load_dotenv()
+
+COMPACTED_PREFIX = "monthly/"
+MANIFEST_KEY = f"{COMPACTED_PREFIX}manifest.json"
+# Rows per Parquet row group; small enough that a day's rows span few groups at scale
+ROW_GROUP_ROWS = 64 * 1024
+GRID_PREFIX = "grid/"
+# Statewide grid: south, west, north, east (degrees) and spacing.
+# The defaults cover North Carolina with 2,610 cells (29 x 90), a quarter of
+# Open-Meteo's free daily quota; 0.05 degrees would be 10,203 cells, more than all of it.
+GRID_BOUNDS = tuple(float(v) for v in os.getenv("GRID_BOUNDS", "33.8,-84.35,36.6,-75.45").split(","))
+GRID_STEP = float(os.getenv("GRID_STEP", "0.1"))
+
+
+def decode_weather_csv(raw: bytes) -> pd.DataFrame:
+    """Decodes a weather CSV; Arrow's reader parses `time` to timestamps at no extra cost."""
+    return pd.read_csv(BytesIO(raw), engine="pyarrow")
+
+
+def monthly_key(month, prefix=""):
+    return f"{prefix}{COMPACTED_PREFIX}weather_{month}.parquet"
+
+
+def read_manifest(bucket_name, s3_client=None, prefix=""):
+    """
+    Returns {"months": {"2025-07": {"key", "rows", "files": {"weather_2025-07-01.csv": rows}}}},
+    empty when nothing has been compacted yet.
+    """
+    s3_client = s3_client or get_s3_client()
+    try:
+        with span("s3_get", key=MANIFEST_KEY):
+            obj = s3_client.get_object(Bucket=bucket_name, Key=f"{prefix}{MANIFEST_KEY}")
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return {"months": {}}
+        raise
+    return json.loads(obj["Body"].read())
+
+
+def write_manifest(bucket_name, manifest, s3_client=None, prefix=""):
+    s3_client = s3_client or get_s3_client()
+    with span("s3_put", key=MANIFEST_KEY):
+        s3_client.put_object(
+            Bucket=bucket_name,
+            Key=f"{prefix}{MANIFEST_KEY}",
+            Body=json.dumps(manifest, indent=1, sort_keys=True).encode(),
+            ContentType="application/json",
+        )
+
+
+def compacted_files(manifest):
+    """{"weather_<date>.csv": monthly object key} for every compacted day."""
+    return {
+        filename: entry["key"]
+        for entry in manifest["months"].values()
+        for filename in entry["files"]
+    }
+
+
+def list_daily_keys(bucket_name, s3_client=None, prefix="", month=None):
+    """Daily CSV keys still stored as their own objects, optionally for one month (YYYY-MM)."""
+    s3_client = s3_client or get_s3_client()
+    start = f"{prefix}weather_{month}-" if month else f"{prefix}weather_"
+    keys = []
+    with span("s3_list", bucket=bucket_name):
+        for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=bucket_name, Prefix=start):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []) if obj["Key"].endswith(".csv"))
+    return keys
+
+
+def read_object(bucket_name, key, s3_client=None):
+    s3_client = s3_client or get_s3_client()
+    with span("s3_get", key=key):
+        raw = s3_client.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+    incr("bytes_downloaded", len(raw))
+    return raw
+
+
+def decode_object(key, raw):
+    """A lake object's bytes as an Arrow table (weather CSV or monthly Parquet)."""
+    if key.endswith(".parquet"):
+        return pq.read_table(BytesIO(raw))
+    with span("csv_decode", file=os.path.basename(key)):
+        return pacsv.read_csv(BytesIO(raw))
+
+
+def read_table(bucket_name, key, s3_client=None):
+    """
+    A lake object as an Arrow table, through the local cache (lakecache.py)
+    when LAKE_CACHE_DIR is set, so repeat reads are an ETag check.
+    """
+    s3_client = s3_client or get_s3_client()
+    cache = get_cache()
+    if cache is not None:
+        return cache.get(s3_client, bucket_name, key, lambda raw: decode_object(key, raw))
+    return decode_object(key, read_object(bucket_name, key, s3_client))
+
+
+def read_compacted_file(bucket_name, key, filename, s3_client=None):
+    """One day's rows (CSV-shaped, no file_name column) out of a monthly Parquet object."""
+    table = read_table(bucket_name, key, s3_client)
+    return table.filter(pc.field("file_name") == filename).drop_columns(["file_name"]).to_pandas()
+
+
+def read_compacted_month(bucket_name, key, s3_client=None):
+    """A monthly object's rows, including file_name."""
+    return read_table(bucket_name, key, s3_client).to_pandas()
+
+
+def grid_key(day, prefix=""):
+    return f"{prefix}{GRID_PREFIX}weather_grid_{day}.parquet"
+
+
+def grid_partial_key(day, prefix=""):
+    return f"{prefix}{GRID_PREFIX}partial/weather_grid_{day}.parquet"
+
+
+def grid_spec(bounds=GRID_BOUNDS, step=GRID_STEP):
+    """Short hash identifying a grid's cell numbering."""
+    spec = json.dumps({"bounds": [round(float(v), 6) for v in bounds], "step": round(float(step), 6)})
+    return hashlib.sha1(spec.encode()).hexdigest()[:12]
+
+
+def grid_cells_key(spec, prefix=""):
+    return f"{prefix}{GRID_PREFIX}cells_{spec}.parquet"
+
+
+def table_grid_spec(table):
+    """The grid spec stored in a grid day's metadata, or None."""
+    spec = (table.schema.metadata or {}).get(b"grid_spec")
+    return None if spec is None else spec.decode()
+
+
+def read_grid_cells(bucket_name, s3_client=None, prefix="", spec=None):
+    """The cells of the grid `spec` (default: GRID_BOUNDS and GRID_STEP): cell, latitude, longitude."""
+    return read_table(bucket_name, grid_cells_key(spec or grid_spec(), prefix), s3_client).to_pandas()
+
+
+def read_grid_cell(bucket_name, day, cell, s3_client=None, prefix="", spec=None):
+    """
+    One cell's hours of a grid day (time + metric columns). Raises ValueError
+    when the day was fetched for another grid than `spec` (default: the current
+    one), whose cell ids number different points.
+    """
+    spec = spec or grid_spec()
+    table = read_table(bucket_name, grid_key(day, prefix), s3_client)
+    if table_grid_spec(table) != spec:
+        raise ValueError(f"Grid data for {day} was fetched for grid {table_grid_spec(table)}, not {spec}.")
+    return table.filter(pc.field("cell") == cell).drop_columns(["cell"]).to_pandas()
+
+
+def _write_parquet(data):
+    """A DataFrame or Arrow table as zstd Parquet bytes."""
+    buf = BytesIO()
+    pq.write_table(
+        data if isinstance(data, pa.Table) else pa.Table.from_pandas(data, preserve_index=False),
+        buf,
+        compression="zstd",
+        row_group_size=ROW_GROUP_ROWS,
+        write_statistics=True,
+    )
+    return buf.getvalue()
+
+
+def compact_month(month, bucket_name=None, s3_client=None, prefix="", delete=True):
+    """
+    Merges a month's daily CSVs (and any earlier monthly object for it) into
+    one Parquet object, verifies it, updates the manifest and then deletes the
+    daily objects. Returns the manifest entry, or None if there was nothing to do.
+    """
+    bucket_name = bucket_name or os.getenv("BUCKET_NAME")
+    s3_client = s3_client or get_s3_client()
+
+    daily_keys = list_daily_keys(bucket_name, s3_client, prefix, month)
+    if not daily_keys:
+        return None
+
+    frames = []
+    for key in daily_keys:
+        df = decode_weather_csv(read_object(bucket_name, key, s3_client))
+        df.insert(0, "file_name", os.path.basename(key))
+        frames.append(df)
+
+    manifest = read_manifest(bucket_name, s3_client, prefix)
+    key = monthly_key(month, prefix)
+    if month in manifest["months"]:
+        # Late files for an already compacted month: a re-uploaded day replaces its old rows
+        new_files = {os.path.basename(k) for k in daily_keys}
+        previous = read_compacted_month(bucket_name, key, s3_client)
+        frames.append(previous[~previous["file_name"].isin(new_files)])
+
+    month_df = pd.concat(frames, ignore_index=True).sort_values(["time", "location_id"], kind="stable")
+    expected = month_df["file_name"].value_counts().to_dict()
+
+    body = _write_parquet(month_df)
+    with span("s3_put", key=key):
+        s3_client.put_object(Bucket=bucket_name, Key=key, Body=body)
+
+    # Read back what S3 now holds before touching the originals
+    written = pq.read_table(BytesIO(read_object(bucket_name, key, s3_client)), columns=["file_name"])
+    actual = written.column("file_name").to_pandas().value_counts().to_dict()
+    if actual != expected:
+        raise RuntimeError(f"Compacted {key} does not match its daily files: {actual} != {expected}")
+
+    entry = {"key": key, "rows": int(len(month_df)), "bytes": len(body),
+             "files": {name: int(n) for name, n in sorted(expected.items())}}
+    manifest["months"][month] = entry
+    write_manifest(bucket_name, manifest, s3_client, prefix)
+
+    if delete:
+        for i in range(0, len(daily_keys), 1000):
+            s3_client.delete_objects(
+                Bucket=bucket_name,
+                Delete={"Objects": [{"Key": k} for k in daily_keys[i:i + 1000]], "Quiet": True},
+            )
+    print(f"Compacted {len(daily_keys)} daily files ({entry['rows']} rows) into {key} ({len(body)} bytes).")
+    return entry
+
+
+def compact(bucket_name=None, s3_client=None, prefix="", before=None, delete=True):
+    """Compacts every month with daily objects that ended before `before` (default: this month)."""
+    bucket_name = bucket_name or os.getenv("BUCKET_NAME")
+    s3_client = s3_client or get_s3_client()
+    current = (before or date.today()).strftime("%Y-%m")
+    skip = len(f"{prefix}weather_")
+    months = sorted({k[skip:skip + 7] for k in list_daily_keys(bucket_name, s3_client, prefix)})
+    return {
+        month: compact_month(month, bucket_name, s3_client, prefix, delete)
+        for month in months
+        if month < current
+    }
+
+
+def select_objects(manifest, daily_keys, start, end):
+    """
+    Of a manifest and the daily keys, the objects holding the days from `start`
+    to `end` (dates, inclusive): one monthly object per compacted month plus any daily objects.
+    """
+    first, last = f"{start:%Y-%m}", f"{end:%Y-%m}"
+    first_name, last_name = f"weather_{start:%Y-%m-%d}.csv", f"weather_{end:%Y-%m-%d}.csv"
+    keys = [entry["key"] for month, entry in sorted(manifest["months"].items()) if first <= month <= last]
+    keys += sorted(k for k in daily_keys if first_name <= os.path.basename(k) <= last_name)
+    return keys
+
+
+def objects_for_range(start, end, bucket_name=None, s3_client=None, prefix=""):
+    """S3 keys holding the days from `start` to `end` (see select_objects)."""
+    bucket_name = bucket_name or os.getenv("BUCKET_NAME")
+    s3_client = s3_client or get_s3_client()
+    manifest = read_manifest(bucket_name, s3_client, prefix)
+    return select_objects(manifest, list_daily_keys(bucket_name, s3_client, prefix), start, end)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the weather data lake.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    compact_parser = sub.add_parser("compact", help="merge finished months' daily CSVs into Parquet")
+    compact_parser.add_argument("--month", help="YYYY-MM (default: every finished month)")
+    compact_parser.add_argument("--prefix", default="")
+    compact_parser.add_argument("--keep-originals", action="store_true")
+    args = parser.parse_args()
+
+    if args.month:
+        compact_month(args.month, prefix=args.prefix, delete=not args.keep_originals)
+    else:
+        compact(prefix=args.prefix, delete=not args.keep_originals)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Read-through disk cache of lake objects, keyed by bucket, key and ETag.
+
+Each object is stored decoded, as an uncompressed Arrow IPC file (ETag in its
+schema metadata) that is memory-mapped on read, so a hit costs one conditional
+GET (If-None-Match with the cached ETag, answered 304 without a body) and no
+parsing. A changed object is downloaded again and replaces the old entry.
+Entries are evicted least recently used first once the directory grows past
+LAKE_CACHE_MB.
+
+Disabled unless LAKE_CACHE_DIR is set.
+"""
+import hashlib
+import os
+import threading
+import pyarrow as pa
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+from metrics import incr, span
+
+load_dotenv()
+
+LAKE_CACHE_DIR = os.getenv("LAKE_CACHE_DIR", "")
+LAKE_CACHE_MB = int(os.getenv("LAKE_CACHE_MB", "1024"))
+
+
+class LakeCache:
+    """
+    `cache.get(s3_client, bucket, key, decode)` returns the object as a pyarrow
+    Table; `decode(raw_bytes)` turns a fresh download into one.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, bucket, key):
+        return os.path.join(self.directory, hashlib.sha1(f"{bucket}/{key}".encode()).hexdigest() + ".arrow")
+
+    def _cached_etag(self, path):
+        try:
+            return pa.ipc.open_file(pa.memory_map(path)).schema.metadata[b"etag"].decode()
+        except (FileNotFoundError, pa.ArrowInvalid, KeyError, TypeError):
+            return None
+
+    def get(self, s3_client, bucket, key, decode):
+        path = self._path(bucket, key)
+        table = self._get(s3_client, bucket, key, decode, path, self._cached_etag(path))
+        if table is None:
+            # The entry was evicted (by another thread or process) after the 304; download it
+            table = self._get(s3_client, bucket, key, decode, path, None)
+        return table
+
+    def _get(self, s3_client, bucket, key, decode, path, etag):
+        """Conditional GET when `etag` is given; None if the 304'd entry is gone by the time it is read."""
+        try:
+            with span("s3_get", key=key, cached=etag is not None):
+                if etag is not None:
+                    obj = s3_client.get_object(Bucket=bucket, Key=key, IfNoneMatch=etag)
+                else:
+                    obj = s3_client.get_object(Bucket=bucket, Key=key)
+                raw = obj["Body"].read()
+        except ClientError as e:
+            if etag is None or e.response["Error"]["Code"] not in ("304", "NotModified"):
+                raise
+            return self._hit(path)
+
+        incr("bytes_downloaded", len(raw))
+        with self._lock:
+            self.misses += 1
+        incr("lake_cache", result="miss")
+        table = decode(raw)
+        self._store(path, obj["ETag"], table)
+        return table
+
+    def _hit(self, path):
+        """The cached table, or None if the entry is gone."""
+        try:
+            # mtime is the LRU clock
+            os.utime(path)
+            table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self.hits += 1
+        incr("lake_cache", result="hit")
+        return table.replace_schema_metadata({k: v for k, v in table.schema.metadata.items() if k != b"etag"})
+
+    def _store(self, path, etag, table):
+        # The ETag travels in the file's schema metadata, so data and ETag are replaced together
+        metadata = dict(table.schema.metadata or {})
+        metadata[b"etag"] = etag.encode()
+        tagged = table.replace_schema_metadata(metadata)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with pa.OSFile(tmp, "wb") as sink:
+            with pa.ipc.new_file(sink, tagged.schema) as writer:
+                writer.write_table(tagged)
+        os.replace(tmp, path)
+        self.evict()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def size(self):
+        return sum(e.stat().st_size for e in os.scandir(self.directory) if e.name.endswith(".arrow"))
+
+    def evict(self):
+        """Deletes least recently used entries until the cache fits in max_bytes."""
+        entries = sorted(
+            (e.stat().st_mtime, e.stat().st_size, e.path)
+            for e in os.scandir(self.directory) if e.name.endswith(".arrow")
+        )
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """The process-wide cache from LAKE_CACHE_DIR / LAKE_CACHE_MB, or None when disabled."""
+    global _cache
+    if not LAKE_CACHE_DIR:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = LakeCache(LAKE_CACHE_DIR, LAKE_CACHE_MB * 1024 * 1024)
+    return _cache
@@ -0,0 +1,206 @@
+"""
+History and ad-hoc queries straight from the lake with DuckDB (optional:
+`pip install duckdb`), instead of scanning formatted_weather_data in Postgres.
+
+LAKE_URL is `s3://bucket/prefix` (read over DuckDB's httpfs extension with the
+AWS_* credentials) or a local directory laid out like the bucket. Only the
+objects covering the requested dates are read (one per compacted month, see
+lake.py), and the location/time filters are pushed into the Parquet scans,
+where row-group statistics skip most of each month.
+
+    HISTORY_BACKEND=lake LAKE_URL=s3://my-bucket streamlit run streamlit_app.py
+    python lakequery.py --start 2025-01-01 --end 2025-06-30 "SELECT location_id, AVG(temp_f) FROM weather GROUP BY 1"
+"""
+import argparse
+import glob
+import json
+import os
+from datetime import date
+import pandas as pd
+from dotenv import load_dotenv
+from db import CSV_TO_DB_COLUMNS
+from history import METRIC_COLUMNS, RESOLUTIONS, choose_resolution, date_range_bounds
+from lake import MANIFEST_KEY, list_daily_keys, read_manifest, read_table, select_objects
+from lakecache import get_cache
+
+try:
+    import duckdb
+    HAS_DUCKDB = True
+except ImportError:
+    HAS_DUCKDB = False
+
+load_dotenv()
+
+HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "postgres")
+LAKE_URL = os.getenv("LAKE_URL") or (f"s3://{os.getenv('BUCKET_NAME')}" if os.getenv("BUCKET_NAME") else None)
+# Column types for a range with no objects (every other column is DOUBLE)
+EMPTY_TYPES = {"location_id": "VARCHAR", "time": "TIMESTAMPTZ"}
+
+if HISTORY_BACKEND == "lake" and not HAS_DUCKDB:
+    print("HISTORY_BACKEND=lake needs duckdb; querying Postgres instead.")
+
+
+def use_lake() -> bool:
+    return HISTORY_BACKEND == "lake" and HAS_DUCKDB and bool(LAKE_URL)
+
+
+def _split_s3_url(url):
+    bucket, _, prefix = url[len("s3://"):].partition("/")
+    return bucket, (prefix.rstrip("/") + "/" if prefix else "")
+
+
+def lake_files(start: date, end: date, lake_url=None, s3_client=None):
+    """Paths (local) or s3:// URLs of the lake objects holding the days from `start` to `end`."""
+    lake_url = lake_url or LAKE_URL
+    if lake_url.startswith("s3://"):
+        bucket, _ = _split_s3_url(lake_url)
+        return [f"s3://{bucket}/{key}" for key in _s3_keys(start, end, lake_url, s3_client)]
+
+    manifest_path = os.path.join(lake_url, MANIFEST_KEY)
+    manifest = {"months": {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    daily = [os.path.basename(p) for p in glob.glob(os.path.join(lake_url, "weather_*.csv"))]
+    return [os.path.join(lake_url, key) for key in select_objects(manifest, daily, start, end)]
+
+
+def _s3_keys(start, end, lake_url, s3_client):
+    bucket, prefix = _split_s3_url(lake_url)
+    manifest = read_manifest(bucket, s3_client, prefix)
+    return select_objects(manifest, list_daily_keys(bucket, s3_client, prefix), start, end)
+
+
+def _sql_list(paths):
+    return "[" + ", ".join("'" + p.replace("'", "''") + "'" for p in paths) + "]"
+
+
+def weather_relation_sql(paths=(), tables=()):
+    """
+    SELECT over the given lake objects (file paths/URLs, or Arrow tables
+    registered on the connection under the names in `tables`) with the table's
+    column names. Parquet columns are selected as-is so DuckDB can push filters
+    into the scan. Files are matched by column name, since newer ones also carry
+    derived metrics.
+    """
+    columns = ", ".join(f'"{csv}" AS {db}' for csv, db in CSV_TO_DB_COLUMNS.items())
+    cast_columns = columns.replace('"time" AS time', 'CAST("time" AS TIMESTAMPTZ) AS time')
+    parquet = [p for p in paths if p.endswith(".parquet")]
+    csv = [p for p in paths if p.endswith(".csv")]
+    parts = []
+    if parquet:
+        parts.append(f"SELECT {columns} FROM read_parquet({_sql_list(parquet)}, union_by_name = true)")
+    if csv:
+        parts.append(f"SELECT {cast_columns} FROM read_csv({_sql_list(csv)}, header = true, union_by_name = true)")
+    parts += [f"SELECT {cast_columns} FROM {name}" for name in tables]
+    if not parts:
+        # No objects in range: same columns, no rows
+        empty = ", ".join(f"CAST(NULL AS {EMPTY_TYPES.get(db, 'DOUBLE')}) AS {db}" for db in CSV_TO_DB_COLUMNS.values())
+        return f"SELECT {empty} WHERE false"
+    return " UNION ALL ".join(parts)
+
+
+def _utc_connection():
+    con = duckdb.connect()
+    con.execute("SET TimeZone = 'UTC';")
+    return con
+
+
+def connect(lake_url=None):
+    """A DuckDB connection in UTC, with S3 access set up when the lake is in S3."""
+    lake_url = lake_url or LAKE_URL
+    con = _utc_connection()
+    if lake_url and lake_url.startswith("s3://"):
+        con.execute("INSTALL httpfs; LOAD httpfs;")
+        settings = {
+            "KEY_ID": os.getenv("AWS_ACCESS_KEY_ID"),
+            "SECRET": os.getenv("AWS_SECRET_ACCESS_KEY"),
+            "REGION": os.getenv("AWS_REGION"),
+        }
+        options = ", ".join(f"{k} '{v.replace(chr(39), chr(39) * 2)}'" for k, v in settings.items() if v)
+        con.execute(f"CREATE OR REPLACE SECRET lake (TYPE s3{', ' + options if options else ''});")
+    return con
+
+
+def query(sql, start: date, end: date, params=None, lake_url=None, s3_client=None):
+    """
+    Runs `sql` against a `weather` view of the lake objects between `start` and
+    `end` (dates, inclusive) and returns a DataFrame. Filter on time as well to
+    drop the other hours of those objects.
+
+    With the local cache enabled (LAKE_CACHE_DIR), S3 objects are read through
+    it and scanned as memory-mapped Arrow tables instead of over HTTP.
+    """
+    lake_url = lake_url or LAKE_URL
+    cached = lake_url.startswith("s3://") and get_cache() is not None
+    con = _utc_connection() if cached else connect(lake_url)
+    try:
+        if cached:
+            bucket, _ = _split_s3_url(lake_url)
+            names = []
+            for i, key in enumerate(_s3_keys(start, end, lake_url, s3_client)):
+                con.register(f"lake_{i}", read_table(bucket, key, s3_client))
+                names.append(f"lake_{i}")
+            relation = weather_relation_sql(tables=names)
+        else:
+            relation = weather_relation_sql(lake_files(start, end, lake_url, s3_client))
+        con.execute(f"CREATE TEMP VIEW weather AS {relation}")
+        return con.execute(sql, params or []).df()
+    finally:
+        con.close()
+
+
+def build_lake_history_query(resolution: str) -> str:
+    """DuckDB version of history.build_history_query, over the `weather` view."""
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution '{resolution}'. Expected one of {list(RESOLUTIONS)}")
+
+    where = "WHERE location_id = ? AND time >= ? AND time < ?"
+    if RESOLUTIONS[resolution] is None:
+        return f"SELECT time, {', '.join(METRIC_COLUMNS)} FROM weather {where} ORDER BY time ASC"
+
+    return f"""
+        SELECT
+            time_bucket(INTERVAL '{RESOLUTIONS[resolution]}', time, TIMESTAMPTZ '2000-01-01') AS time,
+            AVG(temp_f)             AS temp_f,
+            AVG(cloud_cover_perc)   AS cloud_cover_perc,
+            AVG(surface_pressure)   AS surface_pressure,
+            AVG(wind_speed_80m_mph) AS wind_speed_80m_mph,
+            (DEGREES(ATAN2(AVG(SIN(RADIANS(wind_direction_80m_deg))),
+                           AVG(COS(RADIANS(wind_direction_80m_deg))))) + 360) % 360
+                                    AS wind_direction_80m_deg
+        FROM weather
+        {where}
+        GROUP BY 1
+        ORDER BY 1 ASC
+    """
+
+
+def fetch_history(location_id: str, start: date, end: date, resolution: str | None = None,
+                  lake_url=None, s3_client=None) -> pd.DataFrame:
+    """history.fetch_history, answered from the lake instead of Postgres. Same columns and types."""
+    if resolution is None:
+        resolution = choose_resolution(start, end)
+    lower, upper = date_range_bounds(start, end)
+
+    df = query(build_lake_history_query(resolution), start, end, [location_id, lower, upper], lake_url, s3_client)
+    if not df.empty:
+        df["time"] = pd.to_datetime(df["time"], utc=True)
+        df[METRIC_COLUMNS] = df[METRIC_COLUMNS].astype(float)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the weather lake with DuckDB (table: weather).")
+    parser.add_argument("sql")
+    parser.add_argument("--start", type=date.fromisoformat, required=True)
+    parser.add_argument("--end", type=date.fromisoformat, required=True)
+    parser.add_argument("--lake", default=LAKE_URL, help="s3://bucket/prefix or a local directory")
+    args = parser.parse_args()
+
+    pd.set_option("display.width", 200)
+    print(query(args.sql, args.start, args.end, lake_url=args.lake).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
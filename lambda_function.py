@@ -0,0 +1,197 @@
+"""
+AWS Lambda entry point (handler: lambda_function.lambda_handler).
+
+Heavy modules (pandas, openmeteo_requests, requests_cache, boto3, psycopg2) are
+imported by the stage that first needs them, and the S3 client, DB connection
+and Open-Meteo session live in module state so warm invocations reuse them.
+"""
+import importlib
+import json
+import os
+import sys
+import time
+from datetime import datetime
+import metrics
+
+_module_start = time.perf_counter()
+
+# Lambda only allows writes under /tmp
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "/tmp/data")
+CACHE_NAME = os.getenv("OPENMETEO_CACHE", "/tmp/.cache")
+
+# Reused across warm invocations of the same container
+_state = {"s3": None, "conn": None, "openmeteo": None, "invocations": 0}
+_import_ms = {}
+
+
+def _lazy_import(name):
+    """Imports a module on first use and records how long the import took."""
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    if name not in _import_ms:
+        _import_ms[name] = round((time.perf_counter() - start) * 1000, 1)
+    return module
+
+
+def get_s3():
+    if _state["s3"] is None:
+        _state["s3"] = _lazy_import("awsfuncs").get_s3_client()
+    return _state["s3"]
+
+
+def get_conn(reconnect=False):
+    conn = _state["conn"]
+    if reconnect or conn is None or conn.closed:
+        if conn is not None and not conn.closed:
+            conn.close()
+        psycopg2 = _lazy_import("psycopg2")
+        conn = _state["conn"] = psycopg2.connect(os.getenv("DB_URL"))
+    return conn
+
+
+def get_openmeteo():
+    if _state["openmeteo"] is None:
+        weathercalls = _lazy_import("weathercalls")
+        _state["openmeteo"] = weathercalls.get_openmeteo_client(cache_name=CACHE_NAME)
+    return _state["openmeteo"]
+
+
+def run_stages(date_str, bucket_name, schema="WeatherData", prefix="", timings=None, lease=None):
+    """
+    Fetch -> S3 upload -> DB load for one date, with the same status codes as
+    master.run_pipeline_test (0 ok, 1 fetch, 2 upload, 3 DB load). `lease`
+    fences the DB load (see leases.Lease.check).
+    """
+    timings = timings if timings is not None else {}
+    filename = f"weather_{date_str}.csv"
+    local_path = os.path.join(OUTPUT_DIR, filename)
+    s3_key = f"{prefix}{filename}"
+
+    # Step 1. Fetch weather data unless it is already local or in S3
+    start = time.perf_counter()
+    try:
+        awsfuncs = _lazy_import("awsfuncs")
+        s3 = get_s3()
+        in_s3 = awsfuncs.file_exists_in_s3(bucket_name, s3_key, s3)
+        if os.path.exists(local_path) or in_s3:
+            print(f"Data for {date_str} already exists locally or in S3. Skipping fetch.")
+        else:
+            _lazy_import("weathercalls").fetch_and_save_weather_data_test(
+                date=date_str,
+                bucket_name=bucket_name,
+                output_dir=OUTPUT_DIR,
+                s3_client=s3,
+                prefix=prefix,
+                openmeteo=get_openmeteo(),
+            )
+    except Exception as e:
+        print(f"Fetch failed: {e}")
+        return 1
+    finally:
+        timings["fetch"] = round((time.perf_counter() - start) * 1000, 1)
+
+    # Step 2. Upload to S3 if not already present
+    start = time.perf_counter()
+    try:
+        if not in_s3:
+            awsfuncs.upload_file(bucket_name, local_path, s3_key, s3)
+            if not awsfuncs.file_exists_in_s3(bucket_name, s3_key, s3):
+                print("Upload to S3 failed for unknown reasons.")
+                return 2
+    except Exception as e:
+        print(f"S3 upload failed: {e}")
+        return 2
+    finally:
+        timings["upload"] = round((time.perf_counter() - start) * 1000, 1)
+
+    # Step 3. Load from S3 into DB, reconnecting once if the warm connection went stale
+    start = time.perf_counter()
+    try:
+        db = _lazy_import("db")
+        psycopg2 = _lazy_import("psycopg2")
+        for attempt in range(2):
+            try:
+                db.upload_weather_data_to_db(
+                    bucket_name=bucket_name,
+                    conn=get_conn(reconnect=attempt > 0),
+                    filename=filename,
+                    schema=schema,
+                    s3_client=s3,
+                    lease=lease,
+                )
+                break
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if attempt:
+                    raise
+                print(f"DB connection lost ({e}); reconnecting.")
+    except Exception as e:
+        print(f"DB upload failed: {e}")
+        return 3
+    finally:
+        timings["db_load"] = round((time.perf_counter() - start) * 1000, 1)
+
+    return 0
+
+
+def lambda_handler(event, context):
+    """
+    Runs the pipeline for `event["date"]` (default: today) and reports timings.
+
+    Optional event keys: date, bucket_name, schema, prefix.
+    """
+    event = event or {}
+    invoke_start = time.perf_counter()
+    cold = _state["invocations"] == 0
+    _state["invocations"] += 1
+
+    date_str = event.get("date") or datetime.now().strftime("%Y-%m-%d")
+    bucket_name = event.get("bucket_name") or os.getenv("BUCKET_NAME")
+    stage_ms = {}
+    imports_before = set(_import_ms)
+
+    schema = event.get("schema", "WeatherData")
+    leases = _lazy_import("leases")
+    # Duplicate deliveries for the same date exit straight away instead of waiting
+    # (billed time). The lease has its own connection because the load stage may
+    # close and reopen the warm one.
+    try:
+        with leases.Lease(None, f"{date_str}:lambda", schema, wait=0) as lease:
+            status = run_stages(
+                date_str,
+                bucket_name,
+                schema=schema,
+                prefix=event.get("prefix", ""),
+                timings=stage_ms,
+                lease=lease,
+            )
+    except leases.LeaseBusy as e:
+        print(f"{e}; exiting.")
+        status = 4
+
+    report = {
+        "status": status,
+        "date": date_str,
+        "cold_start": cold,
+        "invocation": _state["invocations"],
+        "module_init_ms": _MODULE_INIT_MS,
+        "lazy_import_ms": {k: v for k, v in _import_ms.items() if k not in imports_before},
+        "stage_ms": stage_ms,
+        "total_ms": round((time.perf_counter() - invoke_start) * 1000, 1),
+    }
+    # awsfuncs is only loaded if a stage got that far
+    awsfuncs = sys.modules.get("awsfuncs")
+    report["s3_calls"] = awsfuncs.S3_CALLS.report() if awsfuncs else {}
+    meteoclient = sys.modules.get("meteoclient")
+    report["api_budget"] = meteoclient.SCHEDULER.report() if meteoclient else {}
+    print(json.dumps(report))
+    # Totals are per invocation, not per container
+    metrics.flush()
+    metrics.reset()
+    if awsfuncs:
+        awsfuncs.S3_CALLS.reset()
+    if meteoclient:
+        meteoclient.SCHEDULER.reset()
+    return report
+
+
+_MODULE_INIT_MS = round((time.perf_counter() - _module_start) * 1000, 1)
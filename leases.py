@@ -0,0 +1,186 @@
+"""
+Lease-based locks in Postgres, one per pipeline (date, stage).
+
+A lease is a row in "<schema>".pipeline_leases with an owner, an expiry and a
+fence token that goes up every time the lease changes hands. Overlapping runs
+(EventBridge retries, a manual run) wait for the holder or give up with
+LeaseBusy; a crashed holder's lease simply expires. Writers call
+`lease.check(cursor)` inside their transaction so a holder whose lease expired
+and was taken over cannot commit (fencing).
+
+If the lease table cannot be reached the stage runs unlocked, as before.
+"""
+import os
+import socket
+import time
+import uuid
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LEASE_TTL = int(os.getenv("LEASE_TTL", "300"))     # seconds a lease lasts without renewal
+LEASE_WAIT = float(os.getenv("LEASE_WAIT", "60"))  # seconds to wait for another holder
+POLL_INTERVAL = 0.5
+
+
+class LeaseBusy(Exception):
+    """Another owner holds the lease and did not release it within the wait."""
+
+
+class LeaseLost(Exception):
+    """The lease expired and was taken over (or released) before the write committed."""
+
+
+def new_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class Lease:
+    """
+    `with Lease(conn, "2025-08-01:fetch", schema="WeatherData") as lease: ...`
+
+    :param conn: psycopg2 connection, or None to open one from DB_URL for the lease's lifetime
+    :param owner: reuse one owner across a run's stages; a lease is re-entrant for its owner
+    :param ttl: lease lifetime in seconds
+    :param wait: seconds to keep retrying while someone else holds it (0 = fail fast)
+    """
+
+    def __init__(self, conn, name, schema="WeatherData", owner=None, ttl=LEASE_TTL, wait=LEASE_WAIT):
+        self.conn = conn
+        self.name = name
+        self.schema = schema
+        self.owner = owner or new_owner()
+        self.ttl = ttl
+        self.wait = wait
+        self.fence = None
+        self._own_conn = False
+
+    @property
+    def held(self) -> bool:
+        return self.fence is not None
+
+    @property
+    def table(self) -> str:
+        return f'"{self.schema}".pipeline_leases'
+
+    def _ensure_table(self, cursor):
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.table} (
+                name       text primary key,
+                owner      text        not null,
+                fence      bigint      not null,
+                expires_at timestamptz not null
+            );
+        """)
+
+    def try_acquire(self) -> bool:
+        """One attempt: takes the lease if it is free, expired, or already ours."""
+        cursor = self.conn.cursor()
+        try:
+            self._ensure_table(cursor)
+            # The fence only ever increases for a name, so a newer holder always has a larger token
+            cursor.execute(f"""
+                INSERT INTO {self.table} AS l (name, owner, fence, expires_at)
+                VALUES (%s, %s, 1, now() + make_interval(secs => %s))
+                ON CONFLICT (name) DO UPDATE
+                    SET owner = EXCLUDED.owner,
+                        fence = l.fence + 1,
+                        expires_at = EXCLUDED.expires_at
+                    WHERE l.expires_at < now() OR l.owner = EXCLUDED.owner
+                RETURNING fence;
+            """, (self.name, self.owner, self.ttl))
+            row = cursor.fetchone()
+            self.conn.commit()
+        finally:
+            cursor.close()
+        self.fence = row[0] if row else None
+        return self.held
+
+    def acquire(self):
+        """Retries until acquired or `wait` runs out, then raises LeaseBusy."""
+        deadline = time.monotonic() + self.wait
+        while not self.try_acquire():
+            if time.monotonic() >= deadline:
+                raise LeaseBusy(f"lease '{self.name}' is held by another run")
+            time.sleep(POLL_INTERVAL)
+
+    def renew(self):
+        """Extends the lease; raises LeaseLost if it is no longer ours."""
+        if not self.held:
+            return
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(
+                f"UPDATE {self.table} SET expires_at = now() + make_interval(secs => %s) "
+                f"WHERE name = %s AND owner = %s AND fence = %s AND expires_at >= now();",
+                (self.ttl, self.name, self.owner, self.fence),
+            )
+            renewed = cursor.rowcount == 1
+            self.conn.commit()
+        finally:
+            cursor.close()
+        if not renewed:
+            self.fence = None
+            raise LeaseLost(f"lease '{self.name}' expired before renewal")
+
+    def check(self, cursor):
+        """
+        Fencing check for the caller's open transaction: locks the lease row until
+        commit so it cannot change hands mid-write, and raises LeaseLost if our
+        token is stale. A no-op when the lease was never acquired.
+        """
+        if not self.held:
+            return
+        cursor.execute(
+            f"SELECT 1 FROM {self.table} WHERE name = %s AND owner = %s AND fence = %s "
+            f"AND expires_at >= now() FOR UPDATE;",
+            (self.name, self.owner, self.fence),
+        )
+        if cursor.fetchone() is None:
+            raise LeaseLost(f"lease '{self.name}' (fence {self.fence}) is no longer held")
+
+    def release(self):
+        # Expire rather than delete so the fence keeps increasing
+        if not self.held:
+            return
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(
+                f"UPDATE {self.table} SET expires_at = now() WHERE name = %s AND owner = %s AND fence = %s;",
+                (self.name, self.owner, self.fence),
+            )
+            self.conn.commit()
+        finally:
+            cursor.close()
+            self.fence = None
+
+    def __enter__(self):
+        try:
+            if self.conn is None:
+                self.conn = psycopg2.connect(os.getenv("DB_URL"))
+                self._own_conn = True
+            self.acquire()
+        except psycopg2.Error as e:
+            print(f"Lease store unavailable ({e}); running '{self.name}' without a lease.")
+            self._rollback()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.release()
+        except psycopg2.Error as e:
+            print(f"Could not release lease '{self.name}': {e}")
+            self._rollback()
+        finally:
+            if self._own_conn and self.conn is not None:
+                self.conn.close()
+                self.conn = None
+                self._own_conn = False
+        return False
+
+    def _rollback(self):
+        try:
+            self.conn.rollback()
+        except Exception:
+            pass
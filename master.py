@@ -1,42 +1,81 @@
+import contextlib
 import os
+import threading
 from weathercalls import fetch_and_save_weather_data, fetch_and_save_weather_data_test
 from db import upload_weather_data_to_db
-from awsfuncs import file_exists_in_s3, get_s3_client, upload_file
+from awsfuncs import S3_CALLS, file_exists_in_s3, get_s3_client, upload_file
+from pipeline import PipelineExecutor, Stage, print_summary
+import metrics
+from metrics import span
+from profiling import profiled
+from leases import LEASE_WAIT, Lease, LeaseBusy, new_owner
+from lake import compacted_files, read_manifest
+from spool import get_spool
+from validation import fully_quarantined
+from forecasts import recorded_files
+from meteoclient import SCHEDULER
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
 import psycopg2
 
 load_dotenv()
 
 BUCKET_NAME = os.getenv("BUCKET_NAME")
 
+# Status code reported when a date fails at each stage (same as run_pipeline_test)
+STAGE_STATUS = {"fetch": 1, "upload": 2, "load": 3}
+# Another run held a stage's lease for longer than we were willing to wait
+LEASE_BUSY = 4
 
+
+@profiled("pipeline")
 def run_pipeline():
+    S3_CALLS.reset()
+    SCHEDULER.reset()
     today_str = datetime.now().strftime("%Y-%m-%d")
     filename = f"weather_{today_str}.csv"
     local_path = os.path.join("data", filename)
     s3_key = f"{filename}"
 
-    # 1. If local file already exists -> skip fetching
-    if os.path.exists(local_path):
-        print(f"Local file '{filename}' already exists. Skipping fetch.")
-    else:
-        fetch_and_save_weather_data()
+    owner = new_owner()
+    spool = get_spool()
 
-    # 2. If already in S3 -> skip upload
-    if file_exists_in_s3(BUCKET_NAME, s3_key):
-        print(f"File '{filename}' already exists in S3. Skipping upload.")
-    else:
-        upload_file(BUCKET_NAME, local_path, s3_key)
+    try:
+        # 1. If local file already exists (or is spooled) -> skip fetching
+        with Lease(None, f"{today_str}:fetch", owner=owner), span("stage_fetch", date=today_str):
+            if os.path.exists(local_path) or (spool is not None and spool.holds(filename)):
+                print(f"Local file '{filename}' already exists. Skipping fetch.")
+            else:
+                fetch_and_save_weather_data()
 
-    # 3. Upload weather data from S3 directly to database (skips duplicates in DB)
-    upload_weather_data_to_db(
-        bucket_name=BUCKET_NAME
-    )
+        if spool is not None:
+            # 2+3. Hand the file to the spool, then deliver everything pending to S3 and the DB.
+            # Whatever cannot be delivered now stays spooled for the next run.
+            with Lease(None, f"{today_str}:upload", owner=owner), span("stage_upload", date=today_str):
+                if os.path.exists(local_path):
+                    spool.append_csv(local_path)
+            with Lease(None, f"{today_str}:load", owner=owner) as lease, span("stage_load", date=today_str):
+                spool.flush(BUCKET_NAME, lease=lease)
+        else:
+            # 2. If already in S3 -> skip upload
+            with Lease(None, f"{today_str}:upload", owner=owner), span("stage_upload", date=today_str):
+                if file_exists_in_s3(BUCKET_NAME, s3_key):
+                    print(f"File '{filename}' already exists in S3. Skipping upload.")
+                else:
+                    upload_file(BUCKET_NAME, local_path, s3_key)
 
-# Always keep this function at the bottom of the file
-# also keep it commented out when not in use for gitworkflows to run properly
-# run_pipeline()
+            # 3. Upload weather data from S3 directly to database (skips duplicates in DB)
+            with Lease(None, f"{today_str}:load", owner=owner) as lease, span("stage_load", date=today_str):
+                upload_weather_data_to_db(
+                    bucket_name=BUCKET_NAME,
+                    lease=lease
+                )
+    except LeaseBusy as e:
+        print(f"{e}; exiting.")
+
+    S3_CALLS.print_report()
+    SCHEDULER.print_report()
+    metrics.flush()
 
 def run_pipeline_test(
     bucket_name=None,
@@ -45,15 +84,25 @@ def run_pipeline_test(
     s3_client=None,
     output_dir="data",
     prefix="",
+    lease_wait=LEASE_WAIT,
+    spool=None,
 ):
     """
     Run the weather data pipeline with test-friendly hooks.
 
+    Each stage holds a lease on (date, stage) so an overlapping run waits up to
+    `lease_wait` seconds for it, then re-checks what is already done.
+
+    With a `spool` (spool.Spool) the fetched file is spooled and the spool
+    flushed instead of uploading and loading it directly; a file that could not
+    be delivered stays spooled and reports 2 or 3.
+
     Returns status codes:
       0 = success
       1 = fetch failed
       2 = upload failed
       3 = DB upload failed
+      4 = another run held a stage's lease (LEASE_BUSY)
     """
 
     if bucket_name is None:
@@ -69,48 +118,286 @@ def run_pipeline_test(
     filename = f"weather_{today_str}.csv"
     local_path = os.path.join(output_dir, filename)
     s3_key = f"{prefix}{filename}"
+    owner = new_owner()
+
+    def lease(stage):
+        return Lease(conn, f"{today_str}:{stage}", schema, owner=owner, wait=lease_wait)
 
     # Step 1. Fetch weather data if not present
     try:
-        if os.path.exists(local_path):
-            print(f"Local file '{filename}' already exists. Skipping fetch.")
-        else:
-            fetch_and_save_weather_data_test(
-                date=today_str,
-                bucket_name=bucket_name,
-                output_dir=output_dir,
-                s3_client=s3_client,
-                prefix=prefix,
-            )
+        with lease("fetch"), span("stage_fetch", date=today_str):
+            if os.path.exists(local_path) or (spool is not None and spool.holds(filename)):
+                print(f"Local file '{filename}' already exists. Skipping fetch.")
+            else:
+                fetch_and_save_weather_data_test(
+                    date=today_str,
+                    bucket_name=bucket_name,
+                    output_dir=output_dir,
+                    s3_client=s3_client,
+                    prefix=prefix,
+                )
+    except LeaseBusy as e:
+        print(f"{e}; exiting.")
+        return LEASE_BUSY
     except Exception as e:
         print(f"Fetch failed: {e}")
         return 1
 
+    if spool is not None:
+        # Steps 2+3. Spool the file and deliver whatever is pending
+        try:
+            with lease("upload"), span("stage_upload", date=today_str):
+                if os.path.exists(local_path):
+                    spool.append_csv(local_path)
+            with lease("load") as load_lease, span("stage_load", date=today_str):
+                spool.flush(bucket_name, s3_client, conn, schema, prefix, force=True, lease=load_lease)
+        except LeaseBusy as e:
+            print(f"{e}; exiting.")
+            return LEASE_BUSY
+        except Exception as e:
+            print(f"Spooling failed: {e}")
+            return 2
+        waiting = [b for b in spool.pending().values() if b["file"] == filename]
+        if any(not b["s3"] for b in waiting):
+            return 2
+        if waiting:
+            return 3
+        return 0
+
     # Step 2. Upload to S3 if not already present
     try:
-        if file_exists_in_s3(bucket_name, s3_key, s3_client):
-            print(f"File '{filename}' already exists in S3. Skipping upload.")
-        else:
-            upload_file(bucket_name, local_path, s3_key, s3_client)
+        with lease("upload"), span("stage_upload", date=today_str):
+            if file_exists_in_s3(bucket_name, s3_key, s3_client):
+                print(f"File '{filename}' already exists in S3. Skipping upload.")
+            else:
+                upload_file(bucket_name, local_path, s3_key, s3_client)
 
         if not file_exists_in_s3(bucket_name, s3_key, s3_client):
             print(f"Upload to S3 failed for unknown reasons.")
             return 2
+    except LeaseBusy as e:
+        print(f"{e}; exiting.")
+        return LEASE_BUSY
     except Exception as e:
         print(f"S3 upload failed: {e}")
         return 2
 
     # Step 3. Load from S3 into DB
     try:
-        upload_weather_data_to_db(
-            bucket_name=bucket_name,
-            conn=conn,
-            filename=filename,
-            schema=schema,
-            s3_client=s3_client,
-        )
+        with lease("load") as load_lease, span("stage_load", date=today_str):
+            upload_weather_data_to_db(
+                bucket_name=bucket_name,
+                conn=conn,
+                filename=filename,
+                schema=schema,
+                s3_client=s3_client,
+                lease=load_lease,
+            )
+    except LeaseBusy as e:
+        print(f"{e}; exiting.")
+        return LEASE_BUSY
     except Exception as e:
         print(f"DB upload failed: {e}")
         return 3
 
     return 0
+
+
+def find_missing_dates(
+    dates,
+    bucket_name,
+    conn=None,
+    schema="WeatherData",
+    s3_client=None,
+    output_dir="data",
+    prefix="",
+):
+    """
+    For each date, work out in one pass whether its file is present locally,
+    in S3 (as its own object or compacted into a monthly one) and in the DB.
+    Uses one directory listing, one paginated S3 listing, the lake manifest and
+    one DB query instead of per-date checks.
+
+    Returns {date: {"local": bool, "s3": bool, "db": bool}}.
+    """
+    if s3_client is None:
+        s3_client = get_s3_client()
+
+    filenames = {d: f"weather_{d}.csv" for d in dates}
+
+    local_files = set(os.listdir(output_dir)) if os.path.isdir(output_dir) else set()
+
+    s3_keys = set()
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{prefix}weather_"):
+        s3_keys.update(obj["Key"] for obj in page.get("Contents", []))
+    # Days of finished months may live in a compacted monthly object instead
+    s3_keys.update(f"{prefix}{name}" for name in compacted_files(read_manifest(bucket_name, s3_client, prefix)))
+
+    close_conn = False
+    if conn is None:
+        conn = psycopg2.connect(os.getenv("DB_URL"))
+        close_conn = True
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f'SELECT DISTINCT file_name FROM "{schema}".formatted_weather_data WHERE file_name = ANY(%s);',
+            (list(filenames.values()),),
+        )
+        db_files = {row[0] for row in cursor.fetchall()}
+        db_files |= fully_quarantined(cursor, filenames.values(), schema)
+        db_files |= recorded_files(cursor, filenames.values(), schema)
+    finally:
+        cursor.close()
+        if close_conn:
+            conn.close()
+
+    return {
+        d: {
+            "local": name in local_files,
+            "s3": f"{prefix}{name}" in s3_keys,
+            "db": name in db_files,
+        }
+        for d, name in filenames.items()
+    }
+
+
+def run_pipeline_catchup(
+    lookback_days=7,
+    bucket_name=None,
+    conn=None,
+    schema="WeatherData",
+    s3_client=None,
+    output_dir="data",
+    prefix="",
+    fetch_workers=2,
+    upload_workers=4,
+    load_workers=2,
+    end_date=None,
+    lease_wait=LEASE_WAIT,
+):
+    """
+    Fill gaps over the last `lookback_days` days (ending today or `end_date`).
+
+    Missing dates stream through fetch -> upload -> DB load on a PipelineExecutor,
+    each stage with its own worker count and a bounded queue in front of it.
+    When `conn` is given, loads share it and run one at a time; otherwise each
+    load opens its own connection.
+
+    Like run_pipeline_test, each stage of a date holds a lease on (date, stage),
+    waiting up to `lease_wait` seconds for an overlapping run, then re-checks
+    what is already done.
+
+    Returns a list of {"date", "status", "fetched", "uploaded", "loaded"} sorted by
+    date, with run_pipeline_test's status codes (0 ok, 1 fetch, 2 upload, 3 DB,
+    4 lease busy).
+    """
+    if bucket_name is None:
+        bucket_name = BUCKET_NAME
+    if s3_client is None:
+        s3_client = get_s3_client()
+
+    S3_CALLS.reset()
+    SCHEDULER.reset()
+    end = end_date or datetime.now().date()
+    dates = [(end - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(lookback_days)][::-1]
+
+    presence = find_missing_dates(dates, bucket_name, conn, schema, s3_client, output_dir, prefix)
+    results = {
+        d: {"date": d, "status": 0, "fetched": False, "uploaded": False, "loaded": False}
+        for d in dates
+    }
+
+    owner = new_owner()
+    # A shared `conn` is used by the leases of every stage and by the loads; a lease's
+    # commits must not land in the middle of a load's transaction
+    db_lock = threading.RLock() if conn is not None else contextlib.nullcontext()
+
+    @contextlib.contextmanager
+    def lease(d, stage):
+        held = Lease(conn, f"{d}:{stage}", schema, owner=owner, wait=lease_wait)
+        try:
+            with db_lock:
+                held.__enter__()
+        except LeaseBusy:
+            results[d]["status"] = LEASE_BUSY
+            raise
+        try:
+            yield held
+        finally:
+            with db_lock:
+                held.__exit__(None, None, None)
+
+    def fetch(d):
+        # Skip dates that are already local or in S3
+        if presence[d]["local"] or presence[d]["s3"]:
+            return
+        filename = f"weather_{d}.csv"
+        with lease(d, "fetch"):
+            if os.path.exists(os.path.join(output_dir, filename)) or file_exists_in_s3(
+                bucket_name, f"{prefix}{filename}", s3_client
+            ):
+                return
+            fetch_and_save_weather_data_test(
+                date=d,
+                bucket_name=bucket_name,
+                output_dir=output_dir,
+                s3_client=s3_client,
+                prefix=prefix,
+                exact_date=True,
+            )
+        results[d]["fetched"] = True
+
+    def upload(d):
+        if presence[d]["s3"]:
+            return
+        filename = f"weather_{d}.csv"
+        with lease(d, "upload"):
+            if file_exists_in_s3(bucket_name, f"{prefix}{filename}", s3_client):
+                return
+            upload_file(bucket_name, os.path.join(output_dir, filename), f"{prefix}{filename}", s3_client)
+            if not file_exists_in_s3(bucket_name, f"{prefix}{filename}", s3_client):
+                raise RuntimeError("file not in S3 after upload")
+        results[d]["uploaded"] = True
+
+    def load(d):
+        if presence[d]["db"]:
+            return
+        # upload_weather_data_to_db re-checks whether the file is loaded once the lease is held
+        with lease(d, "load") as held, db_lock:
+            upload_weather_data_to_db(
+                bucket_name=bucket_name,
+                conn=conn,
+                filename=f"weather_{d}.csv",
+                schema=schema,
+                s3_client=s3_client,
+                prefix=prefix,
+                lease=held,
+            )
+        results[d]["loaded"] = True
+
+    # Dates overlap across stages: date N+1 fetches while date N uploads and N-1 loads
+    executor = PipelineExecutor([
+        Stage("fetch", fetch, workers=fetch_workers),
+        Stage("upload", upload, workers=upload_workers),
+        Stage("load", load, workers=1 if conn is not None else load_workers),
+    ])
+    todo = [d for d in dates if not all(presence[d].values())]
+    failed_at, summary = executor.run(todo)
+    for d, stage in failed_at.items():
+        if stage is not None and not results[d]["status"]:
+            results[d]["status"] = STAGE_STATUS[stage]
+    print_summary(summary)
+    S3_CALLS.print_report()
+    SCHEDULER.print_report()
+    metrics.flush()
+
+    table = [results[d] for d in dates]
+    print(f"{'date':<12}{'status':>7}{'fetched':>9}{'uploaded':>10}{'loaded':>8}")
+    for row in table:
+        print(f"{row['date']:<12}{row['status']:>7}{row['fetched']!s:>9}{row['uploaded']!s:>10}{row['loaded']!s:>8}")
+    return table
+
+
+if __name__ == "__main__":
+    run_pipeline()
@@ -0,0 +1,304 @@
+"""
+Open-Meteo requests under a client-side budget.
+
+Open-Meteo's free tier allows OPENMETEO_LIMITS calls (default 600/minute,
+5000/hour, 10000/day). A request's weight is the number of coordinates in it,
+more if it asks for more than 10 variables or more than 2 weeks of data
+(call_weight), which is how the API counts it. Every request made through a
+ScheduledClient (what weathercalls.get_openmeteo_client returns):
+
+- waits until the token bucket of every window has room for its weight, or
+  raises BudgetExceeded if that would take longer than OPENMETEO_MAX_WAIT seconds
+- on a 429, a 5xx or a connection error, pauses all requests for Retry-After
+  (when the API sends one) or the current backoff, which doubles on each failure
+  and halves on each success, then retries up to OPENMETEO_RETRIES times
+- shares the answer of an identical request already in flight instead of sending it twice
+- gets its tokens back when the response came from the local HTTP cache
+
+The buckets, the backoff and the in-flight table are per process (SCHEDULER), so
+concurrent fetches share them. SCHEDULER.print_report() shows the budget used
+since the last reset(), e.g. once per pipeline run.
+"""
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timezone
+from email.utils import parsedate_to_datetime
+from dotenv import load_dotenv
+from metrics import incr, span
+
+load_dotenv()
+
+OPENMETEO_LIMITS = os.getenv("OPENMETEO_LIMITS", "600/minute,5000/hour,10000/day")
+OPENMETEO_MAX_WAIT = float(os.getenv("OPENMETEO_MAX_WAIT", "120"))
+OPENMETEO_RETRIES = int(os.getenv("OPENMETEO_RETRIES", "5"))
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+MAX_BACKOFF = 60.0
+VARIABLE_GROUPS = ("hourly", "daily", "current", "minutely_15")
+
+# Status and headers of the last HTTP response seen by this thread (record_response hook)
+_last = threading.local()
+
+
+class BudgetExceeded(RuntimeError):
+    """The request budget would not allow this request within OPENMETEO_MAX_WAIT."""
+
+
+def parse_limits(spec):
+    """"600/minute,5000/hour" -> [("minute", 600.0, 60), ("hour", 5000.0, 3600)]."""
+    limits = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        count, period = part.split("/")
+        if period not in PERIODS:
+            raise ValueError(f"Unknown period '{period}' in OPENMETEO_LIMITS; use one of {list(PERIODS)}.")
+        limits.append((period, float(count), PERIODS[period]))
+    return limits
+
+
+def _count(value):
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len([v for v in value.split(",") if v])
+    if isinstance(value, (list, tuple)):
+        return len(value)
+    return 1
+
+
+def call_weight(params):
+    """API calls a request counts as: coordinates x max(1, variables / 10) x max(1, days / 14)."""
+    locations = max(1, _count(params.get("latitude")))
+    variables = sum(_count(params.get(group)) for group in VARIABLE_GROUPS)
+    if params.get("start_date") and params.get("end_date"):
+        days = (date.fromisoformat(params["end_date"]) - date.fromisoformat(params["start_date"])).days + 1
+    else:
+        days = int(params.get("forecast_days", 7)) + int(params.get("past_days", 0))
+    return locations * max(1.0, variables / 10) * max(1.0, days / 14)
+
+
+def retry_after_seconds(value, now=None):
+    """A Retry-After header (seconds or an HTTP date) in seconds, or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - (now or datetime.now(timezone.utc))).total_seconds())
+
+
+def record_response(response, *args, **kwargs):
+    """requests response hook: remembers what the scheduler needs to know about the last response."""
+    _last.status = response.status_code
+    _last.retry_after = response.headers.get("Retry-After")
+    _last.from_cache = bool(getattr(response, "from_cache", False))
+    return response
+
+
+class TokenBucket:
+    """`limit` tokens refilling evenly over `period` seconds."""
+
+    def __init__(self, name, limit, period, now):
+        self.name = name
+        self.capacity = limit
+        self.rate = limit / period
+        self.tokens = limit
+        self.updated = now
+        self.used = 0.0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, weight):
+        # A request heavier than the whole bucket goes once the bucket is full
+        need = min(weight, self.capacity)
+        return 0.0 if self.tokens >= need else (need - self.tokens) / self.rate
+
+    def take(self, weight):
+        self.tokens -= weight
+        self.used += weight
+
+    def give_back(self, weight):
+        self.tokens = min(self.capacity, self.tokens + weight)
+        self.used -= weight
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RequestScheduler:
+    """
+    Token buckets, adaptive backoff and in-flight request coalescing shared by
+    every ScheduledClient that uses it.
+
+    :param limits: OPENMETEO_LIMITS-style string
+    :param max_wait: longest a request may wait for the budget before BudgetExceeded
+    :param retries: attempts after the first on 429, 5xx or connection errors
+    :param clock, sleep: injectable for tests
+    """
+
+    def __init__(self, limits=OPENMETEO_LIMITS, max_wait=OPENMETEO_MAX_WAIT, retries=OPENMETEO_RETRIES,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.max_wait = max_wait
+        self.retries = retries
+        now = clock()
+        self.buckets = [TokenBucket(name, limit, period, now) for name, limit, period in parse_limits(limits)]
+        self.backoff = 0.0
+        self.paused_until = now
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.reset()
+
+    def reset(self):
+        """Starts a new report; the buckets keep their state, since the API's windows do."""
+        with self._lock:
+            self.counts = {"requests": 0, "weight": 0.0, "cached": 0, "coalesced": 0, "retries": 0,
+                           "throttled": 0, "server_errors": 0, "connection_errors": 0, "wait_s": 0.0}
+            for bucket in self.buckets:
+                bucket.used = 0.0
+
+    def acquire(self, weight):
+        """Blocks until the budget and any pause allow a request of `weight`, then charges it."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self.clock()
+                for bucket in self.buckets:
+                    bucket.refill(now)
+                wait = max([self.paused_until - now, *(b.wait_time(weight) for b in self.buckets)])
+                if wait <= 0:
+                    for bucket in self.buckets:
+                        bucket.take(weight)
+                    self.counts["requests"] += 1
+                    self.counts["weight"] += weight
+                    self.counts["wait_s"] += waited
+                    return waited
+                if waited + wait > self.max_wait:
+                    empty = [b.name for b in self.buckets if b.wait_time(weight) > 0]
+                    raise BudgetExceeded(
+                        f"Open-Meteo budget ({', '.join(empty) or 'backoff'}) needs {wait:.0f}s more for a "
+                        f"request of weight {weight:g}; OPENMETEO_MAX_WAIT is {self.max_wait:g}s."
+                    )
+            self.sleep(wait)
+            waited += wait
+
+    def refund(self, weight):
+        with self._lock:
+            for bucket in self.buckets:
+                bucket.give_back(weight)
+            self.counts["weight"] -= weight
+            self.counts["cached"] += 1
+
+    def failed(self, status, retry_after=None):
+        """Slows every request down after a 429, a 5xx (`status`) or a connection error (None)."""
+        kind = "throttled" if status == 429 else "connection_errors" if status is None else "server_errors"
+        with self._lock:
+            self.counts[kind] += 1
+            self.counts["retries"] += 1
+            self.backoff = min(max(self.backoff * 2, 1.0), MAX_BACKOFF)
+            pause = retry_after if retry_after is not None else self.backoff
+            self.paused_until = max(self.paused_until, self.clock() + pause)
+        incr("api_retries", reason=kind)
+        print(f"Open-Meteo request failed ({status or 'no response'}); pausing requests for {pause:.1f}s.")
+
+    def succeeded(self):
+        with self._lock:
+            self.backoff = self.backoff / 2 if self.backoff > 0.1 else 0.0
+
+    def coalesce(self, key, request):
+        """Runs `request()` unless an identical one (same key) is in flight, then shares its answer."""
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+            else:
+                self.counts["coalesced"] += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = request()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.done.set()
+
+    def report(self):
+        with self._lock:
+            report = {k: round(v, 2) if isinstance(v, float) else v for k, v in self.counts.items()}
+            report["budget"] = {
+                b.name: {"limit": b.capacity, "used": round(b.used, 2), "remaining": round(max(b.tokens, 0.0), 2)}
+                for b in self.buckets
+            }
+        return report
+
+    def print_report(self):
+        r = self.report()
+        print(f"Open-Meteo: {r['requests']} requests ({r['weight']:g} calls), {r['cached']} from cache, "
+              f"{r['coalesced']} coalesced, {r['retries']} retries ({r['throttled']} throttled, "
+              f"{r['server_errors']} server errors, {r['connection_errors']} connection errors), "
+              f"{r['wait_s']:.1f}s waiting")
+        for name, b in r["budget"].items():
+            print(f"  per {name:<7} used {b['used']:>8g} of {b['limit']:>7g}, {b['remaining']:>8g} left")
+
+
+# Shared by every client made through weathercalls.get_openmeteo_client(); reset between runs
+SCHEDULER = RequestScheduler()
+
+
+class ScheduledClient:
+    """
+    Drop-in for openmeteo_requests.Client that sends every request through a
+    RequestScheduler. The wrapped client's session needs record_response among
+    its response hooks, so failures can be told apart.
+    """
+
+    def __init__(self, client, scheduler=None):
+        self.client = client
+        self.scheduler = scheduler or SCHEDULER
+
+    def weather_api(self, url, params, method="GET", **kwargs):
+        key = json.dumps([method.upper(), url, params, kwargs], sort_keys=True, default=str)
+        return self.scheduler.coalesce(key, lambda: self._request(url, params, method, **kwargs))
+
+    def _request(self, url, params, method, **kwargs):
+        weight = call_weight(params)
+        for attempt in range(self.scheduler.retries + 1):
+            waited = self.scheduler.acquire(weight)
+            if waited:
+                incr("api_budget_wait_ms", round(waited * 1000))
+            _last.status, _last.retry_after, _last.from_cache = None, None, False
+            try:
+                with span("api_request", weight=weight, attempt=attempt):
+                    responses = self.client.weather_api(url, params=params, method=method, **kwargs)
+            except Exception:
+                status = _last.status
+                retryable = status is None or status == 429 or status >= 500
+                if not retryable or attempt == self.scheduler.retries:
+                    raise
+                self.scheduler.failed(status, retry_after_seconds(_last.retry_after))
+                continue
+            if _last.from_cache:
+                self.scheduler.refund(weight)
+            self.scheduler.succeeded()
+            return responses
@@ -0,0 +1,147 @@
+"""
+Timing spans and counters for the pipeline.
+
+Disabled unless METRICS_ENABLED=1. When disabled, `span()` returns a shared no-op
+context manager and `incr()` returns immediately, so instrumented code pays one
+boolean check per call. When enabled, every span is printed as a JSON log line
+and totals can be written as a Prometheus text file (METRICS_PROM_FILE) by `flush()`.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+
+_enabled = os.getenv("METRICS_ENABLED", "0") == "1"
+_prom_file = os.getenv("METRICS_PROM_FILE")
+_run_id = uuid.uuid4().hex[:12]
+
+_NOOP = contextlib.nullcontext()
+_lock = threading.Lock()
+_counters = {}   # (name, labels) -> value
+_spans = {}      # name -> [count, total seconds]; span labels only go to the log
+
+
+def enable(prom_file=None):
+    global _enabled, _prom_file
+    _enabled = True
+    if prom_file is not None:
+        _prom_file = prom_file
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    """Clears collected totals and starts a new run id."""
+    global _run_id
+    with _lock:
+        _counters.clear()
+        _spans.clear()
+        _run_id = uuid.uuid4().hex[:12]
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _log(record):
+    record["run_id"] = _run_id
+    print(json.dumps(record, default=str))
+
+
+class _Span:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        with _lock:
+            entry = _spans.setdefault(self.name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+        _log({
+            "event": "span",
+            "name": self.name,
+            "duration_ms": round(elapsed * 1000, 3),
+            "ok": exc_type is None,
+            **self.labels,
+        })
+        return False
+
+
+def span(name, **labels):
+    """Times the enclosed block: `with span("s3_put", key=key): ...`."""
+    if not _enabled:
+        return _NOOP
+    return _Span(name, labels)
+
+
+def incr(name, value=1, **labels):
+    """Adds `value` to a counter such as rows, bytes or cache hits."""
+    if not _enabled:
+        return
+    with _lock:
+        k = _key(name, labels)
+        _counters[k] = _counters.get(k, 0) + value
+
+
+def snapshot() -> dict:
+    """Current totals: {"counters": {"name,label=value": total}, "spans": {name: {"count", "seconds"}}}."""
+    def label_str(name, labels):
+        return name + "".join(f",{k}={v}" for k, v in labels)
+
+    with _lock:
+        return {
+            "counters": {label_str(n, l): v for (n, l), v in _counters.items()},
+            "spans": {n: {"count": c, "seconds": round(s, 6)} for n, (c, s) in _spans.items()},
+        }
+
+
+def _prom_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def flush():
+    """Logs a run summary and, if configured, writes totals as a Prometheus text file."""
+    if not _enabled:
+        return
+    _log({"event": "summary", **snapshot()})
+    if not _prom_file:
+        return
+
+    lines = []
+    with _lock:
+        if _spans:
+            lines.append("# TYPE meteo_span_seconds summary")
+            for name, (count, seconds) in sorted(_spans.items()):
+                lbl = _prom_labels((("span", name),))
+                lines.append(f"meteo_span_seconds_count{lbl} {count}")
+                lines.append(f"meteo_span_seconds_sum{lbl} {seconds:.6f}")
+        for name in sorted({n for n, _ in _counters}):
+            lines.append(f"# TYPE meteo_{name}_total counter")
+            for (n, labels), value in sorted(_counters.items()):
+                if n == name:
+                    lines.append(f"meteo_{name}_total{_prom_labels(labels)} {value}")
+
+    # Write then rename so a textfile collector never reads a partial file
+    tmp_path = f"{_prom_file}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, _prom_file)
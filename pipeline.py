@@ -0,0 +1,156 @@
+import queue
+import threading
+import time
+
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a pipeline.
+
+    :param name: label used in the run summary
+    :param func: called with each item; raising marks the item failed at this stage
+    :param workers: threads running this stage concurrently
+    :param queue_size: bound on items waiting for this stage (backpressure on the stage before it)
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=2):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.queue_wait = 0.0     # time workers sat waiting for input
+        self.blocked = 0.0        # time workers sat waiting on a full downstream queue
+        self.first_start = None
+        self.last_end = None
+        self.lock = threading.Lock()
+
+    def as_dict(self):
+        wall = 0.0
+        if self.first_start is not None and self.last_end is not None:
+            wall = self.last_end - self.first_start
+        return {
+            "stage": self.name,
+            "processed": self.processed,
+            "failed": self.failed,
+            "wall_s": round(wall, 3),
+            "busy_s": round(self.busy, 3),
+            "queue_wait_s": round(self.queue_wait, 3),
+            "blocked_s": round(self.blocked, 3),
+        }
+
+
+class PipelineExecutor:
+    """
+    Runs items through stages connected by bounded queues, so while item N is in
+    stage 2, item N+1 can already be in stage 1. Each stage has its own worker
+    count, and a full queue blocks the upstream stage (backpressure).
+    """
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self.stats = [StageStats(s.name) for s in self.stages]
+
+    def run(self, items):
+        """
+        Process `items` and return ({item: failed stage name or None}, summary).
+        `summary` has one dict per stage plus the total wall time.
+        """
+        self.stats = [StageStats(s.name) for s in self.stages]
+        queues = [queue.Queue(maxsize=s.queue_size) for s in self.stages]
+        outcome = {}
+        outcome_lock = threading.Lock()
+        alive = [s.workers for s in self.stages]
+        alive_lock = threading.Lock()
+
+        def worker(i):
+            stage, stats = self.stages[i], self.stats[i]
+            inbox = queues[i]
+            outbox = queues[i + 1] if i + 1 < len(queues) else None
+            while True:
+                waited = time.perf_counter()
+                item = inbox.get()
+                with stats.lock:
+                    stats.queue_wait += time.perf_counter() - waited
+                if item is _DONE:
+                    break
+
+                start = time.perf_counter()
+                try:
+                    stage.func(item)
+                    ok = True
+                except Exception as e:
+                    print(f"Stage '{stage.name}' failed for {item}: {e}")
+                    ok = False
+                end = time.perf_counter()
+
+                with stats.lock:
+                    stats.busy += end - start
+                    stats.first_start = start if stats.first_start is None else min(stats.first_start, start)
+                    stats.last_end = end if stats.last_end is None else max(stats.last_end, end)
+                    if ok:
+                        stats.processed += 1
+                    else:
+                        stats.failed += 1
+
+                if not ok:
+                    with outcome_lock:
+                        outcome[item] = stage.name
+                elif outbox is None:
+                    with outcome_lock:
+                        outcome[item] = None
+                else:
+                    blocked = time.perf_counter()
+                    outbox.put(item)
+                    with stats.lock:
+                        stats.blocked += time.perf_counter() - blocked
+
+            # Last worker out tells the next stage to finish
+            with alive_lock:
+                alive[i] -= 1
+                last = alive[i] == 0
+            if last and outbox is not None:
+                for _ in range(self.stages[i + 1].workers):
+                    outbox.put(_DONE)
+
+        threads = [
+            threading.Thread(target=worker, args=(i,), name=f"{stage.name}-{n}", daemon=True)
+            for i, stage in enumerate(self.stages)
+            for n in range(stage.workers)
+        ]
+        run_start = time.perf_counter()
+        for t in threads:
+            t.start()
+
+        for item in items:
+            queues[0].put(item)
+        for _ in range(self.stages[0].workers):
+            queues[0].put(_DONE)
+
+        for t in threads:
+            t.join()
+
+        summary = {
+            "wall_s": round(time.perf_counter() - run_start, 3),
+            "stages": [s.as_dict() for s in self.stats],
+        }
+        return outcome, summary
+
+
+def print_summary(summary):
+    print(f"{'stage':<12}{'done':>6}{'failed':>8}{'wall s':>9}{'busy s':>9}{'wait s':>9}{'blocked s':>11}")
+    for s in summary["stages"]:
+        print(
+            f"{s['stage']:<12}{s['processed']:>6}{s['failed']:>8}{s['wall_s']:>9.3f}"
+            f"{s['busy_s']:>9.3f}{s['queue_wait_s']:>9.3f}{s['blocked_s']:>11.3f}"
+        )
+    print(f"total wall: {summary['wall_s']:.3f}s")
@@ -0,0 +1,190 @@
+"""
+Opt-in profiling for pipeline stages and the dashboard.
+
+Off unless PROFILE_STAGES names the stages to profile (comma separated, or "all"):
+  pipeline   master.run_pipeline
+  db_load    db.upload_weather_data_to_db
+  drain      db.upload_weather_data_to_s3_drain_bucket
+  dashboard  the dashboard's data-prep block
+
+Other settings:
+  PROFILER            cprofile (default), sampling, or both ("cprofile,sampling")
+  PROFILE_SAMPLE_HZ   sampling rate for the sampling profiler (default 100)
+  PROFILE_TRACEMALLOC 1 to also snapshot allocations (top PROFILE_TOP_N lines, default 25)
+  PROFILE_OUTPUT      local directory (default "profiles") or s3://bucket/prefix
+
+Artifacts per profiled call: <stage>-<timestamp>-<pid>-<seq>.pstats (cProfile),
+.collapsed (sampling; feed to flamegraph.pl or speedscope) and .alloc.txt (tracemalloc).
+"""
+import contextlib
+import cProfile
+import functools
+import itertools
+import marshal
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+_local = threading.local()
+# Only one cProfile can be active per process on newer Pythons; concurrent callers skip it
+_cprofile_lock = threading.Lock()
+# Tells apart artifacts of calls finishing in the same second of one process
+_sequence = itertools.count(1)
+
+
+def _settings():
+    # Read on every call so a long-lived process (Streamlit, warm Lambda) can be toggled
+    stages = {s.strip() for s in os.getenv("PROFILE_STAGES", "").split(",") if s.strip()}
+    return {
+        "stages": stages,
+        "profilers": {p.strip() for p in os.getenv("PROFILER", "cprofile").split(",") if p.strip()},
+        "hz": float(os.getenv("PROFILE_SAMPLE_HZ", "100")),
+        "tracemalloc": os.getenv("PROFILE_TRACEMALLOC", "0") == "1",
+        "top_n": int(os.getenv("PROFILE_TOP_N", "25")),
+        "output": os.getenv("PROFILE_OUTPUT", "profiles"),
+    }
+
+
+def is_profiled(stage, settings=None) -> bool:
+    stages = (settings or _settings())["stages"]
+    return "all" in stages or stage in stages
+
+
+class SamplingProfiler:
+    """
+    Samples one thread's stack at a fixed rate from a background thread and
+    counts identical stacks, giving flamegraph-ready collapsed output.
+    """
+
+    def __init__(self, thread_id, hz=100):
+        self.thread_id = thread_id
+        self.interval = 1.0 / max(hz, 1)
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+
+def _top_allocations(snapshot, top_n):
+    stats = snapshot.statistics("lineno")
+    total = sum(s.size for s in stats)
+    lines = [f"Total allocated (still live at exit): {total / 1024:.1f} KiB"]
+    for s in stats[:top_n]:
+        frame = s.traceback[0]
+        lines.append(f"{s.size / 1024:10.1f} KiB {s.count:8d} blocks  {frame.filename}:{frame.lineno}")
+    return "\n".join(lines) + "\n"
+
+
+def _write_artifacts(output, base, artifacts):
+    """Writes {suffix: bytes} to a local directory or an s3://bucket/prefix and returns the paths."""
+    paths = []
+    if output.startswith("s3://"):
+        from awsfuncs import get_s3_client
+        bucket, _, prefix = output[len("s3://"):].partition("/")
+        if prefix and not prefix.endswith("/"):
+            prefix += "/"
+        s3 = get_s3_client()
+        for suffix, data in artifacts.items():
+            key = f"{prefix}{base}{suffix}"
+            s3.put_object(Bucket=bucket, Key=key, Body=data)
+            paths.append(f"s3://{bucket}/{key}")
+    else:
+        os.makedirs(output, exist_ok=True)
+        for suffix, data in artifacts.items():
+            path = os.path.join(output, f"{base}{suffix}")
+            with open(path, "wb") as f:
+                f.write(data)
+            paths.append(path)
+    return paths
+
+
+@contextlib.contextmanager
+def _profile(stage, settings):
+    _local.active = True
+    profiler = sampler = None
+    started_tracemalloc = False
+    try:
+        if settings["tracemalloc"] and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracemalloc = True
+        if "sampling" in settings["profilers"]:
+            sampler = SamplingProfiler(threading.get_ident(), settings["hz"])
+            sampler.start()
+        if "cprofile" in settings["profilers"] and _cprofile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            _cprofile_lock.release()
+        if sampler is not None:
+            sampler.stop()
+        snapshot = tracemalloc.take_snapshot() if settings["tracemalloc"] and tracemalloc.is_tracing() else None
+        if started_tracemalloc:
+            tracemalloc.stop()
+        _local.active = False
+
+        artifacts = {}
+        if profiler is not None:
+            profiler.create_stats()
+            artifacts[".pstats"] = marshal.dumps(profiler.stats)  # same format as Profile.dump_stats
+        if sampler is not None:
+            artifacts[".collapsed"] = sampler.collapsed().encode()
+        if snapshot is not None:
+            artifacts[".alloc.txt"] = _top_allocations(snapshot, settings["top_n"]).encode()
+
+        base = f"{stage}-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{next(_sequence)}"
+        try:
+            for path in _write_artifacts(settings["output"], base, artifacts):
+                print(f"Profile written: {path}")
+        except Exception as e:
+            print(f"Could not write profile for {stage}: {e}")
+
+
+def profile(stage):
+    """
+    Context manager that profiles the enclosed block when `stage` is enabled.
+    Nested profiled blocks in the same thread are covered by the outer one.
+    """
+    if not os.getenv("PROFILE_STAGES"):
+        return contextlib.nullcontext()
+    settings = _settings()
+    if not is_profiled(stage, settings) or getattr(_local, "active", False):
+        return contextlib.nullcontext()
+    return _profile(stage, settings)
+
+
+def profiled(stage):
+    """Decorator form of `profile(stage)`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profile(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,129 @@
+import os
+import time
+import threading
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+COOLDOWN = 30 #seconds
+
+# Fixed-window cooldown evaluated inside Redis so check-and-set is atomic.
+# KEYS[1] holds the epoch second the next refresh is allowed; returns {allowed, remaining}.
+# ARGV[2] == "peek" only reads the remaining time without taking a slot.
+COOLDOWN_SCRIPT = """
+local now = tonumber(redis.call('TIME')[1])
+local window = tonumber(ARGV[1])
+local next_allowed = tonumber(redis.call('GET', KEYS[1]))
+if next_allowed and now < next_allowed then
+    return {0, next_allowed - now}
+end
+if ARGV[2] == 'peek' then
+    return {1, 0}
+end
+redis.call('SET', KEYS[1], now + window, 'EX', window + 2)
+return {1, window}
+"""
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_redis_pool():
+    """Returns the process-wide Redis connection pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = redis.ConnectionPool(
+                host=os.getenv("REDIS_HOST", "localhost"),
+                port=int(os.getenv("REDIS_PORT", "6379")),
+                username=os.getenv("REDIS_UN"),
+                password=os.getenv("REDIS_PWD"),
+                decode_responses=True,
+                max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "10")),
+                socket_connect_timeout=float(os.getenv("REDIS_CONNECT_TIMEOUT", "1")),
+                socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", "1")),
+                health_check_interval=30,
+            )
+        return _pool
+
+
+class CooldownLimiter:
+    """
+    Per-key refresh cooldown backed by an atomic Redis script.
+
+    Remaining time is cached in-process so reruns do not hit Redis until the
+    cached value expires. If Redis is unreachable the limiter falls back to an
+    in-process table and retries Redis after `retry_after` seconds.
+
+    :param client: redis client (defaults to one on the shared pool)
+    :param cooldown: seconds between allowed refreshes
+    :param cache_ttl: seconds a "no cooldown" answer is trusted locally
+    :param retry_after: seconds to stay on the local fallback after a Redis error
+    """
+
+    def __init__(self, client=None, cooldown=COOLDOWN, cache_ttl=5, retry_after=30):
+        self.client = client if client is not None else redis.Redis(connection_pool=get_redis_pool())
+        self.cooldown = cooldown
+        self.cache_ttl = cache_ttl
+        self.retry_after = retry_after
+        self._script = self.client.register_script(COOLDOWN_SCRIPT)
+        self._lock = threading.Lock()
+        self._cache = {}     # key -> (next_allowed, trusted_until), local monotonic clock
+        self._local = {}     # key -> next_allowed, used while Redis is down
+        self._redis_down_until = 0.0
+
+    def _redis_available(self, now):
+        return now >= self._redis_down_until
+
+    def _mark_down(self, now, error):
+        print(f"Redis unavailable, using local rate limiter: {error}")
+        self._redis_down_until = now + self.retry_after
+
+    def _call(self, key, mode):
+        """Runs the cooldown script, returning (allowed, remaining) or None if Redis is down."""
+        now = time.monotonic()
+        if not self._redis_available(now):
+            return None
+        try:
+            allowed, remaining = self._script(keys=[key], args=[self.cooldown, mode])
+            return bool(allowed), int(remaining)
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            self._mark_down(now, e)
+            return None
+
+    def _local_acquire(self, key, now):
+        next_allowed = self._local.get(key, 0.0)
+        if now < next_allowed:
+            return False, int(next_allowed - now + 0.999)
+        self._local[key] = now + self.cooldown
+        return True, self.cooldown
+
+    def try_acquire(self, key: str) -> tuple[bool, int]:
+        """Attempts to take a refresh slot for `key`. Returns (allowed, seconds remaining)."""
+        result = self._call(key, "acquire")
+        now = time.monotonic()
+        with self._lock:
+            if result is None:
+                result = self._local_acquire(key, now)
+            allowed, remaining = result
+            self._cache[key] = (now + remaining, now + max(remaining, self.cache_ttl))
+        return allowed, remaining
+
+    def remaining(self, key: str) -> int:
+        """Seconds until `key` may refresh again, served from the local cache when fresh."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and now < cached[1]:
+                return max(0, int(cached[0] - now + 0.999))
+
+        result = self._call(key, "peek")
+        now = time.monotonic()
+        with self._lock:
+            if result is None:
+                remaining = max(0, int(self._local.get(key, 0.0) - now + 0.999))
+            else:
+                remaining = result[1]
+            self._cache[key] = (now + remaining, now + max(remaining, self.cache_ttl))
+        return remaining
@@ -0,0 +1,142 @@
+"""
+Nearest-point lookups for the weather grid, and a local gazetteer of town names.
+
+SpatialIndex buckets the points into square bins of a few kilometres
+(equirectangular projection around the points' mean latitude, accurate to well
+under 1% across a state) and keeps them sorted by bin, so one row of bins is a
+contiguous slice. A lookup scans the 3x3 bins around the query and widens only
+if the nearest point found could still be beaten from outside them: a few
+NumPy slices, microseconds for 10k points. Queries outside the points' extent
+fall back to a full vectorized scan.
+
+The gazetteer (GAZETTEER_PATH, default gazetteer.csv next to this file: name,
+latitude, longitude) turns "Boone" or "boone, nc" into coordinates, with close
+spellings accepted.
+"""
+import difflib
+import os
+import re
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = EARTH_RADIUS_KM * np.pi / 180
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer.csv"))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class SpatialIndex:
+    """
+    `SpatialIndex(latitudes, longitudes).nearest(lat, lon)` -> (position, km),
+    where position indexes the arrays the index was built from.
+
+    :param points_per_bin: average points per bin; a few keeps both the bins and the scan small
+    """
+
+    def __init__(self, latitudes, longitudes, points_per_bin=4):
+        lat = np.asarray(latitudes, dtype=np.float64)
+        lon = np.asarray(longitudes, dtype=np.float64)
+        if lat.size == 0:
+            raise ValueError("SpatialIndex needs at least one point")
+        self.lat, self.lon = lat, lon
+        self._lon_scale = np.cos(np.radians(lat.mean())) * KM_PER_DEGREE
+        x, y = lon * self._lon_scale, lat * KM_PER_DEGREE
+        self.x0, self.y0 = x.min(), y.min()
+        width, height = x.max() - self.x0, y.max() - self.y0
+        area = max(width * height, 1e-9)
+        self.bin = max(np.sqrt(area * points_per_bin / lat.size), 1e-6)
+        self.nx = int(width // self.bin) + 1
+        self.ny = int(height // self.bin) + 1
+
+        bx = ((x - self.x0) // self.bin).astype(np.int64)
+        by = ((y - self.y0) // self.bin).astype(np.int64)
+        keys = by * self.nx + bx
+        self.order = np.argsort(keys, kind="stable")
+        self.x, self.y = x[self.order], y[self.order]
+        # offsets[k]:offsets[k + 1] are the sorted positions of the points in bin k
+        self.offsets = np.searchsorted(keys[self.order], np.arange(self.nx * self.ny + 1))
+
+    def __len__(self):
+        return self.lat.size
+
+    def _scan(self, qx, qy, bx, by, r):
+        """Best (sorted position, squared km) among the bins within r of (bx, by)."""
+        x_lo, x_hi = max(bx - r, 0), min(bx + r, self.nx - 1)
+        best, best_d2 = -1, np.inf
+        for row in range(max(by - r, 0), min(by + r, self.ny - 1) + 1):
+            lo, hi = self.offsets[row * self.nx + x_lo], self.offsets[row * self.nx + x_hi + 1]
+            if lo == hi:
+                continue
+            d2 = (self.x[lo:hi] - qx) ** 2 + (self.y[lo:hi] - qy) ** 2
+            i = int(d2.argmin())
+            if d2[i] < best_d2:
+                best, best_d2 = lo + i, d2[i]
+        return best, best_d2
+
+    def nearest(self, lat, lon):
+        qx, qy = lon * self._lon_scale - self.x0, lat * KM_PER_DEGREE - self.y0
+        bx, by = int(qx // self.bin), int(qy // self.bin)
+        if not (0 <= bx < self.nx and 0 <= by < self.ny):
+            d2 = (self.x - self.x0 - qx) ** 2 + (self.y - self.y0 - qy) ** 2
+            best = int(d2.argmin())
+        else:
+            qx, qy = qx + self.x0, qy + self.y0
+            r = 1
+            while True:
+                best, best_d2 = self._scan(qx, qy, bx, by, r)
+                # Anything outside the scanned block is at least this far away
+                margin = min(
+                    qx - (self.x0 + (bx - r) * self.bin), (self.x0 + (bx + r + 1) * self.bin) - qx,
+                    qy - (self.y0 + (by - r) * self.bin), (self.y0 + (by + r + 1) * self.bin) - qy,
+                )
+                covers_all = bx - r <= 0 and by - r <= 0 and bx + r >= self.nx - 1 and by + r >= self.ny - 1
+                if covers_all or (best >= 0 and best_d2 <= margin ** 2):
+                    break
+                r *= 2
+        position = int(self.order[best])
+        return position, float(haversine_km(lat, lon, self.lat[position], self.lon[position]))
+
+
+def load_gazetteer(path=None):
+    """name, latitude, longitude per place; `key` is the normalized name used for lookups."""
+    df = pd.read_csv(path or GAZETTEER_PATH)
+    df["key"] = df["name"].map(normalize_place)
+    return df.drop_duplicates("key").reset_index(drop=True)
+
+
+def normalize_place(name):
+    name = re.sub(r",?\s*(nc|north carolina)\s*$", "", name.strip().lower())
+    return re.sub(r"[^a-z0-9]+", " ", name).strip()
+
+
+_COORDINATES = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*[, ]\s*(-?\d+(?:\.\d+)?)\s*$")
+
+
+def resolve_place(text, gazetteer):
+    """
+    "35.6, -82.55" or a town name -> (latitude, longitude, label), or None when
+    nothing matches.
+    """
+    match = _COORDINATES.match(text)
+    if match:
+        lat, lon = float(match.group(1)), float(match.group(2))
+        if -90 <= lat <= 90 and -180 <= lon <= 180:
+            return lat, lon, f"{lat:.4f}, {lon:.4f}"
+        return None
+    key = normalize_place(text)
+    rows = gazetteer[gazetteer["key"] == key]
+    if rows.empty:
+        close = difflib.get_close_matches(key, gazetteer["key"].tolist(), n=1, cutoff=0.8)
+        if not close:
+            return None
+        rows = gazetteer[gazetteer["key"] == close[0]]
+    row = rows.iloc[0]
+    return float(row["latitude"]), float(row["longitude"]), row["name"]
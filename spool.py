@@ -0,0 +1,354 @@
+"""
+A local spool for fetched weather batches, so an S3 or Postgres outage delays
+delivery instead of dropping it.
+
+    spool = Spool("spool")
+    spool.append_csv("data/weather_2025-07-01.csv")   # durable once this returns
+    spool.flush(bucket_name)                           # S3 + DB, whatever is pending
+
+Layout under SPOOL_DIR: each batch is a Parquet file in batches/, and wal.jsonl
+is an append-only log of what happened to them. An "append" record is written
+(and fsynced) only after its batch file is, and a "done" record after the batch
+reached a target ("s3" or "db"). Replaying the log gives every batch's state;
+a torn last line from a crash is ignored.
+
+A flush groups the pending batches by file, later batches winning per
+(location_id, time), so frequent small fetches of the same day become one S3
+PUT and one DB insert. In both targets the newest delivery of a row wins, and
+both are idempotent, which makes a replay after a crash between a write and its
+"done" record harmless:
+
+    S3  the batches are merged into the existing object, if any
+    DB  rows already loaded for that file at the same (location_id, time) are
+        replaced by the batch's, all files in one transaction
+
+so delivery is at least once and the end result exactly once. The file's
+forecast run (forecasts.py) keeps its first delivery; revisions only reach
+formatted_weather_data. S3 and the DB are
+tracked separately: a DB outage does not hold back the S3 upload, nor the other
+way round. Fully delivered batches are removed from the log and disk at the end
+of each flush.
+
+SPOOL_MIN_ROWS / SPOOL_MAX_AGE (seconds) make flush() wait until that many rows
+are pending or the oldest batch is that old (default: flush whenever anything is
+pending). `python spool.py status|flush` inspects or drains it by hand.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+import pandas as pd
+import psycopg2
+from dotenv import load_dotenv
+from anomaly import rebuild_slots
+from awsfuncs import file_exists_in_s3, get_s3_client
+from db import delete_weather_rows, load_weather_frame
+from lake import read_table
+from metrics import incr, span
+
+try:
+    import fcntl
+except ImportError:  # Windows: the spool is then only safe within one process
+    fcntl = None
+
+load_dotenv()
+
+SPOOL_DIR = os.getenv("SPOOL_DIR", "")
+SPOOL_MIN_ROWS = int(os.getenv("SPOOL_MIN_ROWS", "0"))
+SPOOL_MAX_AGE = float(os.getenv("SPOOL_MAX_AGE", "0"))
+TARGETS = ("s3", "db")
+KEY = ["location_id", "time"]
+
+
+def get_spool():
+    """The Spool at SPOOL_DIR, or None when spooling is off."""
+    return Spool(SPOOL_DIR) if SPOOL_DIR else None
+
+
+def merge_batches(frames):
+    """Concatenates CSV-shaped frames, the last one winning per (location_id, time), sorted."""
+    df = pd.concat(frames, ignore_index=True)
+    df["time"] = pd.to_datetime(df["time"], utc=True)
+    df = df.drop_duplicates(KEY, keep="last")
+    return df.sort_values(KEY, kind="stable").reset_index(drop=True)
+
+
+class Spool:
+    def __init__(self, directory, min_rows=SPOOL_MIN_ROWS, max_age=SPOOL_MAX_AGE):
+        self.directory = directory
+        self.batches_dir = os.path.join(directory, "batches")
+        self.wal_path = os.path.join(directory, "wal.jsonl")
+        self.min_rows = min_rows
+        self.max_age = max_age
+        self._thread_locks = {"wal.lock": threading.Lock(), "flush.lock": threading.Lock()}
+        os.makedirs(self.batches_dir, exist_ok=True)
+
+    # Log
+
+    @contextmanager
+    def _locked(self, name="wal.lock", block=True):
+        """Exclusive lock across threads and processes; yields False if `block` is off and it is taken."""
+        thread_lock = self._thread_locks[name]
+        if not thread_lock.acquire(blocking=block):
+            yield False
+            return
+        try:
+            if fcntl is None:
+                yield True
+                return
+            with open(os.path.join(self.directory, name), "a") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX if block else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+                try:
+                    yield True
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        finally:
+            thread_lock.release()
+
+    def _write_records(self, records):
+        """Appends records to the log and fsyncs it. Caller holds the WAL lock."""
+        with open(self.wal_path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _replay(self):
+        """{batch id: {"file", "rows", "at", "s3", "db"}} in append order."""
+        batches = {}
+        if not os.path.exists(self.wal_path):
+            return batches
+        with open(self.wal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn write from a crash
+                if record["op"] == "append":
+                    batches[record["id"]] = {"file": record["file"], "rows": record["rows"], "at": record["at"],
+                                             "s3": False, "db": False}
+                elif record["op"] == "done":
+                    for batch_id in record["ids"]:
+                        if batch_id in batches:
+                            batches[batch_id][record["target"]] = True
+        return batches
+
+    def _batch_path(self, batch_id):
+        return os.path.join(self.batches_dir, f"{batch_id}.parquet")
+
+    def _read_batches(self, ids):
+        return merge_batches([pd.read_parquet(self._batch_path(i)) for i in ids])
+
+    def _mark(self, ids, target):
+        with self._locked():
+            self._write_records([{"op": "done", "ids": list(ids), "target": target}])
+
+    # Producers
+
+    def append(self, filename, df):
+        """Spools `df` (CSV-shaped rows of `filename`) and returns its batch id once it is on disk."""
+        batch_id = f"{time.time_ns():x}-{uuid.uuid4().hex[:8]}"
+        path = self._batch_path(batch_id)
+        with span("spool_append", file=filename, rows=len(df)), self._locked():
+            with open(f"{path}.tmp", "wb") as f:
+                df.to_parquet(f, index=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(f"{path}.tmp", path)
+            self._write_records([{"op": "append", "id": batch_id, "file": filename, "rows": len(df),
+                                  "at": time.time()}])
+        incr("spool_batches_appended")
+        return batch_id
+
+    def append_csv(self, path):
+        """Spools a fetched CSV under its own file name and deletes it."""
+        filename = os.path.basename(path)
+        batch_id = self.append(filename, pd.read_csv(path))
+        os.remove(path)
+        print(f"Spooled {filename} as batch {batch_id}.")
+        return batch_id
+
+    # State
+
+    def pending(self):
+        """Batches not yet delivered to both targets: {batch id: state}."""
+        return {i: b for i, b in self._replay().items() if not all(b[t] for t in TARGETS)}
+
+    def holds(self, filename):
+        """Whether rows of `filename` are waiting in the spool."""
+        return any(b["file"] == filename for b in self.pending().values())
+
+    def status(self):
+        pending = self.pending()
+        return {
+            "batches": len(pending),
+            "rows": sum(b["rows"] for b in pending.values()),
+            "files": sorted({b["file"] for b in pending.values()}),
+            **{f"pending_{t}": sum(not b[t] for b in pending.values()) for t in TARGETS},
+            "oldest_s": round(time.time() - min((b["at"] for b in pending.values()), default=time.time()), 1),
+        }
+
+    def due(self, pending=None):
+        """Whether enough is pending (SPOOL_MIN_ROWS) or the oldest batch is old enough (SPOOL_MAX_AGE) to flush."""
+        pending = self.pending() if pending is None else pending
+        if not pending:
+            return False
+        rows = sum(b["rows"] for b in pending.values())
+        oldest = min(b["at"] for b in pending.values())
+        return rows >= self.min_rows or time.time() - oldest >= self.max_age
+
+    # Flusher
+
+    def flush(self, bucket_name=None, s3_client=None, conn=None, schema="WeatherData", prefix="", force=False,
+              lease=None):
+        """
+        Delivers every pending batch to S3 and the DB, one merged write per file.
+        Failures are printed and leave the batches pending for the next flush.
+        Pass the load stage's `lease` (leases.Lease) to fence the DB write: it only
+        commits while that lease is still held.
+        Returns {"s3_files", "db_files", "db_rows", "pending", "errors"}.
+        """
+        summary = {"s3_files": 0, "db_files": 0, "db_rows": 0, "pending": 0, "errors": []}
+        with self._locked("flush.lock", block=False) as acquired:
+            if not acquired:
+                print("Another flush of this spool is running; skipping.")
+                summary["pending"] = len(self.pending())
+                return summary
+            pending = self.pending()
+            if not pending or not (force or self.due(pending)):
+                summary["pending"] = len(pending)
+                return summary
+
+            bucket_name = bucket_name or os.getenv("BUCKET_NAME")
+            # One client for both targets; making it does not touch the network
+            s3_client = s3_client or get_s3_client()
+            with span("spool_flush", batches=len(pending)):
+                self._flush_s3(pending, bucket_name, s3_client, prefix, summary)
+                self._flush_db(pending, bucket_name, s3_client, conn, schema, prefix, summary, lease)
+                self.checkpoint()
+            summary["pending"] = len(self.pending())
+        print(f"Spool flush: {summary['s3_files']} files to S3, {summary['db_rows']} rows from "
+              f"{summary['db_files']} files to the DB, {summary['pending']} batches still pending.")
+        return summary
+
+    @staticmethod
+    def _by_file(pending, target):
+        files = {}
+        for batch_id, batch in pending.items():
+            if not batch[target]:
+                files.setdefault(batch["file"], []).append(batch_id)
+        return files
+
+    def _flush_s3(self, pending, bucket_name, s3_client, prefix, summary):
+        files = self._by_file(pending, "s3")
+        if not files:
+            return
+        try:
+            for filename, ids in files.items():
+                key = f"{prefix}{filename}"
+                df = self._read_batches(ids)
+                if file_exists_in_s3(bucket_name, key, s3_client):
+                    df = merge_batches([read_table(bucket_name, key, s3_client).to_pandas(), df])
+                body = df.to_csv(index=False).encode()
+                with span("s3_put", key=key):
+                    s3_client.put_object(Bucket=bucket_name, Key=key, Body=body)
+                incr("bytes_uploaded", len(body))
+                self._mark(ids, "s3")
+                summary["s3_files"] += 1
+        except Exception as e:
+            # Most likely the whole service is down; the remaining files wait for the next flush
+            print(f"Spool flush to S3 failed: {e}")
+            summary["errors"].append(f"s3: {e}")
+
+    def _flush_db(self, pending, bucket_name, s3_client, conn, schema, prefix, summary, lease=None):
+        files = self._by_file(pending, "db")
+        if not files:
+            return
+        close_conn = conn is None
+        try:
+            if conn is None:
+                conn = psycopg2.connect(os.getenv("DB_URL"))
+            cursor = conn.cursor()
+        except Exception as e:
+            print(f"Spool flush to the DB failed: {e}")
+            summary["errors"].append(f"db: {e}")
+            return
+
+        try:
+            rows = 0
+            for filename, ids in files.items():
+                df = self._read_batches(ids)
+                # Rows of this file an earlier flush (or an interrupted one) committed are
+                # replaced, so a revised hour ends up the same here as in S3
+                replaced = delete_weather_rows(cursor, df, schema, filename)
+                rows += len(load_weather_frame(cursor, df, filename, schema, s3_client=s3_client,
+                                               bucket_name=bucket_name, prefix=prefix))
+                # The loader counted them as new hours; recompute their slots from the table
+                rebuild_slots(cursor, replaced, schema)
+            if lease is not None:
+                lease.check(cursor)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Spool flush to the DB failed: {e}")
+            summary["errors"].append(f"db: {e}")
+            return
+        finally:
+            cursor.close()
+            if close_conn:
+                conn.close()
+
+        self._mark([i for ids in files.values() for i in ids], "db")
+        incr("rows_loaded", rows)
+        summary["db_files"] += len(files)
+        summary["db_rows"] += rows
+
+    def checkpoint(self):
+        """Drops fully delivered batches: rewrites the log with the rest and deletes their files."""
+        with self._locked():
+            batches = self._replay()
+            done = {i for i, b in batches.items() if all(b[t] for t in TARGETS)}
+            if not done:
+                return
+            records = []
+            for batch_id, batch in batches.items():
+                if batch_id in done:
+                    continue
+                records.append({"op": "append", "id": batch_id, "file": batch["file"], "rows": batch["rows"],
+                                "at": batch["at"]})
+                records.extend({"op": "done", "ids": [batch_id], "target": t} for t in TARGETS if batch[t])
+            with open(f"{self.wal_path}.tmp", "w", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(f"{self.wal_path}.tmp", self.wal_path)
+            for batch_id in done:
+                try:
+                    os.remove(self._batch_path(batch_id))
+                except FileNotFoundError:
+                    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or drain the local spool.")
+    parser.add_argument("command", choices=["status", "flush"])
+    parser.add_argument("--dir", default=SPOOL_DIR or "spool")
+    parser.add_argument("--schema", default="WeatherData")
+    args = parser.parse_args()
+
+    spool = Spool(args.dir)
+    if args.command == "flush":
+        spool.flush(schema=args.schema, force=True)
+    print(json.dumps(spool.status(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
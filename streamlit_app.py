@@ -1,13 +1,20 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import psycopg2
 import pandas as pd
 import os
 from dotenv import load_dotenv
-import altair as alt
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import time
 from streamlit_autorefresh import st_autorefresh
-import redis
+from ratelimit import CooldownLimiter, COOLDOWN
+from history import RESOLUTIONS, choose_resolution, date_range_bounds, downsample_long, fetch_history
+from lakequery import fetch_history as fetch_lake_history, use_lake
+from lake import read_grid_cell, read_grid_cells
+from spatial import SpatialIndex, load_gazetteer, resolve_place
+from tsstore import TimeSeriesStore
+from charts import METRICS, hourly_chart_spec, history_chart_spec, is_vega_spec, vega_embed_html
+from profiling import profile
 import uuid
 
 # This will cause the script to rerun every 1 second, enabling a live countdown.
@@ -15,31 +22,20 @@ st_autorefresh(interval=5000, key="live_cooldown", limit=100)
 
 load_dotenv()
 DB_URL = os.getenv("DB_URL")
-COOLDOWN = 30 #seconds
-r = redis.Redis(
-    host=os.getenv("REDIS_HOST"),
-    port=os.getenv("REDIS_PORT"),
-    decode_responses=True,
-    username=os.getenv("REDIS_UN"),
-    password=os.getenv("REDIS_PWD")
-)
+
+@st.cache_resource(show_spinner=False)
+def get_limiter() -> CooldownLimiter:
+    # One limiter per process so the Redis pool and remaining-time cache survive reruns
+    return CooldownLimiter(cooldown=COOLDOWN)
+
+limiter = get_limiter()
 
 def can_refresh(key: str) -> bool:
-    now = int(time.time())
-    next_allowed = r.get(key)
-    if next_allowed is not None and now < int(next_allowed):
-        return False  # still cooling down
-    # set next_allowed with slight buffer
-    r.set(key, now + COOLDOWN, ex=COOLDOWN + 2)
-    return True
+    allowed, _ = limiter.try_acquire(key)
+    return allowed
 
 def get_cooldown_remaining(key: str) -> int:
-    now = int(time.time())
-    next_allowed = r.get(key)
-    if next_allowed is None:
-        return 0
-    remaining = int(next_allowed) - now
-    return max(0, remaining)
+    return limiter.remaining(key)
 
 # --- persistent client identifier (survives refresh) ---
 if "client_key" not in st.session_state:
@@ -52,45 +48,87 @@ client_key = st.session_state.client_key
 def make_redis_key(client_key: str) -> str:
     return f"cooldown:{client_key}"
 
-@st.cache_data(show_spinner=False)
-def fetch_today_data(db_url: str, today: date, bust: int):
+def show_chart(spec: dict):
+    # Pre-transformed Vega specs (CHART_TRANSFORMS=server) are not Vega-Lite, so embed them directly
+    if is_vega_spec(spec):
+        components.html(vega_embed_html(spec), height=spec.get("height", 350) + 120)
+    else:
+        st.vega_lite_chart(spec, use_container_width=True)
+
+@st.cache_resource(show_spinner=False)
+def get_store() -> TimeSeriesStore:
+    # One store per process; reruns slice NumPy arrays instead of querying Postgres
+    return TimeSeriesStore(lambda: psycopg2.connect(DB_URL))
+
+store = get_store()
+
+def refresh_store(bust: int):
+    # Pull new rows at most every few minutes, or right away after the refresh button
+    store.refresh(force=st.session_state.get("store_bust") != bust)
+    st.session_state.store_bust = bust
+
+def fetch_today_data(bust: int):
     try:
-        conn = psycopg2.connect(db_url)
-        query = """
-            SELECT * FROM "WeatherData"."formatted_weather_data"
-            WHERE time >= NOW() - INTERVAL '24 hours'
-            ORDER BY time ASC
-            LIMIT 72;
-        """
-        df = pd.read_sql_query(query, conn)
-        conn.close()
-        return df
+        refresh_store(bust)
+        return store.recent(hours=24)
     except Exception as e:
         st.warning(f"fetch_today_data failed: {e}")
         return pd.DataFrame()  # safe empty fallback
-    finally:
-        conn.close()
 
 @st.cache_data(show_spinner=False)
-def fetch_weekly_data(db_url: str, location_id: str, today: date, bust: int):
+def fetch_history_data(db_url: str, location_id: str, start: date, end: date, resolution: str, bust: int):
+    conn = None
     try:
         conn = psycopg2.connect(db_url)
-        query = """
-            SELECT *
-            FROM "WeatherData"."formatted_weather_data"
-            WHERE location_id = %s
-              AND time >= (date_trunc('day', now() AT TIME ZONE 'UTC') - INTERVAL '6 days')
-              AND time <  (date_trunc('day', now() AT TIME ZONE 'UTC') + INTERVAL '1 day')
-            ORDER BY time ASC;
-        """
-        df = pd.read_sql_query(query, conn, params=(location_id,))
-        conn.close()
-        return df
+        return fetch_history(conn, location_id, start, end, resolution)
     except Exception as e:
-        st.warning(f"fetch_weekly_data failed: {e}")
+        st.warning(f"fetch_history_data failed: {e}")
         return pd.DataFrame()
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
+
+@st.cache_data(show_spinner=False)
+def fetch_lake_history_data(location_id: str, start: date, end: date, resolution: str, bust: int):
+    try:
+        return fetch_lake_history(location_id, start, end, resolution)
+    except Exception as e:
+        st.warning(f"lake history query failed, querying database: {e}")
+        return None
+
+@st.cache_resource(show_spinner=False)
+def get_grid_locator():
+    # Cells, their spatial index and the gazetteer, built once per process; None until the grid exists
+    try:
+        cells = read_grid_cells(os.getenv("BUCKET_NAME"))
+    except Exception as e:
+        print(f"Grid cells unavailable: {e}")
+        return None
+    return cells, SpatialIndex(cells["latitude"], cells["longitude"]), load_gazetteer()
+
+@st.cache_data(show_spinner=False)
+def fetch_grid_cell_data(cell: int, day: str, bust: int):
+    try:
+        return read_grid_cell(os.getenv("BUCKET_NAME"), day, cell)
+    except Exception as e:
+        st.warning(f"grid lookup failed: {e}")
+        return pd.DataFrame()
+
+def load_history(location_id: str, start: date, end: date, resolution: str, bust: int):
+    # Raw ranges inside the in-memory retention come from the store; the rest go to
+    # the lake (HISTORY_BACKEND=lake) or Postgres
+    lower, upper = date_range_bounds(start, end)
+    if resolution == "raw" and store.covers(lower):
+        try:
+            refresh_store(bust)
+            return store.window(location_id, lower, upper)
+        except Exception as e:
+            st.warning(f"store lookup failed, querying database: {e}")
+    if use_lake():
+        df = fetch_lake_history_data(location_id, start, end, resolution, bust)
+        if df is not None:
+            return df
+    return fetch_history_data(DB_URL, location_id, start, end, resolution, bust)
 
 
 redis_key = make_redis_key(client_key)
@@ -122,26 +160,19 @@ st.set_page_config(layout="wide")
 st.title("🌤️ Nail's Weather Dashboard", anchor=False)
 st.write(f"Live hourly weather metrics from North Carolina cities.  Date: {datetime.now():%Y-%m-%d}")
 
-df = fetch_today_data(DB_URL, date.today(), st.session_state.refresh_bust)
-df.columns = df.columns.str.lower()  # normalize column names
-
-# Prepare time/hour labels
-df['time'] = pd.to_datetime(df['time'])
-df['hour'] = df['time'].dt.hour
-df['hour_label'] = df['time'].dt.strftime('%-I%p')  # e.g., 1AM, 2PM
-
-# Clean location_id
-df['location_id'] = df['location_id'].astype(str).str.strip()
-available_locations = df['location_id'].dropna().unique()
-
-# Metric definitions: key -> (display name, unit)
-METRICS = {
-    "temp_f": ("Temperature", "°F"),
-    "cloud_cover_perc": ("Cloud Cover", "%"),
-    "surface_pressure": ("Surface Pressure", "hPa"),
-    "wind_speed_80m_mph": ("Wind Speed @80m", "mph"),
-    "wind_direction_80m_deg": ("Wind Direction @80m", "°")
-}
+# Data prep is profiled when PROFILE_STAGES includes "dashboard"
+with profile("dashboard"):
+    df = fetch_today_data(st.session_state.refresh_bust)
+    df.columns = df.columns.str.lower()  # normalize column names
+
+    # Prepare time/hour labels
+    df['time'] = pd.to_datetime(df['time'])
+    df['hour'] = df['time'].dt.hour
+    df['hour_label'] = df['time'].dt.strftime('%-I%p')  # e.g., 1AM, 2PM
+
+    # Clean location_id
+    df['location_id'] = df['location_id'].astype(str).str.strip()
+    available_locations = df['location_id'].dropna().unique()
 
 # Sidebar selector with friendly labels
 metric_options = [f"{name} ({unit})" for name, unit in (METRICS[m] for m in METRICS)]
@@ -172,116 +203,13 @@ for i, loc_id in enumerate(available_locations):
             st.warning("No data available.")
             continue
 
-        # Build long-form data: one row per hour per metric
-        records = []
-        for metric in selected_metrics:
-            display_name, unit = METRICS[metric]
-            # Use raw chronological values; if multiple per hour you could aggregate (e.g., last or mean)
-            agg = (
-                loc_df.groupby(["hour", "hour_label"])[metric]
-                .mean()  # collapse duplicates per hour; remove if you want full timestamp series
-                .reset_index()
-                .sort_values("hour")
-            )
-            if agg.empty:
-                continue
-            agg = agg.rename(columns={metric: "value"})
-            agg["metric"] = f"{display_name} ({unit})"
-            records.append(agg[["hour", "hour_label", "metric", "value"]])
-
-        # st.write(records) ## TEST
-
-        if not records:
+        # Spec is compiled once per (location, metrics, data version, day) and reused across reruns
+        spec = hourly_chart_spec(loc_df, selected_metrics, loc_id, date.today())
+        if spec is None:
             st.info("No metric data to display for selected filters.")
             continue
 
-        long_df = pd.concat(records, ignore_index=True)
-
-        # st.write(long_df) ## TEST
-
-        # Selection for hover nearest hour
-        hover = alt.selection_point(
-        fields=["hour"],
-        nearest=True,
-        on="mouseover",
-        empty="none",
-        clear="mouseout"
-        )
-
-        # Base lines: one line per metric
-        lines = (
-            alt.Chart(long_df)
-            .mark_line()
-            .encode(
-                x=alt.X(
-                    "hour:O",
-                    title="Hour of Day",
-                    axis=alt.Axis(
-                        labelExpr="""
-                            datum.value == 0 ? '12AM' :
-                            datum.value < 12 ? datum.value + 'AM' :
-                            datum.value == 12 ? '12PM' :
-                            (datum.value - 12) + 'PM'
-                        """,
-                        labelAngle=0
-                    ),
-                ),
-                y=alt.Y("value:Q", title=None),
-                        color=alt.Color(
-                            "metric:N",
-                            title="Metric",
-                            scale=alt.Scale(scheme="category10"),
-                            legend=alt.Legend(orient="top", titleFontSize=12, labelFontSize=11),
-                        ),
-            )
-        )
-
-        points = (
-            alt.Chart(long_df)
-            .transform_filter(hover)
-            .mark_circle(size=80)
-            .encode(
-                x=alt.X("hour:O"),
-                y=alt.Y("value:Q"),
-                color=alt.Color("metric:N", title="Metric"),
-                tooltip=[
-                    alt.Tooltip("hour_label:N", title="Hour"),
-                    alt.Tooltip("metric:N", title="Metric"),
-                    alt.Tooltip("value:Q", title="Value", format=".2f"),
-                ],
-            )
-        )
-        summary = (
-                    long_df
-                    .groupby(["hour", "hour_label"], sort=False)
-                    .apply(
-                        lambda g: ", ".join(f"{m}: {v:.1f}" for m, v in zip(g["metric"], g["value"])),
-                        include_groups=False
-                    )
-                    .reset_index(name="summary")
-                )
-        
-        rule = (
-            alt.Chart(summary)
-            .mark_rule(color="gray")
-            .encode(
-                x=alt.X("hour:O"),
-                opacity=alt.condition(hover, alt.value(1), alt.value(0)),
-                tooltip=[
-                    alt.Tooltip("hour_label:N", title="Hour"),
-                    alt.Tooltip("summary:N", title="Values")
-                ]
-            )
-            .add_params(hover)
-        )
-
-        final_chart = (
-            alt.layer(lines, points, rule)
-            .resolve_scale(y="shared")
-            .properties(width=350, height=350)
-            .interactive()
-        )
-        st.altair_chart(final_chart, use_container_width=True)
+        show_chart(spec)
 
 
 # Mapping location IDs to friendly city names and reverse
@@ -293,7 +221,7 @@ CITY_MAP = {
 REVERSE_CITY_MAP = {v: k for k, v in CITY_MAP.items()}
 
 st.markdown("---")
-st.header("📈 Weekly History", anchor= False)
+st.header("📈 History", anchor= False)
 
 # Sidebar-like selectors (you can also place them inline)
 col_main, col_controls = st.columns([3, 1])
@@ -323,117 +251,77 @@ with col_controls:
     )
     selected_metrics_week = [label_to_key[lbl] for lbl in selected_labels_week if lbl in label_to_key]
     if not selected_metrics_week:
-        st.warning("Pick at least one metric for weekly history.")
+        st.warning("Pick at least one metric for history.")
         st.stop()
 
+    # 3. Date range (defaults to the past week) and resolution
+    today = date.today()
+    date_range = st.date_input(
+        "Date range",
+        value=(today - timedelta(days=6), today),
+        max_value=today,
+        key="history_range"
+    )
+    if not isinstance(date_range, tuple) or len(date_range) != 2:
+        st.info("Pick a start and end date.")
+        st.stop()
+    range_start, range_end = date_range
+
+    auto_resolution = choose_resolution(range_start, range_end)
+    resolution_options = ["auto"] + list(RESOLUTIONS)
+    resolution_choice = st.selectbox(
+        "Resolution",
+        options=resolution_options,
+        format_func=lambda r: f"auto ({auto_resolution})" if r == "auto" else r,
+        key="history_resolution"
+    )
+    resolution = auto_resolution if resolution_choice == "auto" else resolution_choice
+
 
 with col_main:
-    st.subheader(f"Past 7 Days — {city_friendly}", anchor= False)
+    st.subheader(f"{range_start:%b %d, %Y} – {range_end:%b %d, %Y} — {city_friendly} ({resolution})", anchor= False)
 
-    week_df = fetch_weekly_data(DB_URL, city_friendly, date.today(), 
-                                st.session_state.refresh_bust)
+    week_df = load_history(city_friendly, range_start, range_end, resolution,
+                           st.session_state.refresh_bust)
     
     week_df.columns = week_df.columns.str.lower()
     if week_df.empty:
-        st.info("No weekly data available for that selection.")
+        st.info("No history available for that selection.")
 
     else:
         # Prepare for plotting
         week_df["time"] = pd.to_datetime(week_df["time"])
-        week_df["hour_label"] = week_df["time"].dt.strftime("%-I%p")
-        # Build long-form for selected metrics
-        records = []
-        for metric in selected_metrics_week:
-            display_name, unit = METRICS[metric]
-            tmp = week_df[["time", metric]].copy()
-            tmp = tmp.rename(columns={metric: "value"})
-            tmp["metric"] = f"{display_name} ({unit})"
-            # Keep raw time-series (no collapsing)
-            records.append(tmp[["time", "metric", "value"]])
-
-        long_week = pd.concat(records, ignore_index=True)
-
-        summary_week = (
-            long_week
-            .groupby(["time"], sort=False)
-            .apply(
-                lambda g: ", ".join(f"{m}: {v:.1f}" for m, v in zip(g["metric"], g["value"])),
-                include_groups=False
-            )
-            .reset_index(name="summary")
-        )
-
-
-        # Hover selection on time (nearest timestamp)
-        hover_time = alt.selection_point(
-            fields=["time"],
-            nearest=True,
-            on="mouseover",
-            empty="none",
-            clear="mouseout"
-        )
-
-        # Line layer
-        lines_week = (
-            alt.Chart(long_week)
-            .mark_line()
-            .encode(
-                x=alt.X("time:T", title="Time", axis=alt.Axis(format="%b %d %I %p")),
-                y=alt.Y("value:Q", title=None),
-                color=alt.Color(
-                    "metric:N", 
-                    title="Metric", 
-                    scale=alt.Scale(scheme="category10"),
-                    legend=alt.Legend(orient="top", titleFontSize=12, labelFontSize=11)),
-                tooltip=[
-                    alt.Tooltip("time:T", title="Time", format="%Y-%m-%d %I:%M %p"),
-                    alt.Tooltip("metric:N", title="Metric"),
-                    alt.Tooltip("value:Q", title="Value", format=".2f"),
-                ],
-            )
-        )
-
-        # Points at hovered time
-        points_week = (
-            alt.Chart(long_week)
-            .transform_filter(hover_time)
-            .mark_circle(size=80)
-            .encode(
-                x="time:T",
-                y="value:Q",
-                color=alt.Color("metric:N", scale=alt.Scale(scheme="category10"), legend=None),
-                tooltip=[
-                    alt.Tooltip("time:T", title="Time", format="%Y-%m-%d %I:%M %p"),
-                    alt.Tooltip("metric:N", title="Metric"),
-                    alt.Tooltip("value:Q", title="Value", format=".2f"),
-                ],
-            )
-        )
-
-        # Rule with combined tooltip from summary_week
-        rule_week = (
-            alt.Chart(summary_week)
-            .mark_rule(color="gray")
-            .encode(
-                x=alt.X("time:T"),
-                opacity=alt.condition(hover_time, alt.value(1), alt.value(0)),
-                tooltip=[
-                    alt.Tooltip("time:T", title="Time", format="%Y-%m-%d %I:%M %p"),
-                    alt.Tooltip("summary:N", title="All metrics"),
-                ],
-            )
-            .add_params(hover_time)
-        )
-
-        # Compose with independent y-scales
-        big_chart = (
-            alt.layer(lines_week, points_week, rule_week)
-            .resolve_scale(y="shared")
-            .properties(height=500)
-            .interactive()
-        )
-
-        st.altair_chart(big_chart, use_container_width=True)
+        # Cap points per metric series while keeping peaks/troughs (LTTB)
+        big_spec = history_chart_spec(week_df, selected_metrics_week, city_friendly,
+                                      (range_start, range_end, resolution), prepare=downsample_long)
+
+        show_chart(big_spec)
+
+st.markdown("---")
+st.header("🗺️ Anywhere in NC", anchor= False)
+
+grid_locator = get_grid_locator()
+if grid_locator is None:
+    st.info("The statewide grid has not been fetched yet.")
+else:
+    grid_cells, grid_index, gazetteer = grid_locator
+    place = st.text_input("Town or coordinates (lat, lon)", value="Boone", key="grid_place")
+    resolved = resolve_place(place, gazetteer)
+    if resolved is None:
+        st.warning("Unknown place; try a nearby town or coordinates like 35.6, -82.55.")
+    else:
+        lat, lon, label = resolved
+        position, km = grid_index.nearest(lat, lon)
+        cell = grid_cells.iloc[position]
+        st.caption(f"{label}: nearest grid point {cell['latitude']:.2f}, {cell['longitude']:.2f} ({km:.1f} km away)")
+        today_str = date.today().isoformat()
+        cell_df = fetch_grid_cell_data(int(cell["cell"]), today_str, st.session_state.refresh_bust)
+        if cell_df.empty:
+            st.info("No grid data for today yet.")
+        else:
+            cell_df["time"] = pd.to_datetime(cell_df["time"])
+            show_chart(history_chart_spec(cell_df, selected_metrics_week, f"grid-{int(cell['cell'])}",
+                                          (date.today(), date.today(), "raw")))
 
 with st.expander("ℹ️ About Me & System Architecture", expanded=True):
     st.markdown("""
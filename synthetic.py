@@ -0,0 +1,157 @@
+"""
+Synthetic hourly weather for scale testing formatted_weather_data.
+
+Each location gets an annual and a diurnal temperature cycle, a slowly varying
+pressure signal, wind that picks up as pressure drops, cloud cover that follows
+low pressure (and damps the afternoon peak), and a wandering wind direction.
+Rows use the same CSV column names as weathercalls and are tagged with one
+weather_<date>.csv file name per day, like real loads.
+
+    python synthetic.py --locations 50 --years 2 --schema aq_scale
+"""
+import argparse
+import os
+from io import BytesIO
+import numpy as np
+import pandas as pd
+import psycopg2
+import pyarrow as pa
+import pyarrow.csv as pacsv
+from dotenv import load_dotenv
+from db import CSV_TO_DB_COLUMNS
+
+load_dotenv()
+
+# Roughly the spread of the real cities, widened so many locations differ
+LAT_RANGE = (33.0, 37.0)
+
+
+def smooth_noise(rng, n, tau_hours, scale):
+    """Red noise: white noise convolved with an exponential kernel (correlation time `tau_hours`)."""
+    taps = np.exp(-np.arange(int(tau_hours * 5)) / tau_hours)
+    taps /= np.sqrt((taps ** 2).sum())
+    white = rng.standard_normal(n + len(taps) - 1)
+    return np.convolve(white, taps, mode="valid")[:n] * scale
+
+
+def location_series(location_id, times, latitude, rng):
+    """One location's hourly series over `times` (a UTC DatetimeIndex), CSV-shaped."""
+    n = len(times)
+    day_of_year = times.dayofyear.to_numpy()
+    # Local solar hour, about UTC-5 for North Carolina
+    local_hour = (times.hour.to_numpy() - 5) % 24
+
+    pressure_anom = smooth_noise(rng, n, tau_hours=60, scale=7.0)
+    pressure = 1013.0 + pressure_anom - (latitude - 35.0) * 0.8
+
+    cloud = 100 / (1 + np.exp(0.35 * pressure_anom - smooth_noise(rng, n, 8, 1.2)))
+    cloud = np.clip(cloud + rng.normal(0, 5, n), 0, 100)
+
+    seasonal = 60.0 - (latitude - 35.0) * 2.0 - 18.0 * np.cos(2 * np.pi * (day_of_year - 15) / 365.25)
+    diurnal = 9.0 * np.cos(2 * np.pi * (local_hour - 15) / 24) * (1 - 0.5 * cloud / 100)
+    temp = seasonal + diurnal + smooth_noise(rng, n, tau_hours=36, scale=5.0)
+
+    wind_speed = np.clip(
+        8.0 - 0.45 * pressure_anom + 2.0 * np.cos(2 * np.pi * (local_hour - 14) / 24)
+        + smooth_noise(rng, n, tau_hours=6, scale=2.5),
+        0, None,
+    )
+    wind_dir = (225.0 + np.cumsum(rng.normal(0, 6, n))) % 360
+
+    return pd.DataFrame({
+        "location_id": location_id,
+        "time": times,
+        "temperature (°F)": temp.astype(np.float32),
+        "cloud cover (%)": cloud.astype(np.float32),
+        "surface pressure (hPa)": pressure.astype(np.float32),
+        "wind speed (80m elevation) (mph)": wind_speed.astype(np.float32),
+        "wind direction (80m elevation) (°)": wind_dir.astype(np.float32),
+    })
+
+
+def hourly_range(years, end=None):
+    """Hourly UTC timestamps covering `years` and ending at `end` (default: the current hour)."""
+    end = pd.Timestamp(end or pd.Timestamp.now(tz="UTC")).floor("h")
+    if end.tzinfo is None:
+        end = end.tz_localize("UTC")
+    hours = int(round(years * 365 * 24))
+    return pd.date_range(end=end, periods=hours, freq="h")
+
+
+def generate(locations, years, end=None, seed=0, first_location=0):
+    """
+    Yields one CSV-shaped DataFrame per location: `locations` locations named
+    SYN00000, SYN00001, ... (starting at `first_location`) with `years` of hours each.
+    """
+    times = hourly_range(years, end)
+    for i in range(first_location, first_location + locations):
+        rng = np.random.default_rng([seed, i])
+        latitude = rng.uniform(*LAT_RANGE)
+        yield location_series(f"SYN{i:05d}", times, latitude, rng)
+
+
+def file_names(times):
+    """weather_<date>.csv per row, computed per distinct day."""
+    days = times.dt.floor("D") if isinstance(times, pd.Series) else times.floor("D")
+    codes, uniques = pd.factorize(days)
+    names = np.array([f"weather_{d:%Y-%m-%d}.csv" for d in uniques], dtype=object)
+    return names[codes]
+
+
+def copy_frames(conn, frames, schema="WeatherData", batch_rows=1_000_000):
+    """COPYs CSV-shaped frames into formatted_weather_data in batches. Returns rows loaded."""
+    columns = "file_name, " + ", ".join(CSV_TO_DB_COLUMNS.values())
+    sql = f'COPY "{schema}".formatted_weather_data ({columns}) FROM STDIN WITH (FORMAT csv)'
+    cursor = conn.cursor()
+    total = 0
+    pending = []
+    pending_rows = 0
+
+    def flush():
+        batch = pd.concat(pending, ignore_index=True)
+        batch = batch[list(CSV_TO_DB_COLUMNS)]
+        batch.insert(0, "file_name", file_names(batch["time"]))
+        # Arrow's CSV writer is several times faster than DataFrame.to_csv at these sizes
+        buf = BytesIO()
+        pacsv.write_csv(
+            pa.Table.from_pandas(batch, preserve_index=False),
+            buf,
+            pacsv.WriteOptions(include_header=False),
+        )
+        buf.seek(0)
+        cursor.copy_expert(sql, buf)
+        conn.commit()
+        return len(batch)
+
+    try:
+        for df in frames:
+            pending.append(df)
+            pending_rows += len(df)
+            if pending_rows >= batch_rows:
+                total += flush()
+                pending, pending_rows = [], 0
+        if pending:
+            total += flush()
+    finally:
+        cursor.close()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load synthetic hourly weather data.")
+    parser.add_argument("--locations", type=int, default=3)
+    parser.add_argument("--years", type=float, default=1.0)
+    parser.add_argument("--schema", default="WeatherData")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.getenv("DB_URL"))
+    try:
+        rows = copy_frames(conn, generate(args.locations, args.years, seed=args.seed), args.schema)
+    finally:
+        conn.close()
+    print(f"Loaded {rows} synthetic rows into \"{args.schema}\".formatted_weather_data")
+
+
+if __name__ == "__main__":
+    main()
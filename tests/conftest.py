@@ -45,6 +45,10 @@ def prepare_schema(db_conn):
     cur.execute('CREATE SCHEMA IF NOT EXISTS aq_test_local;')
 
     cur.execute('DROP TABLE IF EXISTS "aq_test_local".formatted_weather_data CASCADE;')
+    cur.execute('DROP TABLE IF EXISTS "aq_test_local".pipeline_leases;')
+    cur.execute('DROP TABLE IF EXISTS "aq_test_local".weather_stats;')
+    cur.execute('DROP TABLE IF EXISTS "aq_test_local".forecast_runs, "aq_test_local".forecast_values;')
+    cur.execute('DROP TABLE IF EXISTS "aq_test_local".quarantined_files;')
     
     # Create the table inside this schema
     cur.execute("""
@@ -92,6 +96,19 @@ def s3_test_good_client():
         aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY_T"),
     )
 
+@pytest.fixture
+def s3_counted_client():
+    """A fresh test client with its own S3 call accounting: (client, stats)."""
+    from awsfuncs import S3CallStats, instrument_client
+    stats = S3CallStats()
+    client = boto3.client(
+        "s3",
+        region_name="us-east-1",
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_T"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY_T"),
+    )
+    return instrument_client(client, stats), stats
+
 @pytest.fixture(scope="session")
 def s3_test_bad_client():
     return boto3.client(
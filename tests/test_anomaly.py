@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+import pytest
+from anomaly import ANOMALY_COLUMN, STATS_METRICS, anomaly_scores, batch_stats, load_stats, rebuild_stats, score_and_update
+
+
+def readings(days, start="2024-01-01", temp=None, seed=0):
+    rng = np.random.default_rng(seed)
+    times = pd.date_range(start, periods=24 * days, freq="h", tz="UTC")
+    return pd.DataFrame({
+        "location_id": "LOC1",
+        "time": times,
+        "temperature (°F)": rng.normal(50, 5, len(times)) if temp is None else temp,
+        "cloud cover (%)": rng.uniform(0, 100, len(times)),
+        "surface pressure (hPa)": rng.normal(1012, 4, len(times)),
+        "wind speed (80m elevation) (mph)": rng.gamma(2, 5, len(times)),
+        "wind direction (80m elevation) (°)": 180.0,
+    })
+
+
+def test_batch_stats_match_numpy():
+    df = readings(10)
+    df.loc[0, "temperature (°F)"] = np.nan
+
+    stats = batch_stats(df)
+    row = stats[(stats["hour"] == 0) & (stats["metric"] == "temp_f")].iloc[0]
+    expected = df[df["time"].dt.hour == 0]["temperature (°F)"].dropna()
+
+    assert len(stats) == 24 * len(STATS_METRICS)
+    assert row["n"] == 9
+    assert row["mean"] == pytest.approx(expected.mean())
+    assert row["m2"] == pytest.approx(expected.var(ddof=0) * 9)
+    assert (row["min"], row["max"]) == (expected.min(), expected.max())
+
+
+def test_scores_need_enough_samples():
+    stats = batch_stats(readings(30)).assign(std=lambda s: np.sqrt(s["m2"] / s["n"]))
+    stats = {metric: group.set_index(["location_id", "month", "hour"])[["n", "mean", "std"]]
+             for metric, group in stats.groupby("metric")}
+    df = readings(1, start="2024-01-31", temp=50.0)
+    df.loc[12, "temperature (°F)"] = 120.0
+
+    scores = anomaly_scores(df, stats)
+    assert scores[12] > 10
+    assert np.nanmax(np.delete(scores, 12)) < 10
+    assert np.isnan(anomaly_scores(df, stats, min_samples=31)).all()
+
+
+def test_incremental_updates_match_a_rebuild(db_conn):
+    cur = db_conn.cursor()
+    for i, day in enumerate(["2024-01-01", "2024-01-02", "2024-01-03"]):
+        score_and_update(cur, readings(1, start=day, seed=i), f"weather_{day}.csv", "aq_test_local")
+    db_conn.commit()
+    incremental = load_stats(cur, readings(1), "aq_test_local")
+    db_conn.commit()
+
+    # Same readings as rows of the table, then recomputed in one pass
+    for i, day in enumerate(["2024-01-01", "2024-01-02", "2024-01-03"]):
+        for r in readings(1, start=day, seed=i).itertuples(index=False):
+            cur.execute(
+                'INSERT INTO "aq_test_local".formatted_weather_data (file_name, location_id, temp_f, cloud_cover_perc, '
+                'surface_pressure, wind_speed_80m_mph, wind_direction_80m_deg, time) VALUES (%s,%s,%s,%s,%s,%s,%s,%s)',
+                ("x.csv", r[0], r[2], r[3], r[4], r[5], r[6], r[1]),
+            )
+    db_conn.commit()
+    rebuild_stats(db_conn, "aq_test_local")
+    rebuilt = load_stats(cur, readings(1), "aq_test_local")
+    db_conn.commit()
+    cur.close()
+
+    for metric in STATS_METRICS:
+        a, b = incremental[metric].sort_index(), rebuilt[metric].sort_index()
+        assert (a["n"] == 3).all()
+        # The table stores reals, the incremental path doubles
+        assert np.allclose(a["mean"], b["mean"], rtol=1e-5)
+        assert np.allclose(a["std"], b["std"], rtol=1e-3)
+
+
+def test_loaded_rows_carry_their_score(db_conn):
+    cur = db_conn.cursor()
+    history = readings(20, temp=50.0 + np.sin(np.arange(24 * 20)))
+    score_and_update(cur, history, "weather_history.csv", "aq_test_local")
+
+    day = readings(1, start="2024-01-21", temp=50.0)
+    day.loc[5, "temperature (°F)"] = 90.0
+    scored = score_and_update(cur, day, "weather_2024-01-21.csv", "aq_test_local")
+    db_conn.rollback()
+    cur.close()
+
+    assert ANOMALY_COLUMN in scored
+    assert scored[ANOMALY_COLUMN].idxmax() == 5
+
+
+@pytest.mark.parametrize("strategy", ["copy", "execute_values"])
+def test_unscored_rows_are_stored_as_null(db_conn, strategy):
+    from db import insert_weather_rows
+
+    cur = db_conn.cursor()
+    day = score_and_update(cur, readings(1), "weather_2024-01-01.csv", "aq_test_local")
+    insert_weather_rows(cur, day, "weather_2024-01-01.csv", "aq_test_local", strategy)
+    db_conn.commit()
+
+    cur.execute('SELECT count(*), count(anomaly_score) FROM "aq_test_local".formatted_weather_data;')
+    total, scored = cur.fetchone()
+    cur.execute('SELECT count(*) FROM "aq_test_local".formatted_weather_data WHERE anomaly_score > 4;')
+    flagged = cur.fetchone()[0]
+    cur.close()
+
+    assert (total, scored, flagged) == (24, 0, 0)
+
+
+def test_stats_follow_the_stored_rows_when_loads_overlap(db_conn):
+    from db import load_weather_frame
+
+    cur = db_conn.cursor()
+    # Two-day files: the second replaces Jan 2, the late third only adds Dec 31
+    for day, seed in (("2024-01-01", 0), ("2024-01-02", 1), ("2023-12-31", 2)):
+        load_weather_frame(cur, readings(2, start=day, seed=seed), f"weather_{day}.csv", "aq_test_local")
+    db_conn.commit()
+    cur.execute('SELECT count(*) FROM "aq_test_local".formatted_weather_data;')
+    assert cur.fetchone()[0] == 24 * 4
+    both_months = readings(2, start="2023-12-31")
+    incremental = load_stats(cur, both_months, "aq_test_local")
+    db_conn.commit()
+
+    rebuild_stats(db_conn, "aq_test_local")
+    rebuilt = load_stats(cur, both_months, "aq_test_local")
+    db_conn.commit()
+    cur.close()
+
+    assert incremental.keys() == rebuilt.keys()
+    for metric in incremental:
+        a, b = incremental[metric].sort_index(), rebuilt[metric].sort_index()
+        assert a.index.equals(b.index)
+        assert (a["n"].to_numpy() == b["n"].to_numpy()).all()
+        assert np.allclose(a["mean"], b["mean"], rtol=1e-5)
+        assert np.allclose(a["std"], b["std"], rtol=1e-3)
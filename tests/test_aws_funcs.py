@@ -1,6 +1,8 @@
+import boto3
 import pytest
-from botocore.exceptions import ClientError
-from awsfuncs import upload_file, file_exists_in_s3, list_files
+from botocore.config import Config
+from botocore.exceptions import ClientError, EndpointConnectionError
+from awsfuncs import S3CallStats, instrument_client, upload_file, file_exists_in_s3, list_files
 
 
 
@@ -139,3 +141,45 @@ def test_upload_failure_keeps_local(tmp_file_with_key, s3_test_bad_client, test_
     assert tmp_file.exists()
 
 
+
+
+def test_instrumented_client_records_calls(s3_counted_client, test_bucket, test_prefix, tmp_path):
+    client, stats = s3_counted_client
+    file_path = tmp_path / "weather_calls.csv"
+    file_path.write_text("a,b\n1,2\n")
+    size = file_path.stat().st_size
+    key = f"{test_prefix}weather_calls.csv"
+
+    upload_file(test_bucket, str(file_path), key, client)
+    client.get_object(Bucket=test_bucket, Key=key)["Body"].read()
+
+    report = stats.report()
+    assert report["HeadObject"]["calls"] == 1
+    assert report["HeadObject"]["errors"] == 1  # 404 before the upload
+    assert report["PutObject"]["bytes_sent"] == size
+    assert report["GetObject"]["bytes_received"] == size
+    assert sum(report["GetObject"]["histogram"].values()) == 1
+
+    # Registering again must not double count
+    instrument_client(client, stats)
+    file_exists_in_s3(test_bucket, key, client)
+    assert stats.calls()["HeadObject"] == 2
+
+
+def test_instrumented_client_counts_connection_errors():
+    """A call that gets no response raises the real botocore error and is counted as failed."""
+    stats = S3CallStats()
+    client = instrument_client(boto3.client(
+        "s3",
+        region_name="us-east-1",
+        endpoint_url="http://127.0.0.1:1",
+        aws_access_key_id="test",
+        aws_secret_access_key="test",
+        config=Config(retries={"max_attempts": 1}, connect_timeout=1),
+    ), stats)
+
+    with pytest.raises(EndpointConnectionError):
+        file_exists_in_s3("bkt", "weather_2024-01-01.csv", client)
+
+    assert stats.report()["HeadObject"]["calls"] == 1
+    assert stats.report()["HeadObject"]["errors"] == 1
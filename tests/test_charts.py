@@ -0,0 +1,104 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+import charts
+from charts import hourly_chart_spec, history_chart_spec
+
+
+@pytest.fixture
+def loc_df():
+    times = pd.date_range("2025-07-20", periods=24, freq="h", tz="UTC")
+    df = pd.DataFrame({
+        "time": times,
+        "temp_f": np.linspace(60, 90, 24),
+        "cloud_cover_perc": np.linspace(0, 100, 24),
+    })
+    df["hour"] = df["time"].dt.hour
+    df["hour_label"] = df["time"].dt.strftime("%-I%p")
+    return df
+
+
+@pytest.fixture(autouse=True)
+def fresh_spec_cache():
+    charts.clear_spec_cache()
+    yield
+    charts.clear_spec_cache()
+
+
+def test_hourly_spec_is_cached_across_reruns(loc_df):
+    first = hourly_chart_spec(loc_df, ["temp_f"], "Charlotte", "2025-07-20")
+    second = hourly_chart_spec(loc_df.copy(), ["temp_f"], "Charlotte", "2025-07-20")
+
+    assert charts.spec_cache_stats == {"hits": 1, "misses": 1}
+    assert first.keys() == second.keys()
+    assert first["layer"] == second["layer"]
+
+
+def test_spec_references_data_by_name(loc_df):
+    spec = hourly_chart_spec(loc_df, ["temp_f", "cloud_cover_perc"], "Charlotte", "2025-07-20")
+    datasets = spec.pop("datasets")
+
+    layer_data = {layer["data"]["name"] for layer in spec["layer"]}
+    assert layer_data == set(datasets)
+    # no inline rows in the spec itself, and the selection name is stable
+    assert '"values"' not in json.dumps(spec)
+    assert "hover" in json.dumps(spec)
+
+
+def test_changed_data_rebuilds_spec(loc_df):
+    first = hourly_chart_spec(loc_df, ["temp_f"], "Charlotte", "2025-07-20")
+    changed = loc_df.assign(temp_f=loc_df["temp_f"] + 1)
+    second = hourly_chart_spec(changed, ["temp_f"], "Charlotte", "2025-07-20")
+
+    assert charts.spec_cache_stats["misses"] == 2
+    assert set(first["datasets"]) != set(second["datasets"])
+
+
+def test_returned_spec_is_safe_to_mutate(loc_df):
+    spec = history_chart_spec(loc_df, ["temp_f"], "Charlotte", ("2025-07-20", "2025-07-20"))
+    spec.pop("datasets")
+
+    again = history_chart_spec(loc_df, ["temp_f"], "Charlotte", ("2025-07-20", "2025-07-20"))
+    assert "datasets" in again
+
+
+def test_no_metrics_returns_none(loc_df):
+    assert hourly_chart_spec(loc_df, [], "Charlotte", "2025-07-20") is None
+
+
+def test_server_mode_falls_back_without_vegafusion(loc_df, monkeypatch):
+    monkeypatch.setattr(charts, "CHART_TRANSFORMS", "server")
+    monkeypatch.setattr(charts, "HAS_VEGAFUSION", False)
+
+    spec = hourly_chart_spec(loc_df, ["temp_f"], "Charlotte", "2025-07-20")
+
+    assert not charts.is_vega_spec(spec)
+    assert "datasets" in spec
+
+
+def test_server_mode_pre_transforms_with_vegafusion(loc_df, monkeypatch):
+    pytest.importorskip("vegafusion")
+    pytest.importorskip("vl_convert")
+    monkeypatch.setattr(charts, "CHART_TRANSFORMS", "server")
+
+    spec = history_chart_spec(loc_df, ["temp_f", "cloud_cover_perc"], "Charlotte", ("2025-07-20", "2025-07-20"))
+
+    assert charts.is_vega_spec(spec)
+    assert "datasets" not in spec
+    # data arrives inline and the page snippet embeds it
+    assert any(isinstance(d.get("values"), list) for d in spec["data"])
+    assert "vegaEmbed" in charts.vega_embed_html(spec)
+
+
+def test_embedded_spec_cannot_close_its_script_tag():
+    pytest.importorskip("vl_convert")
+    spec = {"$schema": "https://vega.github.io/schema/vega/v5.json",
+            "data": [{"name": "t", "values": [{"label": "</script><script>alert(1)</script>"}]}]}
+
+    html = charts.vega_embed_html(spec)
+
+    assert "<script src" not in html  # vega and vega-embed are inlined
+    assert html.count("</script>") == 2  # only the snippet's own tags
+    embedded = html.split('vegaEmbed("#vis", ', 1)[1].rsplit(', {"actions"', 1)[0]
+    assert json.loads(embedded) == spec
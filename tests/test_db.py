@@ -1,6 +1,7 @@
 import pytest
 import pandas as pd
-from db import file_already_uploaded, upload_weather_data_to_db
+from derived import compute as compute_derived
+from db import LOAD_STRATEGIES, file_already_uploaded, insert_weather_rows, upload_weather_data_to_db
 
 
 @pytest.fixture
@@ -120,3 +121,86 @@ def test_unique_constraint(db_conn, sample_weather_df, db_rows):
     assert len(rows_after) == len(sample_weather_df)
     assert rows_before == rows_after
 
+
+@pytest.mark.parametrize("strategy", LOAD_STRATEGIES)
+def test_insert_weather_rows_strategies_match(db_conn, sample_weather_df, strategy):
+    cur = db_conn.cursor()
+    insert_weather_rows(cur, sample_weather_df, "weather_strategy.csv", "aq_test_local", strategy)
+    db_conn.commit()
+
+    cur.execute(
+        'SELECT file_name, location_id, temp_f, wind_direction_80m_deg FROM "aq_test_local".formatted_weather_data ORDER BY time;'
+    )
+    rows = cur.fetchall()
+    cur.close()
+
+    assert rows == [
+        ("weather_strategy.csv", "LOC1", 70.5, 180.0),
+        ("weather_strategy.csv", "LOC2", 75.2, 90.0),
+    ]
+
+
+@pytest.mark.parametrize("strategy", ["copy", "row"])
+def test_insert_weather_rows_adds_derived_columns(db_conn, sample_weather_df, strategy):
+    df = compute_derived(sample_weather_df, metrics=["wind_u_80m_mph", "pressure_tendency_3h"])
+    cur = db_conn.cursor()
+    insert_weather_rows(cur, df, "weather_derived.csv", "aq_test_local", strategy)
+    db_conn.commit()
+
+    cur.execute('SELECT wind_u_80m_mph, pressure_tendency_3h FROM "aq_test_local".formatted_weather_data ORDER BY time;')
+    rows = cur.fetchall()
+    cur.close()
+
+    assert [round(u, 4) for u, _ in rows] == [0.0, -7.0]
+    assert all(tendency is None for _, tendency in rows)  # NULL: no row 3 hours earlier
+
+
+def test_insert_weather_rows_rejects_unknown_strategy(db_conn, sample_weather_df):
+    with pytest.raises(ValueError):
+        insert_weather_rows(db_conn.cursor(), sample_weather_df, "weather_x.csv", "aq_test_local", "bulk")
+
+
+def test_upload_quarantines_bad_rows_and_loads_the_rest(
+    db_conn, s3_test_good_client, test_bucket, test_prefix, sample_weather_df
+):
+    df = pd.concat([sample_weather_df, sample_weather_df.iloc[[0]]], ignore_index=True)  # duplicate
+    df.loc[1, "cloud cover (%)"] = 250.0  # out of range
+    s3_test_good_client.put_object(
+        Bucket=test_bucket, Key=f"{test_prefix}weather_bad.csv", Body=df.to_csv(index=False).encode()
+    )
+
+    upload_weather_data_to_db(bucket_name=test_bucket, conn=db_conn, filename="weather_bad.csv",
+                              schema="aq_test_local", s3_client=s3_test_good_client, prefix=test_prefix)
+
+    cur = db_conn.cursor()
+    cur.execute('SELECT location_id FROM "aq_test_local".formatted_weather_data WHERE file_name = %s;',
+                ("weather_bad.csv",))
+    assert cur.fetchall() == [("LOC1",)]
+    cur.close()
+
+    body = s3_test_good_client.get_object(Bucket=test_bucket, Key=f"{test_prefix}quarantine/weather_bad.csv")["Body"]
+    quarantined = pd.read_csv(body)
+    assert sorted(quarantined["reason"]) == ["duplicate", "range:cloud cover (%)"]
+
+
+def test_fully_quarantined_file_is_not_downloaded_again(
+    db_conn, s3_counted_client, test_bucket, test_prefix, sample_weather_df
+):
+    from master import find_missing_dates
+
+    s3, stats = s3_counted_client
+    df = sample_weather_df.copy()
+    df["cloud cover (%)"] = 250.0  # every row out of range
+    s3.put_object(Bucket=test_bucket, Key=f"{test_prefix}weather_2024-06-01.csv", Body=df.to_csv(index=False).encode())
+
+    for _ in range(2):
+        upload_weather_data_to_db(bucket_name=test_bucket, conn=db_conn, filename="weather_2024-06-01.csv",
+                                  schema="aq_test_local", s3_client=s3, prefix=test_prefix)
+
+    assert stats.calls()["GetObject"] == 1
+    assert stats.calls()["PutObject"] == 2  # the file itself and one quarantine object
+    cur = db_conn.cursor()
+    assert file_already_uploaded(cur, "weather_2024-06-01.csv", schema="aq_test_local") is True
+    cur.close()
+    presence = find_missing_dates(["2024-06-01"], test_bucket, db_conn, "aq_test_local", s3, prefix=test_prefix)
+    assert presence["2024-06-01"]["db"] is True
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+from derived import METRICS, compute, parse_metrics, previous_day_tail
+
+
+def hourly_df(start, hours, location_ids=("LOC1", "LOC2")):
+    frames = []
+    for i, location_id in enumerate(location_ids):
+        step = np.arange(hours, dtype=float)
+        frames.append(pd.DataFrame({
+            "location_id": location_id,
+            "time": pd.date_range(start, periods=hours, freq="h", tz="UTC"),
+            "temperature (°F)": 60.0 + 10 * i + step,
+            "cloud cover (%)": 40.0,
+            "surface pressure (hPa)": 1000.0 + step / 2,
+            "wind speed (80m elevation) (mph)": 10.0,
+            "wind direction (80m elevation) (°)": 90.0,
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def test_wind_components_follow_meteorological_convention():
+    df = hourly_df("2024-01-01", 2, ["LOC1"])
+    df["wind direction (80m elevation) (°)"] = [90.0, 180.0]  # from the east, from the south
+
+    out = compute(df, metrics=["wind_u_80m_mph", "wind_v_80m_mph"])
+
+    assert np.allclose(out[METRICS["wind_u_80m_mph"]], [-10.0, 0.0], atol=1e-9)
+    assert np.allclose(out[METRICS["wind_v_80m_mph"]], [0.0, 10.0], atol=1e-9)
+    assert METRICS["temp_f_mean_24h"] not in out
+
+
+def test_windows_without_history_are_nan():
+    out = compute(hourly_df("2024-01-01", 24, ["LOC1"]))
+
+    mean = out[METRICS["temp_f_mean_24h"]]
+    assert mean.iloc[:23].isna().all()
+    assert mean.iloc[23] == pytest.approx(60.0 + 11.5)
+    assert out[METRICS["temp_f_delta_24h"]].isna().all()
+    assert out[METRICS["pressure_tendency_3h"]].iloc[3:].eq(1.5).all()
+
+
+def test_continuing_from_the_tail_matches_a_full_recompute():
+    both = hourly_df("2024-01-01", 48)
+    day1 = both[both["time"] < "2024-01-02"]
+    day2 = both[both["time"] >= "2024-01-02"]
+
+    full = compute(both)
+    incremental = compute(day2, tail=day1)
+
+    derived = list(METRICS.values())
+    pd.testing.assert_frame_equal(
+        incremental[derived].reset_index(drop=True), full.loc[day2.index, derived].reset_index(drop=True)
+    )
+    assert incremental[METRICS["temp_f_delta_24h"]].eq(24.0).all()
+
+
+def test_new_rows_replace_overlapping_tail_rows():
+    tail = hourly_df("2024-01-01", 6, ["LOC1"])
+    tail["surface pressure (hPa)"] = 900.0  # an older forecast of the same hours
+    df = hourly_df("2024-01-01 03:00", 3, ["LOC1"])
+
+    out = compute(df, tail=tail, metrics=["pressure_tendency_3h"])
+
+    # Each new hour looks back 3 hours into the tail's older values, never its overlapping ones
+    assert out[METRICS["pressure_tendency_3h"]].tolist() == [100.0, 100.5, 101.0]
+
+
+def test_parse_metrics_rejects_unknown_names():
+    assert parse_metrics(" wind_u_80m_mph, ") == ["wind_u_80m_mph"]
+    assert parse_metrics("") == []
+    with pytest.raises(ValueError):
+        parse_metrics("dew_point")
+
+
+def test_previous_day_tail_reads_s3(tmp_path, s3_test_good_client, test_bucket, test_prefix):
+    day1 = hourly_df("2024-01-01", 24)
+    s3_test_good_client.put_object(
+        Bucket=test_bucket, Key=f"{test_prefix}weather_2024-01-01.csv", Body=day1.to_csv(index=False).encode()
+    )
+
+    tail = previous_day_tail("2024-01-02", test_bucket, s3_test_good_client, test_prefix, str(tmp_path))
+    assert len(tail) == 48
+    assert previous_day_tail("2024-01-05", test_bucket, s3_test_good_client, test_prefix, str(tmp_path)) is None
@@ -0,0 +1,124 @@
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from db import CSV_TO_DB_COLUMNS, file_already_uploaded, load_weather_frame
+from forecasts import changed_values, forecast_evolution, issued_at, latest_values, record_run
+from history import METRIC_COLUMNS
+
+
+def run_df(first_hour, hours, issued, temp=70.0, location_id="LOC1"):
+    df = pd.DataFrame({
+        "location_id": location_id,
+        "time": pd.date_range(first_hour, periods=hours, freq="h", tz="UTC"),
+        "temp_f": temp,
+        "cloud_cover_perc": 40.0,
+        "surface_pressure": 1012.0,
+        "wind_speed_80m_mph": 8.0,
+        "wind_direction_80m_deg": 180.0,
+    })
+    df["issued_at"] = pd.Timestamp(issued, tz="UTC")
+    return df
+
+
+def test_changed_values_keeps_only_differences():
+    old = run_df("2024-01-01", 3, "2024-01-01")[["location_id", "time", *METRIC_COLUMNS]]
+    new = run_df("2024-01-01 01:00", 3, "2024-01-01 06:00")[["location_id", "time", *METRIC_COLUMNS]]
+    new.loc[0, "temp_f"] = 71.0          # 01:00: temperature changed
+    new.loc[1, "temp_f"] = 70.0 + 1e-9   # 02:00: same at stored precision
+
+    delta = changed_values(new, old)
+
+    assert delta["time"].dt.hour.tolist() == [1, 3]
+    assert delta.iloc[0]["temp_f"] == 71.0
+    assert delta.iloc[0][["cloud_cover_perc", "surface_pressure"]].isna().all()
+    assert delta.iloc[1][METRIC_COLUMNS].notna().all()  # 03:00 is new
+
+
+def test_issued_at_falls_back_to_the_file_date():
+    df = run_df("2024-01-01", 1, "2024-01-01 06:30")
+    assert issued_at(df, "weather_2024-01-01.csv") == datetime(2024, 1, 1, 6, 30, tzinfo=timezone.utc)
+    assert issued_at(df.drop(columns="issued_at"), "weather_2024-01-03.csv") == datetime(2024, 1, 3, tzinfo=timezone.utc)
+
+
+def test_runs_store_deltas_and_answer_latest_and_evolution(db_conn):
+    cur = db_conn.cursor()
+    # Three daily runs of a 72h forecast; each forecasts tomorrow's noon differently
+    for day in (1, 2, 3):
+        df = run_df(f"2024-01-0{day}", 72, f"2024-01-0{day} 06:00")
+        df.loc[df["time"] == pd.Timestamp(f"2024-01-0{day + 1} 12:00", tz="UTC"), "temp_f"] = 60.0 + day
+        record_run(cur, df, f"weather_2024-01-0{day}.csv", "aq_test_local")
+    db_conn.commit()
+
+    cur.execute('SELECT count(*) FROM "aq_test_local".forecast_values;')
+    stored = cur.fetchone()[0]
+    cur.close()
+    # Run 1 in full, then each later run's 24 new hours and the two noons it revised
+    assert stored == 72 + 2 * (24 + 2)
+
+    latest = latest_values(db_conn, "LOC1", datetime(2024, 1, 2, tzinfo=timezone.utc),
+                           datetime(2024, 1, 3, tzinfo=timezone.utc), "aq_test_local")
+    assert len(latest) == 24
+    assert latest.loc[latest["time"].dt.hour == 12, "temp_f"].item() == 70.0  # run 2 reverted run 1's 61
+
+    evolution = forecast_evolution(db_conn, "LOC1", datetime(2024, 1, 3, 12, tzinfo=timezone.utc), "aq_test_local")
+    assert evolution["temp_f"].tolist() == [70.0, 62.0, 70.0]
+    assert evolution["lead_hours"].tolist() == [54.0, 30.0, 6.0]
+    assert np.all(evolution["surface_pressure"] == 1012.0)
+
+
+def test_older_runs_apply_to_the_hours_no_later_run_covers(db_conn):
+    cur = db_conn.cursor()
+    assert record_run(cur, run_df("2024-01-02", 24, "2024-01-02 06:00"), "weather_2024-01-02.csv", "aq_test_local").all()
+    # Issued earlier, but no later run covers Jan 1
+    assert record_run(cur, run_df("2024-01-01", 24, "2024-01-01 06:00"), "weather_2024-01-01.csv", "aq_test_local").all()
+    # Covers Dec 31 and Jan 1: applied only to Dec 31
+    applied = record_run(cur, run_df("2023-12-31", 48, "2023-12-31 06:00"), "weather_2023-12-31.csv", "aq_test_local")
+    assert applied.tolist() == [True] * 24 + [False] * 24
+    assert not record_run(cur, run_df("2024-01-02", 24, "2024-01-02 06:00"), "weather_2024-01-02.csv", "aq_test_local").any()
+    db_conn.rollback()
+    cur.close()
+
+
+def test_days_loaded_out_of_order_keep_their_forecasts(db_conn):
+    csv_columns = {name: csv for csv, name in CSV_TO_DB_COLUMNS.items()}
+    cur = db_conn.cursor()
+    for day in (3, 1, 2):  # as the parallel catch-up may load them
+        df = run_df(f"2024-01-0{day}", 24, f"2024-01-0{day} 06:00", temp=60.0 + day)
+        load_weather_frame(cur, df.rename(columns=csv_columns), f"weather_2024-01-0{day}.csv", "aq_test_local")
+    db_conn.commit()
+
+    cur.execute('SELECT time, temp_f FROM "aq_test_local".formatted_weather_data ORDER BY time;')
+    stored = pd.DataFrame(cur.fetchall(), columns=["time", "temp_f"])
+    cur.execute('SELECT count(*) FROM "aq_test_local".forecast_runs WHERE NOT applied;')
+    superseded = cur.fetchone()[0]
+    cur.close()
+
+    latest = latest_values(db_conn, "LOC1", datetime(2024, 1, 1, tzinfo=timezone.utc),
+                           datetime(2024, 1, 4, tzinfo=timezone.utc), "aq_test_local")
+    assert superseded == 0
+    assert len(latest) == 72
+    assert latest["temp_f"].tolist() == stored["temp_f"].tolist() == [61.0] * 24 + [62.0] * 24 + [63.0] * 24
+
+
+def test_loading_overlapping_runs_keeps_one_row_per_hour(db_conn):
+    csv_columns = {name: csv for csv, name in CSV_TO_DB_COLUMNS.items()}
+    cur = db_conn.cursor()
+    for day in (2, 1, 3):  # day 1 arrives late: it only fills the hours nobody forecast
+        df = run_df(f"2024-01-0{day}", 72, f"2024-01-0{day} 06:00", temp=60.0 + day)
+        load_weather_frame(cur, df.rename(columns=csv_columns), f"weather_2024-01-0{day}.csv", "aq_test_local")
+    db_conn.commit()
+
+    cur.execute('SELECT time, temp_f, file_name FROM "aq_test_local".formatted_weather_data ORDER BY time;')
+    stored = pd.DataFrame(cur.fetchall(), columns=["time", "temp_f", "file_name"])
+    assert file_already_uploaded(cur, "weather_2024-01-01.csv", "aq_test_local")
+    cur.close()
+
+    assert len(stored) == 24 * 5 and stored["time"].is_unique
+    assert stored.groupby("file_name")["temp_f"].agg(["first", "size"]).to_dict("index") == {
+        "weather_2024-01-01.csv": {"first": 61.0, "size": 24},
+        "weather_2024-01-02.csv": {"first": 62.0, "size": 24},
+        "weather_2024-01-03.csv": {"first": 63.0, "size": 72},
+    }
+    latest = latest_values(db_conn, "LOC1", datetime(2024, 1, 2, tzinfo=timezone.utc),
+                           datetime(2024, 1, 6, tzinfo=timezone.utc), "aq_test_local")
+    assert latest["temp_f"].tolist() == stored["temp_f"].iloc[24:].tolist()
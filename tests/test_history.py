@@ -0,0 +1,81 @@
+from datetime import date
+import numpy as np
+import pandas as pd
+from history import choose_resolution, downsample_long, fetch_history, lttb
+
+
+def insert_hourly_rows(db_conn, location_id, start, hours, temp=70.0):
+    cur = db_conn.cursor()
+    times = pd.date_range(start, periods=hours, freq="h", tz="UTC")
+    for i, t in enumerate(times):
+        cur.execute(
+            """
+            INSERT INTO "aq_test_local".formatted_weather_data (
+                file_name, location_id, temp_f, cloud_cover_perc, surface_pressure,
+                wind_speed_80m_mph, wind_direction_80m_deg, time
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            """,
+            (f"weather_{t:%Y-%m-%d}.csv", location_id, temp + i, 50.0, 1013.0, 5.0, 350.0 if i % 2 else 10.0, t),
+        )
+    db_conn.commit()
+    cur.close()
+
+
+def test_lttb_keeps_endpoints_and_peak():
+    x = np.arange(5000)
+    y = np.sin(x / 100.0)
+    y[2500] = 50.0
+
+    idx = lttb(x, y, 200)
+
+    assert len(idx) == 200
+    assert idx[0] == 0 and idx[-1] == 4999
+    assert 2500 in idx
+    assert np.all(np.diff(idx) > 0)
+
+
+def test_lttb_short_series_untouched():
+    idx = lttb(np.arange(10), np.arange(10), 50)
+    assert list(idx) == list(range(10))
+
+
+def test_choose_resolution_scales_with_range():
+    assert choose_resolution(date(2025, 7, 1), date(2025, 7, 7)) == "raw"
+    assert choose_resolution(date(2025, 7, 1), date(2025, 8, 15)) == "hourly"
+    assert choose_resolution(date(2025, 1, 1), date(2025, 12, 31)) == "6-hourly"
+    assert choose_resolution(date(2020, 1, 1), date(2025, 12, 31)) == "daily"
+
+
+def test_downsample_long_caps_each_metric():
+    times = pd.date_range("2025-01-01", periods=3000, freq="h", tz="UTC")
+    long_df = pd.concat([
+        pd.DataFrame({"time": times, "metric": "Temperature (°F)", "value": np.random.rand(3000)}),
+        pd.DataFrame({"time": times, "metric": "Cloud Cover (%)", "value": np.random.rand(3000)}),
+    ])
+
+    out = downsample_long(long_df, max_points=300)
+
+    assert out.groupby("metric").size().tolist() == [300, 300]
+
+
+def test_fetch_history_raw_and_daily(db_conn):
+    insert_hourly_rows(db_conn, "Charlotte", "2025-07-01", 48)
+    insert_hourly_rows(db_conn, "Raleigh", "2025-07-01", 48, temp=20.0)
+
+    raw = fetch_history(db_conn, "Charlotte", date(2025, 7, 1), date(2025, 7, 2), "raw", schema="aq_test_local")
+    daily = fetch_history(db_conn, "Charlotte", date(2025, 7, 1), date(2025, 7, 2), "daily", schema="aq_test_local")
+
+    assert len(raw) == 48
+    assert len(daily) == 2
+    assert daily["temp_f"].iloc[0] == np.mean(np.arange(24) + 70.0)
+    # circular mean of 350° and 10° is north, not 180°
+    assert min(daily["wind_direction_80m_deg"].iloc[0], 360 - daily["wind_direction_80m_deg"].iloc[0]) < 1e-3
+
+
+def test_fetch_history_respects_range(db_conn):
+    insert_hourly_rows(db_conn, "Charlotte", "2025-07-01", 72)
+
+    df = fetch_history(db_conn, "Charlotte", date(2025, 7, 2), date(2025, 7, 2), schema="aq_test_local")
+
+    assert len(df) == 24
+    assert df["time"].min() == pd.Timestamp("2025-07-02", tz="UTC")
@@ -0,0 +1,73 @@
+from datetime import date
+import pandas as pd
+from lake import (compact, compact_month, list_daily_keys, monthly_key, objects_for_range, read_compacted_file,
+                  read_manifest)
+
+
+def put_day(s3, bucket, prefix, day, temp=70.0):
+    times = pd.date_range(day, periods=24, freq="h", tz="UTC")
+    df = pd.DataFrame({
+        "location_id": "LOC1",
+        "time": times,
+        "temperature (°F)": temp,
+        "cloud cover (%)": 40.0,
+        "surface pressure (hPa)": 1012.0,
+        "wind speed (80m elevation) (mph)": 8.0,
+        "wind direction (80m elevation) (°)": 180.0,
+    })
+    s3.put_object(Bucket=bucket, Key=f"{prefix}weather_{day}.csv", Body=df.to_csv(index=False).encode())
+
+
+def test_compact_month_replaces_daily_objects(s3_test_good_client, test_bucket, test_prefix):
+    for day in ("2024-01-01", "2024-01-02", "2024-01-03"):
+        put_day(s3_test_good_client, test_bucket, test_prefix, day)
+
+    entry = compact_month("2024-01", test_bucket, s3_test_good_client, test_prefix)
+
+    assert entry["rows"] == 72
+    assert entry["files"] == {f"weather_2024-01-0{d}.csv": 24 for d in (1, 2, 3)}
+    assert list_daily_keys(test_bucket, s3_test_good_client, test_prefix, "2024-01") == []
+    assert read_manifest(test_bucket, s3_test_good_client, test_prefix)["months"]["2024-01"] == entry
+
+    day = read_compacted_file(test_bucket, entry["key"], "weather_2024-01-02.csv", s3_test_good_client)
+    assert len(day) == 24
+    assert "file_name" not in day.columns
+    assert day["time"].min() == pd.Timestamp("2024-01-02", tz="UTC")
+
+
+def test_late_day_is_merged_into_compacted_month(s3_test_good_client, test_bucket, test_prefix):
+    put_day(s3_test_good_client, test_bucket, test_prefix, "2024-02-01")
+    compact_month("2024-02", test_bucket, s3_test_good_client, test_prefix)
+    put_day(s3_test_good_client, test_bucket, test_prefix, "2024-02-02")
+    put_day(s3_test_good_client, test_bucket, test_prefix, "2024-02-01", temp=50.0)  # re-upload
+
+    entry = compact_month("2024-02", test_bucket, s3_test_good_client, test_prefix)
+
+    assert entry["rows"] == 48
+    day = read_compacted_file(test_bucket, entry["key"], "weather_2024-02-01.csv", s3_test_good_client)
+    assert (day["temperature (°F)"] == 50.0).all()
+
+
+def test_compact_skips_current_month_and_ranges_use_monthly_objects(s3_test_good_client, test_bucket, test_prefix):
+    for day in ("2024-03-30", "2024-03-31", "2024-04-01"):
+        put_day(s3_test_good_client, test_bucket, test_prefix, day)
+
+    compacted = compact(test_bucket, s3_test_good_client, test_prefix, before=date(2024, 4, 15))
+
+    assert list(compacted) == ["2024-03"]
+    assert objects_for_range(date(2024, 3, 1), date(2024, 4, 30), test_bucket, s3_test_good_client, test_prefix) == [
+        monthly_key("2024-03", test_prefix),
+        f"{test_prefix}weather_2024-04-01.csv",
+    ]
+
+
+def test_compacted_day_still_loads_into_db(db_conn, s3_test_good_client, test_bucket, test_prefix, db_rows):
+    from db import upload_weather_data_to_db
+
+    put_day(s3_test_good_client, test_bucket, test_prefix, "2024-05-01")
+    compact_month("2024-05", test_bucket, s3_test_good_client, test_prefix)
+
+    upload_weather_data_to_db(bucket_name=test_bucket, conn=db_conn, filename="weather_2024-05-01.csv",
+                              schema="aq_test_local", s3_client=s3_test_good_client, prefix=test_prefix)
+
+    assert len(db_rows()) == 24
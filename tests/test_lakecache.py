@@ -0,0 +1,89 @@
+import os
+import time
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pytest
+from io import BytesIO
+import lakecache
+from lakecache import LakeCache
+
+
+def decode(raw):
+    return pacsv.read_csv(BytesIO(raw))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return LakeCache(str(tmp_path / "lake_cache"), max_bytes=10 * 1024 * 1024)
+
+
+def test_repeat_reads_revalidate_instead_of_downloading(cache, s3_counted_client, test_bucket, test_prefix):
+    client, stats = s3_counted_client
+    key = f"{test_prefix}weather_2024-01-01.csv"
+    client.put_object(Bucket=test_bucket, Key=key, Body=b"location_id,temp\nLOC1,70\n")
+
+    first = cache.get(client, test_bucket, key, decode)
+    received = stats.report()["GetObject"]["bytes_received"]
+    second = cache.get(client, test_bucket, key, decode)
+
+    assert first.equals(second)
+    assert (cache.hits, cache.misses) == (1, 1)
+    report = stats.report()["GetObject"]
+    assert report["calls"] == 2
+    assert report["errors"] == 0
+    assert report["bytes_received"] == received  # the 304 carried no body
+
+
+def test_changed_object_is_downloaded_again(cache, s3_test_good_client, test_bucket, test_prefix):
+    key = f"{test_prefix}weather_2024-01-02.csv"
+    s3_test_good_client.put_object(Bucket=test_bucket, Key=key, Body=b"location_id,temp\nLOC1,70\n")
+    cache.get(s3_test_good_client, test_bucket, key, decode)
+
+    s3_test_good_client.put_object(Bucket=test_bucket, Key=key, Body=b"location_id,temp\nLOC1,55\n")
+    table = cache.get(s3_test_good_client, test_bucket, key, decode)
+
+    assert table.column("temp").to_pylist() == [55]
+    assert cache.misses == 2
+    assert len(os.listdir(cache.directory)) == 1
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    table = pa.table({"x": list(range(1000))})
+    cache = LakeCache(str(tmp_path), max_bytes=10 * 1024 * 1024)
+    paths = [cache._path("bkt", f"k{i}") for i in range(4)]
+    for i, path in enumerate(paths[:3]):
+        cache._store(path, f'"etag{i}"', table)
+        time.sleep(0.01)
+    # Room for three entries; k0 was read most recently, so k1 goes when k3 arrives
+    cache.max_bytes = cache.size()
+    cache._hit(paths[0])
+    cache._store(paths[3], '"etag3"', table)
+
+    assert [os.path.exists(p) for p in paths] == [True, False, True, True]
+    assert cache.size() <= cache.max_bytes
+
+
+def test_get_cache_is_off_without_a_directory(monkeypatch, tmp_path):
+    monkeypatch.setattr(lakecache, "_cache", None)
+    monkeypatch.setattr(lakecache, "LAKE_CACHE_DIR", "")
+    assert lakecache.get_cache() is None
+
+    monkeypatch.setattr(lakecache, "LAKE_CACHE_DIR", str(tmp_path))
+    assert lakecache.get_cache().directory == str(tmp_path)
+
+
+def test_entry_evicted_after_revalidation_is_downloaded(cache, s3_counted_client, test_bucket, test_prefix,
+                                                         monkeypatch):
+    client, stats = s3_counted_client
+    key = f"{test_prefix}weather_2024-01-03.csv"
+    client.put_object(Bucket=test_bucket, Key=key, Body=b"location_id,temp\nLOC1,70\n")
+    cache.get(client, test_bucket, key, decode)
+
+    # Another thread evicts the entry between the 304 and the read
+    hit = cache._hit
+    monkeypatch.setattr(cache, "_hit", lambda path: cache._remove(path) or hit(path))
+    table = cache.get(client, test_bucket, key, decode)
+
+    assert table.column("temp").to_pylist() == [70]
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert stats.report()["GetObject"]["calls"] == 3
@@ -0,0 +1,81 @@
+import json
+import os
+from datetime import date
+import pandas as pd
+import pytest
+from lake import COMPACTED_PREFIX, MANIFEST_KEY, _write_parquet
+
+duckdb = pytest.importorskip("duckdb")
+import lakequery  # noqa: E402
+
+
+def day_df(day, location_id, temp=70.0):
+    return pd.DataFrame({
+        "location_id": location_id,
+        "time": pd.date_range(day, periods=24, freq="h", tz="UTC"),
+        "temperature (°F)": temp,
+        "cloud cover (%)": 40.0,
+        "surface pressure (hPa)": 1012.0,
+        "wind speed (80m elevation) (mph)": 8.0,
+        "wind direction (80m elevation) (°)": [350.0, 10.0] * 12,
+    })
+
+
+@pytest.fixture
+def local_lake(tmp_path):
+    """January compacted into Parquet plus one daily CSV in February, laid out like the bucket."""
+    os.makedirs(tmp_path / COMPACTED_PREFIX)
+    frames = []
+    for day in ("2024-01-01", "2024-01-02"):
+        for location_id in ("LOC1", "LOC2"):
+            df = day_df(day, location_id)
+            df.insert(0, "file_name", f"weather_{day}.csv")
+            frames.append(df)
+    month = pd.concat(frames).sort_values(["time", "location_id"])
+    (tmp_path / COMPACTED_PREFIX / "weather_2024-01.parquet").write_bytes(_write_parquet(month))
+    (tmp_path / MANIFEST_KEY).write_text(json.dumps({"months": {"2024-01": {
+        "key": f"{COMPACTED_PREFIX}weather_2024-01.parquet",
+        "rows": len(month),
+        "files": {"weather_2024-01-01.csv": 48, "weather_2024-01-02.csv": 48},
+    }}}))
+    pd.concat([day_df("2024-02-01", "LOC1", temp=60.0), day_df("2024-02-01", "LOC2")]).to_csv(
+        tmp_path / "weather_2024-02-01.csv", index=False
+    )
+    return str(tmp_path)
+
+
+def test_lake_files_prunes_by_date(local_lake):
+    assert lakequery.lake_files(date(2024, 1, 5), date(2024, 1, 20), local_lake) == [
+        os.path.join(local_lake, COMPACTED_PREFIX, "weather_2024-01.parquet"),
+    ]
+    assert lakequery.lake_files(date(2024, 2, 1), date(2024, 2, 1), local_lake) == [
+        os.path.join(local_lake, "weather_2024-02-01.csv"),
+    ]
+    assert lakequery.lake_files(date(2023, 1, 1), date(2023, 12, 31), local_lake) == []
+
+
+def test_raw_history_spans_parquet_and_csv(local_lake):
+    df = lakequery.fetch_history("LOC1", date(2024, 1, 2), date(2024, 2, 1), "raw", lake_url=local_lake)
+
+    assert len(df) == 48
+    assert str(df["time"].dt.tz) == "UTC"
+    assert df["time"].is_monotonic_increasing
+    assert df["temp_f"].tolist() == [70.0] * 24 + [60.0] * 24
+
+
+def test_daily_history_averages_wind_direction_circularly(local_lake):
+    df = lakequery.fetch_history("LOC1", date(2024, 1, 1), date(2024, 2, 1), "daily", lake_url=local_lake)
+
+    assert len(df) == 3
+    assert df["wind_direction_80m_deg"].round(6).isin([0.0, 360.0]).all()
+
+
+def test_empty_range_and_ad_hoc_query(local_lake):
+    empty = lakequery.fetch_history("LOC1", date(2023, 1, 1), date(2023, 1, 2), lake_url=local_lake)
+    assert empty.empty
+
+    counts = lakequery.query(
+        "SELECT location_id, COUNT(*) AS n FROM weather GROUP BY 1 ORDER BY 1",
+        date(2024, 1, 1), date(2024, 2, 1), lake_url=local_lake,
+    )
+    assert counts.to_dict("records") == [{"location_id": "LOC1", "n": 72}, {"location_id": "LOC2", "n": 72}]
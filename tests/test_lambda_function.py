@@ -0,0 +1,48 @@
+import pytest
+import lambda_function
+
+
+@pytest.fixture
+def warm_state(db_conn, s3_test_good_client, tmp_path, monkeypatch):
+    """Pre-seed the warm-container state with the test clients."""
+    monkeypatch.setattr(lambda_function, "OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setattr(lambda_function, "_state", {
+        "s3": s3_test_good_client,
+        "conn": db_conn,
+        "openmeteo": None,
+        "invocations": 0,
+    })
+    return lambda_function._state
+
+
+def test_handler_runs_pipeline_and_reports(warm_state, test_bucket, test_prefix):
+    event = {"bucket_name": test_bucket, "schema": "aq_test_local", "prefix": test_prefix}
+
+    report = lambda_function.lambda_handler(event, None)
+
+    assert report["status"] == 0
+    assert report["cold_start"] is True
+    assert set(report["stage_ms"]) == {"fetch", "upload", "db_load"}
+    assert report["module_init_ms"] >= 0
+
+
+def test_warm_invocation_reuses_clients(warm_state, test_bucket, test_prefix):
+    event = {"bucket_name": test_bucket, "schema": "aq_test_local", "prefix": test_prefix}
+
+    lambda_function.lambda_handler(event, None)
+    s3, conn, openmeteo = warm_state["s3"], warm_state["conn"], warm_state["openmeteo"]
+    second = lambda_function.lambda_handler(event, None)
+
+    assert second["cold_start"] is False
+    assert second["invocation"] == 2
+    assert warm_state["s3"] is s3
+    assert warm_state["conn"] is conn
+    assert warm_state["openmeteo"] is openmeteo
+
+
+def test_handler_reports_fetch_failure(warm_state, s3_test_bad_client, test_bucket):
+    warm_state["s3"] = s3_test_bad_client
+
+    report = lambda_function.lambda_handler({"bucket_name": test_bucket}, None)
+
+    assert report["status"] == 1
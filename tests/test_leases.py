@@ -0,0 +1,68 @@
+import pytest
+from leases import Lease, LeaseBusy, LeaseLost
+
+SCHEMA = "aq_test_local"
+
+
+def expire(conn, name):
+    cur = conn.cursor()
+    cur.execute(f'UPDATE "{SCHEMA}".pipeline_leases SET expires_at = now() - interval \'1 second\' WHERE name = %s;',
+                (name,))
+    conn.commit()
+    cur.close()
+
+
+def test_second_owner_is_refused_until_release(db_conn):
+    first = Lease(db_conn, "2025-08-01:fetch", SCHEMA, owner="a", wait=0)
+    second = Lease(db_conn, "2025-08-01:fetch", SCHEMA, owner="b", wait=0)
+
+    with first:
+        assert first.held
+        with pytest.raises(LeaseBusy):
+            second.acquire()
+
+    # Released leases can be taken straight away, with a larger fence token
+    with second:
+        assert second.fence > 1
+
+
+def test_same_owner_reenters(db_conn):
+    with Lease(db_conn, "2025-08-01:upload", SCHEMA, owner="a", wait=0) as outer:
+        inner = Lease(db_conn, "2025-08-01:upload", SCHEMA, owner="a", wait=0)
+        assert inner.try_acquire()
+        assert inner.fence == outer.fence + 1
+
+
+def test_expired_lease_is_taken_over_and_fenced(db_conn):
+    stale = Lease(db_conn, "2025-08-01:load", SCHEMA, owner="a", wait=0)
+    stale.acquire()
+    expire(db_conn, "2025-08-01:load")
+
+    with Lease(db_conn, "2025-08-01:load", SCHEMA, owner="b", wait=0) as current:
+        cur = db_conn.cursor()
+        current.check(cur)
+        db_conn.commit()
+
+        with pytest.raises(LeaseLost):
+            stale.check(cur)
+        db_conn.rollback()
+        with pytest.raises(LeaseLost):
+            stale.renew()
+        cur.close()
+
+
+def test_unreachable_lease_store_runs_unlocked(bad_db_conn):
+    with Lease(bad_db_conn, "2025-08-01:fetch", SCHEMA, wait=0) as lease:
+        assert not lease.held
+        # Fencing is skipped rather than failing the write
+        lease.check(None)
+
+
+def test_missing_schema_fails_open(db_conn):
+    with Lease(db_conn, "2025-08-01:fetch", "no_such_schema", wait=0) as lease:
+        assert not lease.held
+    # The connection is usable again afterwards
+    cur = db_conn.cursor()
+    cur.execute("SELECT 1;")
+    assert cur.fetchone() == (1,)
+    cur.close()
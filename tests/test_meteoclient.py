@@ -0,0 +1,129 @@
+import threading
+import time
+import pytest
+from meteoclient import BudgetExceeded, RequestScheduler, ScheduledClient, call_weight, record_response
+
+URL = "https://api.open-meteo.com/v1/forecast"
+PARAMS = {"latitude": [35.2], "longitude": [-80.8], "hourly": ["temperature_2m"], "forecast_days": 1}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class FakeResponse:
+    def __init__(self, status, headers=None):
+        self.status_code = status
+        self.headers = headers or {}
+
+
+class FlakyClient:
+    """Answers with the given HTTP statuses in turn, like openmeteo_requests.Client behind the hooked session."""
+
+    def __init__(self, statuses, headers=None):
+        self.statuses = list(statuses)
+        self.headers = headers or {}
+        self.calls = 0
+
+    def weather_api(self, url, params, method="GET", **kwargs):
+        self.calls += 1
+        status = self.statuses.pop(0)
+        record_response(FakeResponse(status, self.headers))
+        if status != 200:
+            raise RuntimeError(f"failed to request {url!r}: {status}")
+        return ["response"]
+
+
+def scheduler(clock, limits="600/minute,10000/day", **kwargs):
+    return RequestScheduler(limits, clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_call_weight_counts_coordinates_variables_and_days():
+    assert call_weight(PARAMS) == 1
+    assert call_weight({**PARAMS, "latitude": [1, 2, 3]}) == 3
+    assert call_weight({**PARAMS, "hourly": ["v"] * 15}) == 1.5
+    assert call_weight({"latitude": 1, "hourly": "a,b", "start_date": "2024-01-01", "end_date": "2024-01-28"}) == 2
+
+
+def test_buckets_pace_requests_and_report_the_budget():
+    clock = FakeClock()
+    sched = scheduler(clock, limits="2/minute,100/day", max_wait=60)
+    client = ScheduledClient(FlakyClient([200] * 3), sched)
+
+    for _ in range(3):
+        client.weather_api(URL, PARAMS)
+
+    assert clock.slept == [pytest.approx(30)]
+    report = sched.report()
+    assert report["requests"] == 3
+    assert report["budget"]["day"] == {"limit": 100, "used": 3, "remaining": pytest.approx(97, abs=0.1)}
+
+    sched.reset()
+    assert sched.report()["budget"]["day"]["used"] == 0
+    daily = ScheduledClient(FlakyClient([200, 200]), scheduler(clock, limits="1/day", max_wait=60))
+    daily.weather_api(URL, PARAMS)
+    with pytest.raises(BudgetExceeded):
+        daily.weather_api(URL, {**PARAMS, "forecast_days": 2})
+
+
+def test_throttled_requests_honor_retry_after_then_give_up():
+    clock = FakeClock()
+    sched = scheduler(clock, retries=2)
+    client = ScheduledClient(FlakyClient([429, 503, 200], {"Retry-After": "7"}), sched)
+
+    assert client.weather_api(URL, PARAMS) == ["response"]
+    assert clock.slept == [7, 7]
+    assert sched.report()["throttled"] == 1
+    assert sched.report()["server_errors"] == 1
+
+    # Without Retry-After the pause is the backoff, which grew with each failure
+    failing = FlakyClient([500, 500, 500])
+    with pytest.raises(RuntimeError):
+        ScheduledClient(failing, sched).weather_api(URL, PARAMS)
+    assert failing.calls == 3
+    assert clock.slept[2:] == [2, 4]
+
+    # A 400 is the request's fault and is not retried
+    bad = FlakyClient([400])
+    with pytest.raises(RuntimeError):
+        ScheduledClient(bad, sched).weather_api(URL, PARAMS)
+    assert bad.calls == 1
+
+
+def test_identical_requests_in_flight_are_sent_once():
+    release = threading.Event()
+
+    class SlowClient:
+        calls = 0
+
+        def weather_api(self, url, params, method="GET", **kwargs):
+            SlowClient.calls += 1
+            record_response(FakeResponse(200))
+            release.wait(5)
+            return ["response"]
+
+    sched = RequestScheduler("600/minute")
+    client = ScheduledClient(SlowClient(), sched)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.weather_api(URL, dict(PARAMS))))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    while sched.report()["coalesced"] < 3:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert SlowClient.calls == 1
+    assert results == [["response"]] * 4
+    assert sched.report()["requests"] == 1
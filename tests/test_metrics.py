@@ -0,0 +1,71 @@
+import json
+import pytest
+import metrics
+from awsfuncs import upload_file
+
+
+@pytest.fixture
+def enabled_metrics(tmp_path, monkeypatch):
+    prom_file = tmp_path / "meteo.prom"
+    monkeypatch.setattr(metrics, "_enabled", True)
+    monkeypatch.setattr(metrics, "_prom_file", str(prom_file))
+    metrics.reset()
+    yield prom_file
+    metrics.reset()
+
+
+def test_disabled_is_noop(monkeypatch, capsys):
+    monkeypatch.setattr(metrics, "_enabled", False)
+    metrics.reset()
+
+    with metrics.span("api_call") as s:
+        metrics.incr("rows_fetched", 10)
+
+    assert s is None
+    assert metrics.span("a") is metrics.span("b")
+    assert metrics.snapshot() == {"counters": {}, "spans": {}}
+    assert capsys.readouterr().out == ""
+
+
+def test_span_logs_json_and_aggregates(enabled_metrics, capsys):
+    for _ in range(2):
+        with metrics.span("s3_put", key="weather_2025-01-01.csv"):
+            pass
+    with pytest.raises(ValueError):
+        with metrics.span("decode"):
+            raise ValueError("bad payload")
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [l["name"] for l in lines] == ["s3_put", "s3_put", "decode"]
+    assert lines[0]["key"] == "weather_2025-01-01.csv"
+    assert lines[2]["ok"] is False
+    assert metrics.snapshot()["spans"]["s3_put"]["count"] == 2
+
+
+def test_flush_writes_prometheus_file(enabled_metrics):
+    with metrics.span("db_insert", file="weather_2025-01-01.csv"):
+        pass
+    metrics.incr("rows_loaded", 72)
+    metrics.incr("bytes_written", 100, stage="fetch")
+    metrics.incr("bytes_written", 50, stage="fetch")
+
+    metrics.flush()
+
+    text = enabled_metrics.read_text()
+    assert 'meteo_span_seconds_count{span="db_insert"} 1' in text
+    assert "meteo_rows_loaded_total 72" in text
+    assert 'meteo_bytes_written_total{stage="fetch"} 150' in text
+    assert "weather_2025-01-01.csv" not in text  # span labels stay out of the metric series
+
+
+def test_upload_counts_bytes(enabled_metrics, s3_test_good_client, test_bucket, test_prefix, tmp_path):
+    local = tmp_path / "weather_metrics.csv"
+    local.write_text("location_id,time\nCharlotte,2025-01-01T00:00:00Z\n")
+    size = local.stat().st_size
+
+    upload_file(test_bucket, str(local), f"{test_prefix}weather_metrics.csv", s3_test_good_client)
+
+    snap = metrics.snapshot()
+    assert snap["counters"]["bytes_uploaded"] == size
+    assert snap["spans"]["s3_put"]["count"] == 1
+    assert snap["spans"]["s3_head"]["count"] >= 1
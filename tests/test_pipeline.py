@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 from master import run_pipeline_test as run_pipeline
 from awsfuncs import file_exists_in_s3, list_files
@@ -130,4 +130,145 @@ def test_pipeline_bad_db_connection(s3_test_good_client, bad_db_conn, test_bucke
     assert status == 3  # DB upload failed
     assert file_exists_in_s3(test_bucket, s3_key, s3_test_good_client)
     assert len(after_files) == len(before_files) + 1  # file still uploaded
-    assert len(db_rows()) == 0  # no DB rows inserted
\ No newline at end of file
+    assert len(db_rows()) == 0  # no DB rows inserted
+
+def test_pipeline_waits_out_busy_lease(db_conn, s3_test_good_client, test_bucket, test_prefix, db_rows, tmp_path):
+    """A run that finds another run holding the fetch lease exits with status 4 and does nothing."""
+    from leases import Lease
+
+    today_str = datetime.now().strftime("%Y-%m-%d")
+
+    with Lease(db_conn, f"{today_str}:fetch", "aq_test_local", owner="other-run", wait=0):
+        status = run_pipeline(
+            bucket_name=test_bucket,
+            conn=db_conn,
+            schema="aq_test_local",
+            s3_client=s3_test_good_client,
+            prefix=test_prefix,
+            output_dir=str(tmp_path),
+            lease_wait=0,
+        )
+
+    assert status == 4
+    assert list(tmp_path.iterdir()) == []
+    assert len(db_rows()) == 0
+
+
+def test_catchup_fills_missing_dates(db_conn, s3_test_good_client, test_bucket, test_prefix, tmp_path):
+    """Catch-up over a short lookback loads every missing date, then has nothing to do."""
+    from master import run_pipeline_catchup
+
+    table = run_pipeline_catchup(
+        lookback_days=2,
+        bucket_name=test_bucket,
+        conn=db_conn,
+        schema="aq_test_local",
+        s3_client=s3_test_good_client,
+        output_dir=str(tmp_path),
+        prefix=test_prefix,
+    )
+
+    assert [row["status"] for row in table] == [0, 0]
+    assert all(row["fetched"] and row["uploaded"] and row["loaded"] for row in table)
+    for row in table:
+        assert file_exists_in_s3(test_bucket, f"{test_prefix}weather_{row['date']}.csv", s3_test_good_client)
+
+    again = run_pipeline_catchup(
+        lookback_days=2,
+        bucket_name=test_bucket,
+        conn=db_conn,
+        schema="aq_test_local",
+        s3_client=s3_test_good_client,
+        output_dir=str(tmp_path),
+        prefix=test_prefix,
+    )
+    assert not any(row["fetched"] or row["uploaded"] or row["loaded"] for row in again)
+
+
+def test_catchup_fills_windowed_metrics_of_consecutive_days(db_conn, s3_test_good_client, test_bucket, test_prefix, tmp_path):
+    """Days fetched in parallel, a later one possibly first, still get full 24h windows from their first hour."""
+    import pandas as pd
+    from derived import LOOKBACK, METRICS
+    from master import run_pipeline_catchup
+
+    table = run_pipeline_catchup(
+        lookback_days=3,
+        bucket_name=test_bucket,
+        conn=db_conn,
+        schema="aq_test_local",
+        s3_client=s3_test_good_client,
+        output_dir=str(tmp_path),
+        prefix=test_prefix,
+        fetch_workers=3,
+        end_date=datetime.now().date() - timedelta(days=3),
+    )
+
+    assert [row["status"] for row in table] == [0, 0, 0]
+    for row in table:
+        day = pd.read_csv(tmp_path / f"weather_{row['date']}.csv")
+        assert len(day) == 3 * 24
+        assert pd.to_datetime(day["time"]).min().strftime("%Y-%m-%d") == row["date"]  # the day before was dropped
+        for name in LOOKBACK:
+            assert day[METRICS[name]].notna().all(), (row["date"], name)
+
+
+def test_catchup_skips_dates_whose_stage_lease_is_busy(db_conn, s3_test_good_client, test_bucket, test_prefix, tmp_path):
+    """A date whose fetch lease another run holds reports status 4; the other dates still load."""
+    from leases import Lease
+    from master import run_pipeline_catchup
+
+    busy = datetime.now().strftime("%Y-%m-%d")
+    with Lease(db_conn, f"{busy}:fetch", "aq_test_local", owner="other-run", wait=0):
+        table = run_pipeline_catchup(
+            lookback_days=2,
+            bucket_name=test_bucket,
+            conn=db_conn,
+            schema="aq_test_local",
+            s3_client=s3_test_good_client,
+            output_dir=str(tmp_path),
+            prefix=test_prefix,
+            lease_wait=0,
+        )
+
+    statuses = {row["date"]: row["status"] for row in table}
+    assert statuses.pop(busy) == 4
+    assert list(statuses.values()) == [0]
+    assert not (tmp_path / f"weather_{busy}.csv").exists()
+
+def test_find_missing_dates_checks_each_location(db_conn, s3_test_good_client, test_bucket, test_prefix, tmp_path):
+    from master import find_missing_dates
+
+    (tmp_path / "weather_2025-01-01.csv").write_text("local only")
+    s3_test_good_client.put_object(Bucket=test_bucket, Key=f"{test_prefix}weather_2025-01-02.csv", Body=b"x")
+
+    presence = find_missing_dates(
+        ["2025-01-01", "2025-01-02", "2025-01-03"],
+        test_bucket,
+        conn=db_conn,
+        schema="aq_test_local",
+        s3_client=s3_test_good_client,
+        output_dir=str(tmp_path),
+        prefix=test_prefix,
+    )
+
+    assert presence["2025-01-01"] == {"local": True, "s3": False, "db": False}
+    assert presence["2025-01-02"] == {"local": False, "s3": True, "db": False}
+    assert presence["2025-01-03"] == {"local": False, "s3": False, "db": False}
+
+
+def test_pipeline_s3_request_budget(db_conn, s3_counted_client, test_bucket, test_prefix, tmp_path):
+    """A fresh run's S3 requests; update deliberately when the budget changes."""
+    client, stats = s3_counted_client
+
+    status = run_pipeline(
+        bucket_name=test_bucket,
+        conn=db_conn,
+        schema="aq_test_local",
+        s3_client=client,
+        prefix=test_prefix,
+        output_dir=str(tmp_path),
+    )
+
+    assert status == 0
+    # HEADs: fetch skip check, upload skip check, upload_file's own check, post-upload check, DB load check
+    assert stats.calls() == {"HeadObject": 5, "PutObject": 1, "GetObject": 1}
@@ -0,0 +1,72 @@
+import threading
+import time
+from pipeline import PipelineExecutor, Stage
+
+
+def sleeper(seconds):
+    def _run(item):
+        time.sleep(seconds)
+    return _run
+
+
+def test_stages_overlap():
+    """Item 0 is only loaded once item 2 is being fetched, which needs the stages to run at the same time."""
+    fetched = {i: threading.Event() for i in range(4)}
+
+    def load(item):
+        if item == 0 and not fetched[2].wait(timeout=5):
+            raise RuntimeError("fetch did not run ahead of load")
+
+    outcome, summary = PipelineExecutor([
+        Stage("fetch", lambda item: fetched[item].set()),
+        Stage("upload", sleeper(0.01)),
+        Stage("load", load),
+    ]).run(range(4))
+
+    assert outcome == {0: None, 1: None, 2: None, 3: None}
+    assert [s["processed"] for s in summary["stages"]] == [4, 4, 4]
+
+
+def test_failed_items_stop_at_their_stage():
+    seen = []
+    lock = threading.Lock()
+
+    def upload(item):
+        if item == "bad":
+            raise RuntimeError("upload failed")
+
+    def load(item):
+        with lock:
+            seen.append(item)
+
+    outcome, summary = PipelineExecutor([
+        Stage("fetch", lambda item: None),
+        Stage("upload", upload),
+        Stage("load", load),
+    ]).run(["ok", "bad"])
+
+    assert outcome == {"ok": None, "bad": "upload"}
+    assert seen == ["ok"]
+    assert summary["stages"][1]["failed"] == 1
+
+
+def test_full_queue_applies_backpressure():
+    _, summary = PipelineExecutor([
+        Stage("fast", lambda item: None, queue_size=1),
+        Stage("slow", sleeper(0.05), queue_size=1),
+    ]).run(range(5))
+
+    fast, slow = summary["stages"]
+    assert fast["blocked_s"] > 0.05
+    assert slow["processed"] == 5
+
+
+def test_parallel_workers_per_stage():
+    # Each item waits until four are in the stage at once
+    together = threading.Barrier(4, timeout=5)
+    outcome, summary = PipelineExecutor([
+        Stage("fetch", lambda item: together.wait(), workers=4, queue_size=8),
+    ]).run(range(8))
+
+    assert set(outcome.values()) == {None}
+    assert summary["stages"][0]["processed"] == 8
@@ -0,0 +1,92 @@
+import pstats
+import time
+import pytest
+from profiling import profile, profiled
+
+
+def busy(seconds=0.05):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(1000))
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROFILE_OUTPUT", str(tmp_path))
+    return tmp_path
+
+
+def test_disabled_writes_nothing(profile_dir, monkeypatch):
+    monkeypatch.delenv("PROFILE_STAGES", raising=False)
+
+    with profile("pipeline"):
+        busy(0.01)
+
+    assert list(profile_dir.iterdir()) == []
+
+
+def test_only_selected_stages_are_profiled(profile_dir, monkeypatch):
+    monkeypatch.setenv("PROFILE_STAGES", "db_load")
+
+    with profile("pipeline"):
+        busy(0.01)
+    with profile("db_load"):
+        busy(0.01)
+
+    files = [p.name for p in profile_dir.iterdir()]
+    assert len(files) == 1
+    assert files[0].startswith("db_load-") and files[0].endswith(".pstats")
+
+
+def test_cprofile_output_loads_with_pstats(profile_dir, monkeypatch):
+    monkeypatch.setenv("PROFILE_STAGES", "all")
+
+    @profiled("pipeline")
+    def run():
+        busy()
+        return 42
+
+    assert run() == 42
+
+    (path,) = profile_dir.glob("pipeline-*.pstats")
+    stats = pstats.Stats(str(path))
+    assert any(func[2] == "busy" for func in stats.stats)
+
+
+def test_sampling_and_tracemalloc_artifacts(profile_dir, monkeypatch):
+    monkeypatch.setenv("PROFILE_STAGES", "drain")
+    monkeypatch.setenv("PROFILER", "sampling")
+    monkeypatch.setenv("PROFILE_SAMPLE_HZ", "500")
+    monkeypatch.setenv("PROFILE_TRACEMALLOC", "1")
+
+    with profile("drain"):
+        data = [bytes(1000) for _ in range(1000)]
+        busy(0.1)
+
+    (collapsed,) = profile_dir.glob("drain-*.collapsed")
+    (alloc,) = profile_dir.glob("drain-*.alloc.txt")
+    assert not list(profile_dir.glob("*.pstats"))
+    assert "test_profiling.py:busy" in collapsed.read_text()
+    assert "test_profiling.py" in alloc.read_text()
+    assert len(data) == 1000
+
+
+def test_nested_blocks_profile_once(profile_dir, monkeypatch):
+    monkeypatch.setenv("PROFILE_STAGES", "all")
+
+    with profile("pipeline"):
+        with profile("db_load"):
+            busy(0.01)
+
+    assert [p.name.split("-")[0] for p in profile_dir.iterdir()] == ["pipeline"]
+
+
+def test_calls_in_the_same_second_get_their_own_artifacts(profile_dir, monkeypatch):
+    monkeypatch.setenv("PROFILE_STAGES", "db_load")
+    monkeypatch.setenv("PROFILER", "sampling")
+
+    for _ in range(3):
+        with profile("db_load"):
+            busy(0.01)
+
+    assert len(list(profile_dir.glob("db_load-*.collapsed"))) == 3
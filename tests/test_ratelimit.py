@@ -0,0 +1,75 @@
+import os
+import uuid
+import pytest
+import redis
+from ratelimit import CooldownLimiter
+
+
+@pytest.fixture
+def redis_client():
+    client = redis.Redis(
+        host=os.getenv("REDIS_TEST_HOST", "localhost"),
+        port=int(os.getenv("REDIS_TEST_PORT", "6379")),
+        decode_responses=True,
+    )
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def cooldown_key(redis_client):
+    key = f"cooldown:test:{uuid.uuid4()}"
+    yield key
+    redis_client.delete(key)
+
+
+def test_first_acquire_allowed_second_blocked(redis_client, cooldown_key):
+    limiter = CooldownLimiter(client=redis_client, cooldown=30)
+
+    allowed1, remaining1 = limiter.try_acquire(cooldown_key)
+    allowed2, remaining2 = limiter.try_acquire(cooldown_key)
+
+    assert allowed1 is True
+    assert remaining1 == 30
+    assert allowed2 is False
+    assert 0 < remaining2 <= 30
+
+
+def test_concurrent_limiters_share_cooldown(redis_client, cooldown_key):
+    """Two processes (separate limiters) must not both get the slot."""
+    a = CooldownLimiter(client=redis_client, cooldown=30)
+    b = CooldownLimiter(client=redis_client, cooldown=30)
+
+    results = [a.try_acquire(cooldown_key)[0], b.try_acquire(cooldown_key)[0]]
+
+    assert results.count(True) == 1
+    assert b.remaining(cooldown_key) > 0
+
+
+def test_remaining_is_zero_for_unknown_key(redis_client, cooldown_key):
+    limiter = CooldownLimiter(client=redis_client, cooldown=30)
+    assert limiter.remaining(cooldown_key) == 0
+    # peeking must not start a cooldown
+    assert redis_client.get(cooldown_key) is None
+
+
+def test_remaining_served_from_local_cache(redis_client, cooldown_key):
+    limiter = CooldownLimiter(client=redis_client, cooldown=30)
+    limiter.try_acquire(cooldown_key)
+
+    # Removing the key in Redis is invisible until the cached value expires
+    redis_client.delete(cooldown_key)
+    assert limiter.remaining(cooldown_key) > 0
+
+
+def test_falls_back_to_local_limiter_when_redis_down():
+    dead = redis.Redis(host="localhost", port=1, socket_connect_timeout=0.2, decode_responses=True)
+    limiter = CooldownLimiter(client=dead, cooldown=30)
+
+    allowed1, _ = limiter.try_acquire("cooldown:offline")
+    allowed2, remaining2 = limiter.try_acquire("cooldown:offline")
+
+    assert allowed1 is True
+    assert allowed2 is False
+    assert remaining2 > 0
+    assert limiter.remaining("cooldown:offline") > 0
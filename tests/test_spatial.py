@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from spatial import SpatialIndex, haversine_km, load_gazetteer, resolve_place
+from weathercalls import grid_points
+
+
+@pytest.fixture(scope="module")
+def grid():
+    return grid_points()
+
+
+def test_nearest_matches_brute_force_on_the_grid(grid):
+    index = SpatialIndex(grid["latitude"], grid["longitude"])
+    rng = np.random.default_rng(0)
+    for lat, lon in zip(rng.uniform(33.8, 36.6, 300), rng.uniform(-84.35, -75.45, 300)):
+        position, km = index.nearest(lat, lon)
+        expected = haversine_km(lat, lon, grid["latitude"].to_numpy(), grid["longitude"].to_numpy()).min()
+        assert km == pytest.approx(expected, abs=1e-3)
+
+
+def test_nearest_on_scattered_points_and_outside_them():
+    rng = np.random.default_rng(1)
+    lat, lon = rng.uniform(34, 36, 2000), rng.uniform(-82, -77, 2000)
+    index = SpatialIndex(lat, lon)
+
+    # A few kilometres of slack for the flat projection far from the points' latitude
+    for q_lat, q_lon in [(35.0, -79.5), (35.99, -77.01), (40.0, -79.0), (30.0, -90.0)]:
+        _, km = index.nearest(q_lat, q_lon)
+        assert km <= haversine_km(q_lat, q_lon, lat, lon).min() * 1.01 + 1e-6
+
+    assert SpatialIndex([35.0], [-80.0]).nearest(36.0, -81.0)[0] == 0
+
+
+def test_resolve_place_accepts_towns_and_coordinates():
+    gazetteer = load_gazetteer()
+
+    assert resolve_place("Boone", gazetteer)[2] == "Boone"
+    assert resolve_place("winston salem, NC", gazetteer)[2] == "Winston-Salem"
+    assert resolve_place("Ashevile", gazetteer)[2] == "Asheville"
+    assert resolve_place("35.6, -82.55", gazetteer)[:2] == (35.6, -82.55)
+    assert resolve_place("Atlantis", gazetteer) is None
+    assert resolve_place("135, 0", gazetteer) is None
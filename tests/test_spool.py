@@ -0,0 +1,111 @@
+import boto3
+import pandas as pd
+from botocore.config import Config
+import spool as spool_module
+import validation
+from lake import read_table
+from spool import Spool
+
+
+def day_rows(day, hours, temp=70.0, loc="LOC1"):
+    return pd.DataFrame({
+        "location_id": loc,
+        "time": pd.date_range(day, periods=24, freq="h", tz="UTC")[hours],
+        "temperature (°F)": temp,
+        "cloud cover (%)": 40.0,
+        "surface pressure (hPa)": 1012.0,
+        "wind speed (80m elevation) (mph)": 8.0,
+        "wind direction (80m elevation) (°)": 180.0,
+    })
+
+
+class DownConn:
+    """A database that cannot be reached."""
+
+    def cursor(self):
+        raise ConnectionError("database is down")
+
+
+def test_spool_replays_log_and_ignores_torn_record(tmp_path):
+    spool = Spool(str(tmp_path))
+    first = spool.append("weather_2024-05-01.csv", day_rows("2024-05-01", slice(0, 12)))
+    spool.append("weather_2024-05-01.csv", day_rows("2024-05-01", slice(12, 24)))
+    with open(spool.wal_path, "a") as f:
+        f.write('{"op": "done", "ids": ["' + first)  # crash mid-write
+
+    reopened = Spool(str(tmp_path))
+    assert reopened.status()["batches"] == 2
+    assert reopened.status()["rows"] == 24
+    assert reopened.holds("weather_2024-05-01.csv")
+    assert not reopened.holds("weather_2024-05-02.csv")
+
+
+def test_flush_coalesces_batches_and_keeps_db_pending_while_it_is_down(
+    tmp_path, s3_test_good_client, test_bucket, test_prefix
+):
+    spool = Spool(str(tmp_path))
+    spool.append("weather_2024-05-01.csv", day_rows("2024-05-01", slice(0, 12)))
+    spool.append("weather_2024-05-01.csv", day_rows("2024-05-01", slice(6, 24), temp=75.0))
+
+    summary = spool.flush(test_bucket, s3_test_good_client, DownConn(), prefix=test_prefix)
+
+    assert summary["s3_files"] == 1
+    assert summary["pending"] == 2
+    assert summary["errors"] and summary["errors"][0].startswith("db:")
+    df = read_table(test_bucket, f"{test_prefix}weather_2024-05-01.csv", s3_test_good_client).to_pandas()
+    assert len(df) == 24
+    assert (df["temperature (°F)"].iloc[6:] == 75.0).all()
+
+    # A later batch of the same day is merged into the object already in S3
+    spool.append("weather_2024-05-01.csv", day_rows("2024-05-01", slice(0, 1), temp=60.0))
+    assert spool.flush(test_bucket, s3_test_good_client, DownConn(), prefix=test_prefix)["s3_files"] == 1
+    df = read_table(test_bucket, f"{test_prefix}weather_2024-05-01.csv", s3_test_good_client).to_pandas()
+    assert len(df) == 24
+    assert df["temperature (°F)"].iloc[0] == 60.0
+    assert spool.status()["pending_s3"] == 0
+
+
+def test_flush_loads_each_row_once_and_revisions_win_in_both_targets(
+    tmp_path, db_conn, db_rows, s3_test_good_client, test_bucket, test_prefix
+):
+    spool = Spool(str(tmp_path))
+    spool.append("weather_2024-05-01.csv", day_rows("2024-05-01", slice(0, 12)))
+    assert spool.flush(test_bucket, s3_test_good_client, db_conn, "aq_test_local", test_prefix)["db_rows"] == 12
+
+    # A later fetch of the same day revises the delivered hours and adds the rest
+    spool.append("weather_2024-05-01.csv", day_rows("2024-05-01", slice(0, 24), temp=75.0))
+    summary = spool.flush(test_bucket, s3_test_good_client, db_conn, "aq_test_local", test_prefix)
+
+    assert summary["pending"] == 0
+    assert not list((tmp_path / "batches").iterdir())
+    cur = db_conn.cursor()
+    cur.execute('SELECT temp_f FROM "aq_test_local".formatted_weather_data ORDER BY time;')
+    assert [row[0] for row in cur.fetchall()] == [75.0] * 24
+    cur.close()
+    s3 = read_table(test_bucket, f"{test_prefix}weather_2024-05-01.csv", s3_test_good_client).to_pandas()
+    assert (s3["temperature (°F)"] == 75.0).all() and len(s3) == 24
+
+    # Replaying a delivered batch (crash before its "done" record) changes nothing
+    spool.append("weather_2024-05-01.csv", day_rows("2024-05-01", slice(0, 24), temp=75.0))
+    spool.flush(test_bucket, s3_test_good_client, db_conn, "aq_test_local", test_prefix)
+    assert len(db_rows()) == 24
+
+
+def test_bad_rows_do_not_hold_back_the_db_while_s3_is_down(tmp_path, db_conn, db_rows, monkeypatch):
+    unreachable = boto3.client("s3", region_name="us-east-1", endpoint_url="http://127.0.0.1:1",
+                               aws_access_key_id="test", aws_secret_access_key="test",
+                               config=Config(retries={"max_attempts": 1}, connect_timeout=1))
+    monkeypatch.setattr(spool_module, "get_s3_client", lambda: unreachable)
+    monkeypatch.setattr(validation, "QUARANTINE_DIR", str(tmp_path / "quarantine"))
+    spool = Spool(str(tmp_path / "spool"))
+    rows = day_rows("2024-05-01", slice(0, 24))
+    rows.loc[5, "cloud cover (%)"] = 250.0
+    spool.append("weather_2024-05-01.csv", rows)
+
+    summary = spool.flush("bkt", None, db_conn, "aq_test_local")
+
+    assert summary["db_rows"] == 23
+    assert summary["errors"] and summary["errors"][0].startswith("s3:")
+    assert spool.status()["pending_db"] == 0 and spool.status()["pending_s3"] == 1
+    assert len(db_rows()) == 23
+    assert len(pd.read_csv(tmp_path / "quarantine" / "weather_2024-05-01.csv")) == 1
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+from synthetic import copy_frames, file_names, generate
+
+
+def test_generate_shape_and_realism():
+    frames = list(generate(2, 1, end="2025-07-01 00:00"))
+    df = frames[0]
+
+    assert len(frames) == 2
+    assert len(df) == 365 * 24
+    assert df["time"].is_monotonic_increasing
+    assert df["location_id"].iloc[0] == "SYN00000"
+    assert df["cloud cover (%)"].between(0, 100).all()
+    assert (df["wind speed (80m elevation) (mph)"] >= 0).all()
+
+    # Afternoon warmer than pre-dawn, summer warmer than winter
+    local_hour = (df["time"].dt.hour - 5) % 24
+    by_hour = df.groupby(local_hour)["temperature (°F)"].mean()
+    assert by_hour[15] > by_hour[5] + 5
+    by_month = df.groupby(df["time"].dt.month)["temperature (°F)"].mean()
+    assert by_month[7] > by_month[1] + 15
+
+    # Low pressure brings wind and cloud
+    pressure = df["surface pressure (hPa)"]
+    assert np.corrcoef(pressure, df["wind speed (80m elevation) (mph)"])[0, 1] < -0.3
+    assert np.corrcoef(pressure, df["cloud cover (%)"])[0, 1] < -0.3
+
+
+def test_generate_is_deterministic():
+    a = next(generate(1, 0.1, end="2025-01-01", seed=7))
+    b = next(generate(1, 0.1, end="2025-01-01", seed=7))
+
+    pd.testing.assert_frame_equal(a, b)
+
+
+def test_file_names_per_day():
+    times = pd.Series(pd.date_range("2025-01-01 22:00", periods=4, freq="h", tz="UTC"))
+
+    assert list(file_names(times)) == [
+        "weather_2025-01-01.csv", "weather_2025-01-01.csv",
+        "weather_2025-01-02.csv", "weather_2025-01-02.csv",
+    ]
+
+
+def test_copy_frames_loads_all_rows(db_conn):
+    frames = generate(3, 2 / 365, end="2025-01-02 23:00")
+
+    loaded = copy_frames(db_conn, frames, schema="aq_test_local", batch_rows=50)
+
+    cur = db_conn.cursor()
+    cur.execute('SELECT COUNT(*), COUNT(DISTINCT file_name), COUNT(DISTINCT location_id) FROM "aq_test_local".formatted_weather_data;')
+    assert cur.fetchone() == (loaded, 2, 3)
+    cur.close()
+    assert loaded == 3 * 48
@@ -0,0 +1,122 @@
+import os
+from datetime import datetime, timedelta, timezone
+import psycopg2
+import pytest
+from tsstore import TimeSeriesStore
+
+
+def connect():
+    return psycopg2.connect(
+        host=os.getenv("POSTGRES_HOST", "localhost"),
+        port=os.getenv("POSTGRES_PORT", "5432"),
+        user=os.getenv("POSTGRES_USER", "postgres"),
+        password=os.getenv("POSTGRES_PASSWORD", "postgres"),
+        dbname=os.getenv("POSTGRES_DB", "postgres")
+    )
+
+
+def insert_rows(db_conn, location_id, start, hours, temp=70.0, filename="weather_store.csv"):
+    cur = db_conn.cursor()
+    for i in range(hours):
+        cur.execute(
+            """
+            INSERT INTO "aq_test_local".formatted_weather_data (
+                file_name, location_id, temp_f, cloud_cover_perc, surface_pressure,
+                wind_speed_80m_mph, wind_direction_80m_deg, time
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            """,
+            (filename, location_id, temp + i, 50.0, 1013.0, 5.0, 180.0, start + timedelta(hours=i)),
+        )
+    db_conn.commit()
+    cur.close()
+
+
+@pytest.fixture
+def start_hour():
+    return datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) - timedelta(hours=24)
+
+
+def test_initial_load_and_window(db_conn, start_hour):
+    insert_rows(db_conn, "Charlotte", start_hour, 48)
+    store = TimeSeriesStore(connect, schema="aq_test_local")
+    store.refresh()
+
+    window = store.window("Charlotte", start_hour + timedelta(hours=10), start_hour + timedelta(hours=20))
+
+    assert len(window) == 10
+    assert window["temp_f"].iloc[0] == 80.0
+    assert window["time"].is_monotonic_increasing
+
+
+def test_refresh_is_incremental(db_conn, start_hour):
+    insert_rows(db_conn, "Charlotte", start_hour, 24)
+    store = TimeSeriesStore(connect, schema="aq_test_local")
+    store.refresh()
+    loaded = store.stats["rows_loaded"]
+
+    insert_rows(db_conn, "Raleigh", start_hour, 24, filename="weather_new.csv")
+    store.refresh()  # throttled: no query
+    assert store.stats["queries"] == 1
+
+    store.refresh(force=True)
+    assert store.stats["rows_loaded"] - loaded == 24
+    assert sorted(store.locations()) == ["Charlotte", "Raleigh"]
+
+
+def test_newer_load_replaces_same_hour(db_conn, start_hour):
+    insert_rows(db_conn, "Charlotte", start_hour, 3, temp=70.0, filename="weather_a.csv")
+    insert_rows(db_conn, "Charlotte", start_hour, 3, temp=10.0, filename="weather_b.csv")
+    store = TimeSeriesStore(connect, schema="aq_test_local")
+    store.refresh()
+
+    window = store.window("Charlotte", start_hour)
+
+    assert list(window["temp_f"]) == [10.0, 11.0, 12.0]
+
+
+def test_cold_locations_are_evicted_and_backfilled(db_conn, start_hour):
+    for city in ("Charlotte", "Raleigh", "Greensboro"):
+        insert_rows(db_conn, city, start_hour, 12, filename=f"weather_{city}.csv")
+    store = TimeSeriesStore(connect, schema="aq_test_local", max_locations=2)
+    store.refresh()
+
+    assert store.stats["evictions"] == 1
+    assert len(store._series) == 2
+
+    evicted = next(iter(store._evicted))
+    queries = store.stats["queries"]
+    assert len(store.window(evicted, start_hour)) == 12
+    assert store.stats["queries"] == queries + 1
+    assert len(store._series) == 2
+
+
+def test_recent_matches_today_shape(db_conn, start_hour):
+    insert_rows(db_conn, "Charlotte", start_hour - timedelta(hours=24), 72)
+    store = TimeSeriesStore(connect, schema="aq_test_local")
+    store.refresh()
+
+    df = store.recent(hours=24)
+
+    assert {"location_id", "time", "temp_f"} <= set(df.columns)
+    assert df["time"].min() >= datetime.now(timezone.utc) - timedelta(hours=25)
+
+
+def test_recent_reads_evicted_locations_in_one_query(db_conn, start_hour):
+    cities = ("Charlotte", "Raleigh", "Greensboro", "Durham")
+    for city in cities:
+        insert_rows(db_conn, city, start_hour, 12, filename=f"weather_{city}.csv")
+    store = TimeSeriesStore(connect, schema="aq_test_local", max_locations=2)
+    store.refresh()
+    resident, evictions = list(store._series), store.stats["evictions"]
+
+    queries = []
+    query = store._query
+    store._query = lambda sql, params: queries.append(params) or query(sql, params)
+    for _ in range(2):
+        df = store.recent(hours=48)
+        assert sorted(df["location_id"].unique()) == sorted(cities)
+        assert len(df) == 4 * 12
+
+    assert len(queries) == 2  # one per call, however many locations were evicted
+    assert list(store._series) == resident
+    assert store.stats["evictions"] == evictions
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import validation
+from validation import REASONS, check, describe, quarantine_invalid, validate
+
+
+def hourly_df(locations=("LOC1", "LOC2"), hours=6):
+    times = pd.date_range("2025-08-01", periods=hours, freq="h", tz="UTC")
+    return pd.DataFrame({
+        "location_id": np.repeat(locations, hours),
+        "time": np.tile(times, len(locations)),
+        "temperature (°F)": 70.0,
+        "cloud cover (%)": 40.0,
+        "surface pressure (hPa)": 1012.0,
+        "wind speed (80m elevation) (mph)": 8.0,
+        "wind direction (80m elevation) (°)": 180.0,
+    })
+
+
+def test_clean_data_passes():
+    df = hourly_df()
+
+    valid, rejected, gaps = validate(df)
+
+    assert len(valid) == len(df)
+    assert rejected.empty
+    assert gaps == {}
+
+
+def test_each_check_flags_its_row():
+    df = hourly_df()
+    df.loc[0, "temperature (°F)"] = np.nan
+    df.loc[1, "surface pressure (hPa)"] = 400.0
+    df.loc[2, "location_id"] = None
+    df.loc[3, "time"] = pd.Timestamp("2025-08-01 03:30", tz="UTC")
+    df = pd.concat([df, df.iloc[[7]]], ignore_index=True)
+
+    flags, _ = check(df)
+
+    assert describe(flags[[0, 1, 2, 3]]) == [
+        "null:temperature (°F)",
+        "range:surface pressure (hPa)",
+        "missing_location",
+        "off_hour",
+    ]
+    # The first copy of a (location, time) pair is kept
+    assert flags[7] == 0
+    assert flags[12] == REASONS["duplicate"]
+    assert (flags[8:12] == 0).all()
+
+
+def test_gaps_counted_per_location():
+    df = hourly_df().drop(index=[2, 3, 10])
+
+    valid, rejected, gaps = validate(df)
+
+    assert rejected.empty
+    assert gaps == {"LOC1": 2, "LOC2": 1}
+
+
+def test_string_times_are_parsed():
+    df = hourly_df()
+    df["time"] = df["time"].astype(str)
+    df.loc[4, "time"] = "not a time"
+
+    valid, rejected, _ = validate(df)
+
+    assert len(valid) == len(df) - 1
+    assert list(rejected["reason"]) == ["bad_time"]
+
+
+def test_rejected_rows_stay_local_without_s3(tmp_path, monkeypatch):
+    monkeypatch.setattr(validation, "QUARANTINE_DIR", str(tmp_path))
+    df = hourly_df()
+    df.loc[0, "cloud cover (%)"] = 250.0
+
+    valid = quarantine_invalid(df, "weather_2025-08-01.csv", None, "bkt")
+
+    assert len(valid) == len(df) - 1
+    assert pd.read_csv(tmp_path / "weather_2025-08-01.csv")["cloud cover (%)"].tolist() == [250.0]
@@ -1,5 +1,9 @@
 import os
-from weathercalls import file_exists_in_s3, fetch_and_save_weather_data_test
+import numpy as np
+import pytest
+from lake import GRID_BOUNDS, GRID_STEP, grid_partial_key, grid_spec, read_grid_cell, read_grid_cells
+from meteoclient import BudgetExceeded, RequestScheduler
+from weathercalls import file_exists_in_s3, fetch_and_save_weather_data_test, fetch_grid_weather_data, grid_points
 
 
 def test_fetch_and_save_weather_data_uses_existing_file(
@@ -75,4 +79,108 @@ def test_fetch_and_save_weather_data_creates_file(
     )
 
     # File should exist locally
-    assert os.path.exists(result_path), "Local CSV file should have been created"
\ No newline at end of file
+    assert os.path.exists(result_path), "Local CSV file should have been created"
+
+
+class FakeGridClient:
+    """Stands in for openmeteo_requests.Client: 24 hours per coordinate, temperature = latitude + hour."""
+
+    def __init__(self, fail_on=None):
+        self.calls = 0
+        self.fail_on = fail_on
+
+    def weather_api(self, url, params):
+        self.calls += 1
+        if self.calls == self.fail_on:
+            raise RuntimeError("failed to request: 503")
+        return [FakeResponse(lat, lon) for lat, lon in zip(params["latitude"], params["longitude"])]
+
+
+class FakeResponse:
+    def __init__(self, lat, lon):
+        hours = np.arange(24, dtype=np.float32)
+        self.values = [lat + hours, hours * 0 + 50, hours + 1000, hours * 0 + lon, hours * 15]
+
+    def Hourly(self):
+        return self
+
+    def Time(self):
+        return 1719792000  # 2024-07-01 00:00 UTC
+
+    def TimeEnd(self):
+        return self.Time() + 24 * 3600
+
+    def Interval(self):
+        return 3600
+
+    def Variables(self, i):
+        values = self.values[i]
+        return type("Variable", (), {"ValuesAsNumpy": lambda self: values})()
+
+
+def test_fetch_grid_weather_data_stores_cells_compactly(s3_test_good_client, test_bucket, test_prefix):
+    client = FakeGridClient()
+    bounds = (35.0, -80.0, 35.5, -79.0)  # 6 x 11 cells at 0.1 degrees
+
+    key = fetch_grid_weather_data("2024-07-01", test_bucket, s3_test_good_client, test_prefix, client,
+                                  bounds=bounds, step=0.1, batch=25)
+
+    spec = grid_spec(bounds, 0.1)
+    cells = read_grid_cells(test_bucket, s3_test_good_client, test_prefix, spec)
+    assert len(cells) == 66
+    assert client.calls == 3
+
+    cell = cells[(cells["latitude"] == 35.2) & (cells["longitude"] == -79.5)]["cell"].item()
+    day = read_grid_cell(test_bucket, "2024-07-01", cell, s3_test_good_client, test_prefix, spec)
+    assert len(day) == 24
+    assert day["temp_f"].iloc[3] == np.float32(35.2) + 3
+    assert day["wind_speed_80m_mph"].eq(np.float32(-79.5)).all()
+
+    # A second run finds the day in S3 and makes no API calls
+    assert fetch_grid_weather_data("2024-07-01", test_bucket, s3_test_good_client, test_prefix, client,
+                                   bounds=bounds, step=0.1) == key
+    assert client.calls == 3
+
+
+def test_fetch_grid_weather_data_resumes_after_a_failed_batch(s3_test_good_client, test_bucket, test_prefix):
+    bounds = (35.0, -80.0, 35.5, -79.0)  # 66 cells, 3 batches of 25
+    failing = FakeGridClient(fail_on=3)
+    with pytest.raises(RuntimeError):
+        fetch_grid_weather_data("2024-07-01", test_bucket, s3_test_good_client, test_prefix, failing,
+                                bounds=bounds, step=0.1, batch=25)
+    assert file_exists_in_s3(test_bucket, grid_partial_key("2024-07-01", test_prefix), s3_test_good_client)
+
+    client = FakeGridClient()
+    fetch_grid_weather_data("2024-07-01", test_bucket, s3_test_good_client, test_prefix, client,
+                            bounds=bounds, step=0.1, batch=25)
+    assert client.calls == 1  # only the batch that failed
+    assert not file_exists_in_s3(test_bucket, grid_partial_key("2024-07-01", test_prefix), s3_test_good_client)
+
+    spec = grid_spec(bounds, 0.1)
+    for cell in (0, 30, 65):
+        day = read_grid_cell(test_bucket, "2024-07-01", cell, s3_test_good_client, test_prefix, spec)
+        assert len(day) == 24
+
+    # Cell ids of another grid number other points: its cells and days do not mix
+    other = grid_spec(bounds, 0.05)
+    with pytest.raises(ValueError):
+        read_grid_cell(test_bucket, "2024-07-01", 0, s3_test_good_client, test_prefix, other)
+
+
+def test_default_grid_fits_the_daily_quota():
+    assert len(grid_points(GRID_BOUNDS, GRID_STEP)) <= 10000 // 2
+
+
+def test_grid_larger_than_the_budget_is_refused_before_any_request(s3_test_good_client, test_bucket, test_prefix):
+    bounds = (35.0, -80.0, 35.5, -79.0)  # 66 cells
+    client = FakeGridClient()
+    client.scheduler = RequestScheduler("600/minute,50/day")
+    with pytest.raises(BudgetExceeded):
+        fetch_grid_weather_data("2024-07-01", test_bucket, s3_test_good_client, test_prefix, client,
+                                bounds=bounds, step=0.1, batch=25)
+    assert client.calls == 0
+
+    client.scheduler = RequestScheduler("600/minute,100/day")
+    fetch_grid_weather_data("2024-07-01", test_bucket, s3_test_good_client, test_prefix, client,
+                            bounds=bounds, step=0.1, batch=25)
+    assert client.calls == 3
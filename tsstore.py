@@ -0,0 +1,218 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+from history import METRIC_COLUMNS
+
+
+class LocationSeries:
+    """Time-sorted NumPy columns for one location (times are UTC epoch nanoseconds)."""
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.times = np.empty(0, dtype=np.int64)
+        self.values = {m: np.empty(0, dtype=np.float32) for m in METRIC_COLUMNS}
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def nbytes(self) -> int:
+        return self.ids.nbytes + self.times.nbytes + sum(v.nbytes for v in self.values.values())
+
+    def merge(self, ids, times, values):
+        """Merge new rows, keeping the highest id when the same timestamp arrives twice."""
+        ids = np.concatenate([self.ids, ids])
+        times = np.concatenate([self.times, times])
+        order = np.lexsort((ids, times))
+        ids, times = ids[order], times[order]
+        # last row of each run of equal timestamps (i.e. the newest load wins)
+        keep = np.append(times[1:] != times[:-1], True)
+
+        self.ids = ids[keep]
+        self.times = times[keep]
+        for m in METRIC_COLUMNS:
+            merged = np.concatenate([self.values[m], values[m]])[order]
+            self.values[m] = merged[keep]
+
+    def trim_before(self, cutoff_ns: int):
+        start = np.searchsorted(self.times, cutoff_ns, side="left")
+        if start:
+            self.ids = self.ids[start:]
+            self.times = self.times[start:]
+            self.values = {m: v[start:] for m, v in self.values.items()}
+
+    def window(self, start_ns: int, end_ns: int | None = None) -> pd.DataFrame:
+        """Rows with start <= time < end (open-ended when end is None), located by binary search."""
+        lo = np.searchsorted(self.times, start_ns, side="left")
+        hi = len(self.times) if end_ns is None else np.searchsorted(self.times, end_ns, side="left")
+        data = {"time": pd.to_datetime(self.times[lo:hi], utc=True)}
+        data.update({m: self.values[m][lo:hi] for m in METRIC_COLUMNS})
+        return pd.DataFrame(data)
+
+
+class TimeSeriesStore:
+    """
+    Process-level cache of recent weather rows, held as NumPy arrays per
+    (location, metric) and topped up incrementally from Postgres.
+
+    The identity `id` of formatted_weather_data is the watermark: a refresh only
+    reads rows with a larger id. Locations beyond `max_locations` are evicted
+    least-recently-used first and backfilled from the database on next access.
+
+    :param connect: zero-argument callable returning a psycopg2 connection
+    :param retention_days: how much history is kept in memory
+    :param refresh_interval: seconds between incremental refreshes unless forced
+    """
+
+    def __init__(self, connect, schema="WeatherData", retention_days=14, max_locations=16,
+                 refresh_interval=300):
+        self.connect = connect
+        self.schema = schema
+        self.retention = timedelta(days=retention_days)
+        self.max_locations = max_locations
+        self.refresh_interval = refresh_interval
+        self.watermark = 0
+        self._series = OrderedDict()
+        self._evicted = set()
+        self._last_refresh = None
+        self._lock = threading.RLock()
+        self.stats = {"queries": 0, "rows_loaded": 0, "evictions": 0}
+
+    def horizon(self) -> datetime:
+        return datetime.now(timezone.utc) - self.retention
+
+    def _query(self, sql, params):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+        self.stats["queries"] += 1
+        self.stats["rows_loaded"] += len(rows)
+        return rows
+
+    def _select(self, where: str) -> str:
+        return f"""
+            SELECT id, location_id, time, {", ".join(METRIC_COLUMNS)}
+            FROM "{self.schema}".formatted_weather_data
+            WHERE {where}
+            ORDER BY id ASC;
+        """
+
+    def _ingest(self, rows, only=None, into=None):
+        """Group rows by location and merge them (into the cache unless `into` is given). Returns the max id seen."""
+        if not rows:
+            return 0
+        df = pd.DataFrame(rows, columns=["id", "location_id", "time"] + METRIC_COLUMNS)
+        df["location_id"] = df["location_id"].astype(str).str.strip()
+        times = pd.to_datetime(df["time"], utc=True).to_numpy(dtype="datetime64[ns]").astype(np.int64)
+        ids = df["id"].to_numpy(dtype=np.int64)
+
+        for location_id, idx in df.groupby("location_id").indices.items():
+            if only is not None and location_id != only:
+                continue
+            if only is None and into is None and location_id in self._evicted:
+                continue  # picked up by the backfill if it is requested again
+            target = self._series if into is None else into
+            series = target.get(location_id)
+            if series is None:
+                series = target[location_id] = LocationSeries()
+            values = {m: df[m].to_numpy(dtype=np.float32)[idx] for m in METRIC_COLUMNS}
+            series.merge(ids[idx], times[idx], values)
+        return int(ids.max())
+
+    def _evict(self):
+        while len(self._series) > self.max_locations:
+            location_id, _ = self._series.popitem(last=False)
+            self._evicted.add(location_id)
+            self.stats["evictions"] += 1
+
+    def refresh(self, force=False):
+        """Pull rows newer than the watermark, at most once per `refresh_interval` unless forced."""
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._last_refresh is not None and now - self._last_refresh < self.refresh_interval:
+                return
+            if self.watermark == 0:
+                rows = self._query(self._select("time >= %s"), (self.horizon(),))
+            else:
+                rows = self._query(self._select("id > %s"), (self.watermark,))
+            self.watermark = max(self.watermark, self._ingest(rows))
+
+            cutoff = pd.Timestamp(self.horizon()).value
+            for series in self._series.values():
+                series.trim_before(cutoff)
+            self._evict()
+            self._last_refresh = now
+
+    def _backfill(self, location_id):
+        rows = self._query(
+            self._select("location_id = %s AND id <= %s AND time >= %s"),
+            (location_id, self.watermark, self.horizon()),
+        )
+        self._evicted.discard(location_id)
+        self._series[location_id] = LocationSeries()
+        self._ingest(rows, only=location_id)
+
+    def _get(self, location_id):
+        if location_id in self._evicted:
+            self._backfill(location_id)
+        series = self._series.get(location_id)
+        if series is not None:
+            self._series.move_to_end(location_id)
+            self._evict()
+        return series
+
+    def covers(self, start: datetime) -> bool:
+        """True when a window starting at `start` lies within the retained history."""
+        return start >= self.horizon()
+
+    def locations(self) -> list[str]:
+        with self._lock:
+            return list(self._series) + sorted(self._evicted)
+
+    def window(self, location_id: str, start: datetime, end: datetime | None = None) -> pd.DataFrame:
+        """Rows for one location with start <= time < end (open-ended when end is None)."""
+        with self._lock:
+            series = self._get(location_id)
+            if series is None:
+                return pd.DataFrame(columns=["time"] + METRIC_COLUMNS)
+            end_ns = None if end is None else pd.Timestamp(end).value
+            return series.window(pd.Timestamp(start).value, end_ns)
+
+    def recent(self, hours=24) -> pd.DataFrame:
+        """Every location's rows from the last `hours` onward (forecast hours included), like the today query."""
+        start = datetime.now(timezone.utc) - timedelta(hours=hours)
+        start_ns = pd.Timestamp(start).value
+        with self._lock:
+            series = list(self._series.items())
+            if self._evicted:
+                # One query for every evicted location, read through without caching them again:
+                # backfilling each would evict the next one and query it back on the following call
+                rows = self._query(
+                    self._select("location_id = ANY(%s) AND id <= %s AND time >= %s"),
+                    (sorted(self._evicted), self.watermark, start),
+                )
+                uncached = {}
+                self._ingest(rows, into=uncached)
+                series += [(location_id, uncached.get(location_id, LocationSeries()))
+                           for location_id in sorted(self._evicted)]
+            frames = []
+            for location_id, location_series in series:
+                df = location_series.window(start_ns)
+                df.insert(0, "location_id", location_id)
+                frames.append(df)
+        if not frames:
+            return pd.DataFrame(columns=["location_id", "time"] + METRIC_COLUMNS)
+        return pd.concat(frames, ignore_index=True)
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(s.nbytes for s in self._series.values())
@@ -0,0 +1,213 @@
+"""
+Data-quality checks for a weather CSV before it is loaded.
+
+Every check is a vectorized mask over the whole frame (no per-row Python), so
+validating a file costs well under a millisecond per thousand rows. Rows that
+fail go to quarantine (a CSV under QUARANTINE_PREFIX in the same bucket, with a
+`reason` column) and the rest are loaded, instead of one bad value rolling back
+the whole file.
+
+Missing hours are reported but cannot be quarantined, since there is no row.
+When S3 cannot take the quarantine object (no client, or it is unreachable),
+the rejected rows are written under QUARANTINE_DIR on local disk instead, so
+an S3 outage does not hold back the DB load.
+
+A file whose rows are all quarantined loads nothing, so it is recorded in
+"<schema>".quarantined_files instead; the loaders treat it as loaded rather than
+downloading and validating it again on every run. Delete its row there to retry
+a corrected upload.
+"""
+import os
+from io import BytesIO
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from metrics import incr, span
+
+load_dotenv()
+
+QUARANTINE_PREFIX = os.getenv("QUARANTINE_PREFIX", "quarantine/")
+QUARANTINE_DIR = os.getenv("QUARANTINE_DIR", "quarantine")
+
+# Plausible (min, max) per CSV column, inclusive
+RANGES = {
+    "temperature (°F)": (-80.0, 140.0),
+    "cloud cover (%)": (0.0, 100.0),
+    "surface pressure (hPa)": (850.0, 1100.0),
+    "wind speed (80m elevation) (mph)": (0.0, 250.0),
+    "wind direction (80m elevation) (°)": (0.0, 360.0),
+}
+
+# One bit per failed check; a row can fail several
+REASONS = {
+    "missing_location": 1,
+    "bad_time": 2,
+    "off_hour": 4,
+    "duplicate": 8,
+}
+for _bit, _column in enumerate(RANGES, start=4):
+    REASONS[f"null:{_column}"] = 1 << (2 * _bit - 4)
+    REASONS[f"range:{_column}"] = 1 << (2 * _bit - 3)
+
+UNIT_PER_SECOND = {"s": 1, "ms": 10**3, "us": 10**6, "ns": 10**9}
+
+
+def parse_times(values):
+    """CSV time strings -> UTC timestamps (NaT where unparseable). Slow; decode with times parsed instead."""
+    return pd.to_datetime(values, utc=True, errors="coerce", format="ISO8601")
+
+
+def _floats(column):
+    if pd.api.types.is_float_dtype(column):
+        return column.to_numpy(dtype=np.float64)
+    return pd.to_numeric(column, errors="coerce").to_numpy(dtype=np.float64)
+
+
+def check(df):
+    """
+    Returns (flags, gaps): an int64 array with the REASONS bits each row failed
+    (0 = valid), and {location_id: missing hours between its first and last row}.
+
+    `time` should already be parsed (lake.decode_object does it for free);
+    string times are parsed here, which costs more than all the checks together.
+    """
+    n = len(df)
+    flags = np.zeros(n, dtype=np.int64)
+
+    codes, uniques = df["location_id"].factorize()
+    flags[codes < 0] |= REASONS["missing_location"]
+
+    for column, (low, high) in RANGES.items():
+        values = _floats(df[column])
+        flags[np.isnan(values)] |= REASONS[f"null:{column}"]
+        with np.errstate(invalid="ignore"):
+            flags[(values < low) | (values > high)] |= REASONS[f"range:{column}"]
+
+    times = df["time"].array
+    if not isinstance(times, pd.arrays.DatetimeArray):
+        times = parse_times(times).array
+    # Epoch integers in the column's own unit; NaT is the minimum int64
+    ticks = times.asi8
+    hour = 3600 * UNIT_PER_SECOND[times.unit]
+    bad_time = ticks == np.iinfo(np.int64).min
+    flags[bad_time] |= REASONS["bad_time"]
+    flags[~bad_time & (ticks % hour != 0)] |= REASONS["off_hour"]
+
+    # Sort once by (location, time); duplicates and gaps are then adjacent comparisons
+    order = np.lexsort((ticks, codes))
+    sorted_codes = codes[order]
+    sorted_ticks = ticks[order]
+    usable = ~bad_time[order] & (sorted_codes >= 0)
+    pairs = usable[1:] & usable[:-1] & (sorted_codes[1:] == sorted_codes[:-1])
+    steps = np.diff(sorted_ticks)
+
+    # Keep the first of each (location, time), flag the rest
+    flags[order[1:][pairs & (steps == 0)]] |= REASONS["duplicate"]
+
+    missing = np.where(pairs & (steps > hour), steps // hour - 1, 0)
+    per_location = np.bincount(sorted_codes[1:][pairs], weights=missing[pairs], minlength=len(uniques))
+    gaps = {uniques[i]: int(h) for i in np.flatnonzero(per_location) for h in [per_location[i]]}
+
+    return flags, gaps
+
+
+def describe(flags):
+    """Bit flags -> "reason;reason" strings (only call this on the few bad rows)."""
+    return [
+        ";".join(name for name, bit in REASONS.items() if f & bit)
+        for f in flags
+    ]
+
+
+def validate(df):
+    """
+    Splits a decoded weather CSV into (valid rows, rejected rows, gaps).
+    Rejected rows keep their original columns plus a `reason` column (when there are any).
+    """
+    flags, gaps = check(df)
+    bad = flags != 0
+    if not bad.any():
+        return df, df.iloc[:0], gaps
+    rejected = df[bad].copy()
+    rejected["reason"] = describe(flags[bad])
+    incr("rows_rejected", int(bad.sum()))
+    return df[~bad], rejected, gaps
+
+
+def quarantine_key(filename, prefix=""):
+    return f"{prefix}{QUARANTINE_PREFIX}{filename}"
+
+
+def quarantine_rows(s3_client, bucket_name, filename, rejected, prefix=""):
+    """Writes rejected rows to the quarantine prefix, replacing any earlier attempt. Returns the key."""
+    key = quarantine_key(filename, prefix)
+    buf = BytesIO()
+    rejected.to_csv(buf, index=False)
+    s3_client.put_object(Bucket=bucket_name, Key=key, Body=buf.getvalue())
+    return key
+
+
+def quarantine_invalid(df, filename, s3_client, bucket_name, prefix=""):
+    """Validates a decoded file, quarantines its bad rows and returns the rows to load."""
+    with span("validate", file=filename, rows=len(df)):
+        valid, rejected, gaps = validate(df)
+    report(filename, valid, rejected, gaps)
+    if len(rejected):
+        try:
+            if s3_client is None:
+                raise ValueError("no S3 client")
+            key = quarantine_rows(s3_client, bucket_name, filename, rejected, prefix)
+            print(f"Quarantined {len(rejected)} rows from {filename} to {key}.")
+        except Exception as e:
+            path = quarantine_locally(filename, rejected)
+            print(f"Could not quarantine rows of {filename} in S3 ({e}); kept {len(rejected)} rows in {path}.")
+    return valid
+
+
+def quarantine_locally(filename, rejected, directory=None):
+    """Writes rejected rows under QUARANTINE_DIR, replacing any earlier attempt. Returns the path."""
+    directory = directory or QUARANTINE_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, filename)
+    rejected.to_csv(path, index=False)
+    return path
+
+
+def report(filename, valid, rejected, gaps):
+    """Prints a one-line summary of a file's validation."""
+    if rejected.empty and not gaps:
+        return
+    reasons = rejected["reason"].str.split(";").explode().value_counts().to_dict() if len(rejected) else {}
+    print(f"Validation of {filename}: {len(valid)} valid, {len(rejected)} rejected {reasons}, "
+          f"missing hours {gaps or {}}")
+
+
+def quarantined_files_table(schema):
+    return f'"{schema}".quarantined_files'
+
+
+def mark_fully_quarantined(cursor, filename, rows, schema="WeatherData"):
+    """Records that all `rows` rows of `filename` were quarantined. Does not commit."""
+    table = quarantined_files_table(schema)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            file_name      text        primary key,
+            rows           integer     not null,
+            quarantined_at timestamptz not null default now()
+        );
+    """)
+    cursor.execute(
+        f"INSERT INTO {table} (file_name, rows) VALUES (%s, %s) "
+        f"ON CONFLICT (file_name) DO UPDATE SET rows = EXCLUDED.rows, quarantined_at = now();",
+        (filename, rows),
+    )
+
+
+def fully_quarantined(cursor, filenames, schema="WeatherData"):
+    """The names among `filenames` whose rows were all quarantined."""
+    cursor.execute("SELECT to_regclass(%s);", (quarantined_files_table(schema),))
+    if cursor.fetchone()[0] is None:
+        return set()
+    cursor.execute(f"SELECT file_name FROM {quarantined_files_table(schema)} WHERE file_name = ANY(%s);",
+                   (list(filenames),))
+    return {row[0] for row in cursor.fetchall()}
@@ -1,16 +1,77 @@
-from datetime import datetime
+import argparse
+from datetime import datetime, timedelta
 import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 from awsfuncs import file_exists_in_s3, get_s3_client
+from derived import DERIVED_METRICS, LOOKBACK, compute as compute_derived, previous_day_tail
+from forecasts import ISSUED_AT_COLUMN
+from history import METRIC_COLUMNS
+from lake import (GRID_BOUNDS, GRID_STEP, _write_parquet, decode_object, grid_cells_key, grid_key,
+                  grid_partial_key, grid_spec, read_object, table_grid_spec)
+from meteoclient import SCHEDULER, BudgetExceeded, ScheduledClient, record_response
+from metrics import incr, span
 import openmeteo_requests
 import pandas as pd
 import requests_cache
-from retry_requests import retry
 from dotenv import load_dotenv
 
 load_dotenv()
 
 LAKE_BUCKET = os.getenv("BUCKET_NAME")
 
+# Coordinates per API request of the statewide grid (GRID_BOUNDS and GRID_STEP are in lake.py)
+GRID_BATCH = int(os.getenv("GRID_BATCH", "100"))
+
+def _count_cache_hit(response, *args, **kwargs):
+    # On a miss the hook also fires for the plain response inside requests; only count the cache-aware one
+    if hasattr(response, "from_cache"):
+        incr("http_cache_hits" if response.from_cache else "http_cache_misses")
+    return response
+
+def get_openmeteo_client(cache_name=".cache"):
+    """Returns an Open-Meteo client with request caching, a shared request budget and retries (meteoclient.py)."""
+    cache_session = requests_cache.CachedSession(cache_name, expire_after=3600)
+    cache_session.hooks["response"].extend([_count_cache_hit, record_response])
+    return ScheduledClient(openmeteo_requests.Client(session=cache_session))
+
+def responses_to_dataframe(responses, locations):
+    """Decodes Open-Meteo hourly responses (one per location, same order) into one CSV-shaped DataFrame."""
+    dfs = []
+    for loc, response in zip(locations, responses):
+        hourly = response.Hourly()
+
+        time_range = pd.date_range(
+            start=pd.to_datetime(hourly.Time(), unit="s", utc=True),
+            end=pd.to_datetime(hourly.TimeEnd(), unit="s", utc=True),
+            freq=pd.Timedelta(seconds=hourly.Interval()),
+            inclusive="left",
+        )
+
+        dfs.append(pd.DataFrame({
+            "location_id": loc["location_id"],
+            "time": time_range,
+            "temperature (°F)": hourly.Variables(0).ValuesAsNumpy(),
+            "cloud cover (%)": hourly.Variables(1).ValuesAsNumpy(),
+            "surface pressure (hPa)": hourly.Variables(2).ValuesAsNumpy(),
+            "wind speed (80m elevation) (mph)": hourly.Variables(3).ValuesAsNumpy(),
+            "wind direction (80m elevation) (°)": hourly.Variables(4).ValuesAsNumpy(),
+        }))
+    return pd.concat(dfs, ignore_index=True)
+
+def add_derived_metrics(df, date, bucket_name, s3_client, prefix="", output_dir="data", tail=None):
+    """
+    Appends the DERIVED_METRICS columns, continuing rolling windows from `tail`
+    (earlier rows) or else from the previous day's file.
+    """
+    if not DERIVED_METRICS:
+        return df
+    if tail is None:
+        tail = previous_day_tail(date, bucket_name, s3_client, prefix, output_dir)
+    with span("derive", date=date):
+        return compute_derived(df, tail)
+
 def fetch_and_save_weather_data(date=None, forecast_length=1, past_days=0):
     # Create data folder if it doesn't exist
     os.makedirs("data", exist_ok=True)    
@@ -31,9 +92,7 @@ def fetch_and_save_weather_data(date=None, forecast_length=1, past_days=0):
         return
 
     # Setup request caching and retries
-    cache_session = requests_cache.CachedSession('.cache', expire_after=3600)
-    retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
-    openmeteo = openmeteo_requests.Client(session=retry_session)
+    openmeteo = get_openmeteo_client()
 
     # Define locations
     locations = [
@@ -57,41 +116,19 @@ def fetch_and_save_weather_data(date=None, forecast_length=1, past_days=0):
     }
 
     # Fetch data
-    responses = openmeteo.weather_api(url, params=params)
-
-    all_dataframes = []
-
-    for i, response in enumerate(responses):
-        loc = locations[i]
-        hourly = response.Hourly()
-        hourly_temperature_2m = hourly.Variables(0).ValuesAsNumpy()
-        hourly_cloud_cover = hourly.Variables(1).ValuesAsNumpy()
-        hourly_surface_pressure = hourly.Variables(2).ValuesAsNumpy()
-        hourly_wind_speed_80m = hourly.Variables(3).ValuesAsNumpy()
-        hourly_wind_direction_80m = hourly.Variables(4).ValuesAsNumpy()
-
-        time_range = pd.date_range(
-            start=pd.to_datetime(hourly.Time(), unit="s", utc=True),
-            end=pd.to_datetime(hourly.TimeEnd(), unit="s", utc=True),
-            freq=pd.Timedelta(seconds=hourly.Interval()),
-            inclusive="left"
-        )
-
-        df = pd.DataFrame({
-            "location_id": loc["location_id"],
-            "time": time_range,
-            "temperature (°F)": hourly_temperature_2m,
-            "cloud cover (%)": hourly_cloud_cover,
-            "surface pressure (hPa)": hourly_surface_pressure,
-            "wind speed (80m elevation) (mph)": hourly_wind_speed_80m,
-            "wind direction (80m elevation) (°)": hourly_wind_direction_80m
-        })
-
-        all_dataframes.append(df)
-
-    # Combine and save the DataFrame
-    final_df = pd.concat(all_dataframes, ignore_index=True)
-    final_df.to_csv(output_path, index=False)
+    with span("api_call", date=date):
+        responses = openmeteo.weather_api(url, params=params)
+
+    with span("decode", date=date):
+        final_df = responses_to_dataframe(responses, locations)
+    final_df[ISSUED_AT_COLUMN] = pd.Timestamp.now(tz="UTC").floor("s")
+    final_df = add_derived_metrics(final_df, date, LAKE_BUCKET, get_s3_client())
+
+    # Save the DataFrame
+    with span("csv_encode", date=date):
+        final_df.to_csv(output_path, index=False)
+    incr("rows_fetched", len(final_df))
+    incr("bytes_written", os.path.getsize(output_path), stage="fetch")
     print(f"Weather data saved to '{output_path}'")
 
 ## Test Version below with more options
@@ -103,7 +140,9 @@ def fetch_and_save_weather_data_test(
     bucket_name=None,
     output_dir="data",
     s3_client=None,
-    prefix=""
+    prefix="",
+    openmeteo=None,
+    exact_date=False
 ):
     """
     Fetch weather data and save to local CSV, skipping if already present locally or in S3.
@@ -111,6 +150,12 @@ def fetch_and_save_weather_data_test(
     Priority for bucket resolution:
       1. Explicit bucket_name argument
       2. BUCKET_NAME from environment
+
+    Pass `openmeteo` to reuse an existing client (e.g. across warm Lambda invocations).
+    With `exact_date=True` the API is asked for `date` itself (start_date/end_date)
+    instead of a window relative to today, which is what catch-up runs need. The
+    day before is then fetched in the same request for the rolling derived
+    metrics and dropped before saving, since the catch-up may fetch it later.
     """
     if bucket_name is None:
         bucket_name = os.getenv("BUCKET_NAME")
@@ -139,9 +184,8 @@ def fetch_and_save_weather_data_test(
         return output_path
 
     # Setup request caching and retries
-    cache_session = requests_cache.CachedSession(".cache", expire_after=3600)
-    retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
-    openmeteo = openmeteo_requests.Client(session=retry_session)
+    if openmeteo is None:
+        openmeteo = get_openmeteo_client()
 
     # Locations
     locations = [
@@ -169,35 +213,186 @@ def fetch_and_save_weather_data_test(
         "temperature_unit": "fahrenheit",
         "precipitation_unit": "inch",
     }
+    lookback = exact_date and any(name in LOOKBACK for name in DERIVED_METRICS)
+    if exact_date:
+        del params["forecast_days"], params["past_days"]
+        day_before = (datetime.strptime(date, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+        params["start_date"] = day_before if lookback else date
+        params["end_date"] = date
+
+    with span("api_call", date=date):
+        responses = openmeteo.weather_api(url, params=params)
+
+    with span("decode", date=date):
+        final_df = responses_to_dataframe(responses, locations)
+    tail = None
+    if lookback:
+        # Each location's hours start at local midnight of the day before, 24 per day
+        first = final_df.groupby("location_id")["time"].transform("min")
+        in_day = (final_df["time"] >= first + pd.Timedelta(days=1)).to_numpy()
+        tail, final_df = final_df[~in_day], final_df[in_day].reset_index(drop=True)
+    final_df[ISSUED_AT_COLUMN] = pd.Timestamp.now(tz="UTC").floor("s")
+    final_df = add_derived_metrics(final_df, date, bucket_name, s3_client, prefix, output_dir, tail)
+    with span("csv_encode", date=date):
+        final_df.to_csv(output_path, index=False)
+    incr("rows_fetched", len(final_df))
+    incr("bytes_written", os.path.getsize(output_path), stage="fetch")
+    print(f"Weather data saved to '{output_path}'")
 
-    responses = openmeteo.weather_api(url, params=params)
+    return output_path
 
-    dfs = []
 
+## Statewide grid
+
+def grid_points(bounds=GRID_BOUNDS, step=GRID_STEP):
+    """Cells of a regular lat/lon grid, row-major from the south-west corner: cell, latitude, longitude."""
+    south, west, north, east = bounds
+    lats = south + step * np.arange(int(round((north - south) / step)) + 1)
+    lons = west + step * np.arange(int(round((east - west) / step)) + 1)
+    lat, lon = np.meshgrid(lats, lons, indexing="ij")
+    return pd.DataFrame({
+        "cell": np.arange(lat.size, dtype=np.int32),
+        "latitude": lat.ravel().round(4),
+        "longitude": lon.ravel().round(4),
+    })
+
+def grid_responses_to_table(responses, cells):
+    """
+    Decodes one hourly response per cell (same order, same hours) into an Arrow
+    table of cell, time and float32 metrics, sorted by (cell, time) so a cell's
+    day is one contiguous run for Parquet's row-group statistics.
+    """
+    hourly = responses[0].Hourly()
+    start, interval = hourly.Time(), hourly.Interval()
+    hours = (hourly.TimeEnd() - start) // interval
+    values = np.empty((len(METRIC_COLUMNS), len(responses) * hours), dtype=np.float32)
     for i, response in enumerate(responses):
-        loc = locations[i]
         hourly = response.Hourly()
+        for v in range(len(METRIC_COLUMNS)):
+            values[v, i * hours:(i + 1) * hours] = hourly.Variables(v).ValuesAsNumpy()
 
-        time_range = pd.date_range(
-            start=pd.to_datetime(hourly.Time(), unit="s", utc=True),
-            end=pd.to_datetime(hourly.TimeEnd(), unit="s", utc=True),
-            freq=pd.Timedelta(seconds=hourly.Interval()),
-            inclusive="left",
-        )
-
-        df = pd.DataFrame({
-            "location_id": loc["location_id"],
-            "time": time_range,
-            "temperature (°F)": hourly.Variables(0).ValuesAsNumpy(),
-            "cloud cover (%)": hourly.Variables(1).ValuesAsNumpy(),
-            "surface pressure (hPa)": hourly.Variables(2).ValuesAsNumpy(),
-            "wind speed (80m elevation) (mph)": hourly.Variables(3).ValuesAsNumpy(),
-            "wind direction (80m elevation) (°)": hourly.Variables(4).ValuesAsNumpy(),
-        })
-        dfs.append(df)
+    times = start + interval * np.arange(hours, dtype=np.int64)
+    columns = {
+        "cell": pa.array(np.repeat(np.asarray(cells, dtype=np.int32), hours)),
+        "time": pa.array(np.tile(times, len(responses)), type=pa.timestamp("s", tz="UTC")),
+    }
+    columns.update({m: pa.array(values[v]) for v, m in enumerate(METRIC_COLUMNS)})
+    return pa.table(columns)
 
-    final_df = pd.concat(dfs, ignore_index=True)
-    final_df.to_csv(output_path, index=False)
-    print(f"Weather data saved to '{output_path}'")
+def fetch_grid_weather_data(date=None, bucket_name=None, s3_client=None, prefix="", openmeteo=None,
+                            bounds=GRID_BOUNDS, step=GRID_STEP, batch=GRID_BATCH):
+    """
+    Fetches one day for every cell of the grid and stores it as
+    grid/weather_grid_<date>.parquet, tagged with the grid spec (plus
+    grid/cells_<spec>.parquet, once per spec). Skips days already in S3.
+    Returns the object key.
+
+    Cells go GRID_BATCH coordinates per request; each coordinate counts as one
+    call against the Open-Meteo quota, so a day costs one call per cell: 2,610
+    for the default grid, which the default 600/minute limit spreads over about
+    3.5 minutes. A grid larger than the longest OPENMETEO_LIMITS window (10,000 a
+    day by default) raises BudgetExceeded before any request. When a request
+    fails, the batches fetched so far are kept in grid/partial/ and the next run
+    only fetches the rest.
+    """
+    bucket_name = bucket_name or LAKE_BUCKET
+    s3_client = s3_client or get_s3_client()
+    date = date or datetime.now().strftime("%Y-%m-%d")
+    key = grid_key(date, prefix)
+    if file_exists_in_s3(bucket_name, key, s3_client):
+        print(f"Grid data for {date} already exists in S3. Skipping fetch.")
+        return key
+
+    openmeteo = openmeteo or get_openmeteo_client()
+    cells = grid_points(bounds, step)
+    spec = grid_spec(bounds, step)
+    metadata = {"grid_spec": spec}
+    cells_key = grid_cells_key(spec, prefix)
+    if not file_exists_in_s3(bucket_name, cells_key, s3_client):
+        s3_client.put_object(Bucket=bucket_name, Key=cells_key, Body=_write_parquet(cells))
+
+    # Batches an earlier, failed run already fetched for this grid (cells are fetched in order)
+    partial_key = grid_partial_key(date, prefix)
+    tables = []
+    has_partial = file_exists_in_s3(bucket_name, partial_key, s3_client)
+    if has_partial:
+        partial = decode_object(partial_key, read_object(bucket_name, partial_key, s3_client))
+        if table_grid_spec(partial) == spec:
+            # Parquet hands the second timestamps back as milliseconds
+            time_type = pa.timestamp("s", tz="UTC")
+            partial = partial.set_column(partial.schema.get_field_index("time"), "time",
+                                         partial["time"].cast(time_type))
+            tables.append(partial.replace_schema_metadata(None))
+    start = pc.max(tables[0]["cell"]).as_py() + 1 if tables else 0
+    if start:
+        print(f"Resuming grid fetch for {date} at cell {start} of {len(cells)}.")
+    scheduler = getattr(openmeteo, "scheduler", None)
+    if scheduler is not None and scheduler.buckets:
+        cost = len(cells) - start
+        longest = max(scheduler.buckets, key=lambda b: b.capacity / b.rate)
+        if cost > longest.capacity:
+            raise BudgetExceeded(f"Grid fetch for {date} needs {cost} calls, more than the {longest.name} limit "
+                                 f"of {longest.capacity:g}; use a coarser GRID_STEP or smaller GRID_BOUNDS.")
+        # Past each window's capacity, the rest of the calls go at its refill rate
+        pace = max(max(0.0, cost - b.capacity) / b.rate for b in scheduler.buckets)
+        print(f"Grid fetch for {date}: {cost} calls in batches of {batch}, at least {pace / 60:.0f} min of pacing.")
 
-    return output_path
+    url = "https://api.open-meteo.com/v1/forecast"
+    responses = []
+    try:
+        for first in range(start, len(cells), batch):
+            chunk = cells.iloc[first:first + batch]
+            params = {
+                "latitude": chunk["latitude"].tolist(),
+                "longitude": chunk["longitude"].tolist(),
+                "hourly": ["temperature_2m", "cloud_cover", "surface_pressure", "wind_speed_80m", "wind_direction_80m"],
+                "start_date": date,
+                "end_date": date,
+                "timezone": "auto",
+                "wind_speed_unit": "mph",
+                "temperature_unit": "fahrenheit",
+            }
+            with span("api_call", date=date, cells=len(chunk)):
+                responses.extend(openmeteo.weather_api(url, params=params))
+    except Exception:
+        if responses:
+            table = grid_responses_to_table(responses, cells["cell"].iloc[start:start + len(responses)])
+            table = pa.concat_tables([*tables, table]).replace_schema_metadata(metadata)
+            s3_client.put_object(Bucket=bucket_name, Key=partial_key, Body=_write_parquet(table))
+            print(f"Grid fetch for {date} failed after {start + len(responses)} of {len(cells)} cells; "
+                  f"kept them in s3://{bucket_name}/{partial_key}.")
+        raise
+
+    with span("decode", date=date, cells=len(cells)):
+        if responses:
+            tables.append(grid_responses_to_table(responses, cells["cell"].iloc[start:]))
+        table = pa.concat_tables(tables).replace_schema_metadata(metadata)
+    with span("parquet_encode", date=date):
+        body = _write_parquet(table)
+    with span("s3_put", key=key):
+        s3_client.put_object(Bucket=bucket_name, Key=key, Body=body)
+    if has_partial:
+        s3_client.delete_object(Bucket=bucket_name, Key=partial_key)
+    incr("rows_fetched", table.num_rows)
+    incr("bytes_uploaded", len(body))
+    print(f"Grid data for {date} ({len(cells)} cells, {table.num_rows} rows, {len(body)} bytes) saved to s3://{bucket_name}/{key}")
+    return key
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch weather data outside the daily pipeline.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    grid_parser = sub.add_parser("grid", help="fetch a day of the statewide grid into the lake")
+    grid_parser.add_argument("--date", help="YYYY-MM-DD (default: today)")
+    grid_parser.add_argument("--prefix", default="")
+    args = parser.parse_args()
+
+    SCHEDULER.reset()
+    try:
+        fetch_grid_weather_data(args.date, prefix=args.prefix)
+    finally:
+        SCHEDULER.print_report()
+
+
+if __name__ == "__main__":
+    main()